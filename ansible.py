@@ -1,7 +1,11 @@
+import json
 import logging
+import os
 import sys
+import tempfile
 from tqdm import tqdm
 
+import tracing as trc
 import utils as utl
 from client_config import CLI_CONFIG
 
@@ -31,46 +35,96 @@ def write_ansible_hosts_file(pub_ip, inst_user, ssh_priv_key_path, node_name):
         logger.error(f'Error writing hosts file for ansible\n{exc}')
         print(utl.print_err_str('>>> error writing hosts file for ansible'))
 
+@trc.traced('ansible', label_arg='ans_playbook_name',
+            arg_names=('ans_playbook_name', 'ans_hosts_path', 'forks', 'limit'))
 def run_playbook(ans_playbooks_path,
                  ans_playbook_name,
                  ans_hosts_path,
                  extra_vars=None,
-                 var_name=None):
+                 var_name=None,
+                 forks=None,
+                 limit=None):
     '''
     Run selected ansible playbook on the instance
+    `ansible.cfg` is always passed via `ANSIBLE_CONFIG`, so pipelining,
+    persistent connections and the task timing callback are enabled
 
     Args:
         param1: playbook file path
         param2: playbook file name
-        param3: hosts file path
-        param4: [optional] pass extra var to ansible
-        param5: [optional] pass extra var name to ansible
-    '''
-    if extra_vars is None:
-        logger.info('Running playbooks')
-        tqdm.write('>>> running ansible playbooks')
-        try:
-            utl.run_cmd('ANSIBLE_HOST_KEY_CHECKING=False '
-                        f'ansible-playbook '
-                        f'{ans_playbooks_path}{ans_playbook_name} -i '
-                        f'{ans_hosts_path} >> {CLI_CONFIG["pcli_log_path"]} 2>&1')
-        except Exception as exc:
-            logger.error(f'error while running ansible {ans_playbook_name} playbook:\n{exc}')
-            print(f'>>> error while running ansible {ans_playbook_name} playbook')
-            sys.exit(1)
-    else:
-        logger.info('Running playbooks')
-        tqdm.write('>>> running ansible playbooks')
-        try:
-            utl.run_cmd('ANSIBLE_HOST_KEY_CHECKING=False '
-                        f'ansible-playbook '
-                        f'{ans_playbooks_path}{ans_playbook_name} -i '
-                        f'{ans_hosts_path} --extra-vars "{var_name}={extra_vars}" '
-                        f'>> {CLI_CONFIG["pcli_log_path"]} 2>&1')
-        except Exception as exc:
-            logger.error(f'error while running ansible {ans_playbook_name} playbook')
-            print(f'>>> error while running ansible {ans_playbook_name} playbook')
-            sys.exit(1)
+        param3: hosts file (or dynamic inventory script) path
+        param4: [optional] pass extra var to ansible (or dict of extra vars)
+        param5: [optional] pass extra var name to ansible (if param4 is not a dict)
+        param6: [optional] max hosts configured at the same time
+        param7: [optional] comma-separated hosts to run on (default all)
+    '''
+    ans_argv = ['ansible-playbook', f'{ans_playbooks_path}{ans_playbook_name}',
+                '-i', ans_hosts_path]
+    if forks is not None:
+        ans_argv += ['--forks', str(forks)]
+    if limit is not None:
+        ans_argv += ['--limit', limit]
+    vars_path = None
+    if extra_vars is not None:
+        if not isinstance(extra_vars, dict):
+            extra_vars = {var_name: extra_vars}
+        # passed as a file (readable by the owner only), not on the command line
+        vars_fd, vars_path = tempfile.mkstemp(prefix='pcli-vars-', suffix='.json')
+        with os.fdopen(vars_fd, 'w') as f_vars:
+            json.dump(extra_vars, f_vars)
+        ans_argv += ['--extra-vars', f'@{vars_path}']
+    logger.info('Running playbooks')
+    tqdm.write('>>> running ansible playbooks')
+    try:
+        res = utl.run_argv(ans_argv,
+                           env=dict(os.environ,
+                                    ANSIBLE_CONFIG=CLI_CONFIG['ans_cfg_path'],
+                                    ANSIBLE_HOST_KEY_CHECKING='False'),
+                           on_line=utl.line_logger(f'ansible {ans_playbook_name}'))
+        if res['rc'] != 0:
+            raise RuntimeError(f'ansible-playbook {ans_playbook_name} failed '
+                               f'(exit code {res["rc"]})\n'
+                               + '\n'.join(res['output'].splitlines()[-20:]))
+    except Exception as exc:
+        logger.error(f'error while running ansible {ans_playbook_name} playbook:\n{exc}')
+        print(f'>>> error while running ansible {ans_playbook_name} playbook')
+        sys.exit(1)
+    finally:
+        if vars_path is not None:
+            os.remove(vars_path)
+
+def inventory_script_path():
+    '''
+    Return the fleet dynamic inventory script path (see `inventory.py`)
+
+    Args:
+        return: inventory script path
+    '''
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'inventory.py')
+
+def fleet_playbook(playbook_name, pnode_rel_url, node_names=None, forks=None):
+    '''
+    Apply a playbook to many nodes in a single parallel ansible run, using
+    the dynamic inventory built from the nodes terraform states
+
+    Args:
+        param1: playbook file name
+        param2: release-server url (prod or dev - based on `--dev` arg)
+        param3: [optional] node names list (default every node)
+        param4: [optional] max nodes configured at the same time
+    '''
+    logger.info(f'Deploying {playbook_name} ansible playbook on '
+                f'{"all nodes" if node_names is None else node_names}')
+    print(f'>>> deploying {playbook_name} ansible playbook on '
+          f'{"all nodes" if node_names is None else ", ".join(node_names)}')
+    run_playbook(CLI_CONFIG['ans_playbooks_path'],
+                 playbook_name,
+                 inventory_script_path(),
+                 extra_vars={'pnode_rel_url': pnode_rel_url},
+                 forks=forks,
+                 limit=None if node_names is None else ','.join(node_names))
+    print(utl.print_ok_str(f'>>> {playbook_name} applied - task timings in '
+                           f'{CLI_CONFIG["pcli_log_path"]}'))
 
 def sys_config(node_name):
     '''
@@ -119,3 +173,35 @@ def edit_inst_user_pwd(node_name, pwd):
                  hosts_path,
                  extra_vars=pwd,
                  var_name='new_pwd')
+
+def bootstrap_node(node_name, pwd, pnode_rel_url, iam_cred_src):
+    '''
+    Run the whole node bootstrap (sys_config, edit_user_pwd, credentials,
+    reboot, pnode_package) as a single ansible-playbook run, over one
+    pipelined and persistent ssh connection
+    Per-task timings are reported in the pcli log (profile_tasks callback)
+    A missing operator IAM credentials file is reported and its copy skipped
+
+    Args:
+        param1: node name
+        param2: user password
+        param3: release-server url (prod or dev - based on `--dev` arg)
+        param4: local operator IAM credentials file path (absolute)
+    '''
+    if not os.path.isfile(iam_cred_src):
+        logger.warning(f'{node_name}: {iam_cred_src} not found, IAM credentials not copied')
+        tqdm.write(utl.print_err_str(f'>>> {node_name}: operator IAM credentials not found, '
+                                     'not copied on the node'))
+        iam_cred_src = ''
+    logger.info('Deploying bootstrap ansible playbook')
+    tqdm.write('>>> deploying bootstrap ansible playbook')
+    hosts_path = f'{CLI_CONFIG["ans_hosts_path"]}-{node_name}'
+    run_playbook(CLI_CONFIG['ans_playbooks_path'],
+                 'bootstrap.yml',
+                 hosts_path,
+                 extra_vars={'new_pwd': pwd,
+                             'node_cred_path': CLI_CONFIG['inst_cred_path'],
+                             'iam_cred_src': iam_cred_src,
+                             'iam_cred_dest': CLI_CONFIG['iam_cred_path'],
+                             'pnode_rel_url': pnode_rel_url})
+    tqdm.write(f'>>> bootstrap task timings in {CLI_CONFIG["pcli_log_path"]}')
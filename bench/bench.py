@@ -0,0 +1,260 @@
+import argparse
+import datetime
+import http.server
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+import utils as utl
+
+
+# provisioning prompts: region (Ireland), then empty aws keys (template defaults)
+PROVISIONING_INPUT = '4\n' + '\n' * 8
+
+class BridgePingHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Stand-in bridge api (and dashboard): every GET answers 200
+    '''
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '4')
+        self.end_headers()
+        self.wfile.write(b'pong')
+
+    def log_message(self, *args):
+        pass
+
+def start_bridge_server():
+    '''
+    Start the stand-in bridge api on a free local port
+
+    Args:
+        return: listening port
+    '''
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), BridgePingHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+def start_ssh_listener():
+    '''
+    Start a local listener standing in for the nodes ssh port (the readiness
+    port check only needs the tcp handshake)
+
+    Args:
+        return: listening port
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+
+    def accept_loop():
+        while True:
+            conn, _ = sock.accept()
+            conn.close()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return sock.getsockname()[1]
+
+def setup_root(bench_root, nodes_nr=0):
+    '''
+    Create a pcli sandbox (config templates, playbooks, log) w/ `nodes_nr`
+    already provisioned nodes (canned tfstate)
+
+    Args:
+        param1: sandbox dir
+        param2: [optional] number of existing nodes
+    '''
+    shutil.rmtree(bench_root, ignore_errors=True)
+    for sub_dir in ('etc/.pcli/ssh', 'etc/ansible/playbooks', 'home', 'log', 'ssh'):
+        os.makedirs(os.path.join(bench_root, sub_dir))
+    shutil.copytree(os.path.join(REPO_DIR, 'config', 'terraform'),
+                    os.path.join(bench_root, 'etc', 'terraform'))
+    shutil.copy(os.path.join(REPO_DIR, 'config', 'ansible', 'ansible.cfg'),
+                os.path.join(bench_root, 'etc', 'ansible'))
+    for playbook in os.listdir(os.path.join(REPO_DIR, 'config', 'ansible', 'playbooks')):
+        shutil.copy(os.path.join(REPO_DIR, 'config', 'ansible', 'playbooks', playbook),
+                    os.path.join(bench_root, 'etc', 'ansible', 'playbooks'))
+    tf_state = os.path.join(BENCH_DIR, 'fixtures', 'terraform.tfstate')
+    for node_nr in range(nodes_nr):
+        node_dir = os.path.join(bench_root, 'etc', 'terraform', f'node-{node_nr:04d}')
+        os.mkdir(node_dir)
+        shutil.copy(tf_state, node_dir)
+
+def benchmarks(node_counts):
+    '''
+    Return the benchmarks to run
+
+    Args:
+        param1: node counts for `node list`
+        return: list of (name, existing nodes, pcli args, stdin, fresh sandbox per run)
+    '''
+    benches = [(f'node list ({n} nodes)', n, ['node', 'list'], None, False)
+               for n in node_counts]
+    benches += [
+        ('node exec (1 node)', 1, ['node', 'exec', 'uptime', '-n', 'node-0000'], None, False),
+        ('node exec --all (10 nodes)', 10, ['node', 'exec', 'uptime', '--all'], None, False),
+        ('node status --all (10 nodes)', 10, ['node', 'status', '--all'], None, False),
+        ('node metrics collect (10 nodes)', 10, ['node', 'metrics', 'collect'], None, False),
+        ('node update --all (10 nodes)', 10,
+         ['node', 'update', '--all', '--batch-size', '3'], None, False),
+        ('bridge restart all', 1, ['bridge', 'restart', 'all', '-n', 'node-0000'], None, False),
+        ('node provisioning', 0, ['node', 'provisioning'], PROVISIONING_INPUT, True),
+        ('node provisioning --count 5', 0,
+         ['node', 'provisioning', '--count', '5', '--parallel', '5'], PROVISIONING_INPUT, True)]
+    return benches
+
+def run_bench(bench, runs, env, work_dir):
+    '''
+    Time `runs` executions of a pcli command in the sandbox
+
+    Args:
+        param1: benchmark tuple (see `benchmarks`)
+        param2: number of timed runs
+        param3: environment (fake binaries on PATH, sandbox vars)
+        param4: working dir
+        return: dict w/ median/min/max seconds and failed runs
+    '''
+    name, nodes_nr, pcli_args, stdin, fresh = bench
+    bench_root = env['PCLI_BENCH_ROOT']
+    durations = []
+    failed = 0
+    for run_nr in range(runs):
+        if run_nr == 0 or fresh is True:
+            setup_root(bench_root, nodes_nr)
+        start_time = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.join(BENCH_DIR, 'run_pcli.py')]
+                              + pcli_args,
+                              input=stdin, text=True, env=env, cwd=work_dir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        durations.append(time.perf_counter() - start_time)
+        if proc.returncode != 0:
+            failed += 1
+            print(f'>>> {name}: run {run_nr + 1} failed (exit code {proc.returncode})\n'
+                  f'{proc.stderr.strip()[-2000:]}')
+    return {'median': round(statistics.median(durations), 4),
+            'min': round(min(durations), 4),
+            'max': round(max(durations), 4),
+            'failed': failed}
+
+def git_commit():
+    '''
+    Return the current commit (`-dirty` if the tree has local changes)
+
+    Args:
+        return: commit id (`None` if not a git checkout)
+    '''
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=REPO_DIR, stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous_record(results_path, latency):
+    '''
+    Return the last recorded run w/ the same fake binaries latency
+
+    Args:
+        param1: results file path
+        param2: latency in seconds
+        return: record dict (`None` if not found)
+    '''
+    if not os.path.isfile(results_path):
+        return None
+    prev = None
+    with open(results_path) as f_results:
+        for line in f_results:
+            record = json.loads(line)
+            if record['latency'] == latency:
+                prev = record
+    return prev
+
+def print_results(record, prev):
+    '''
+    Print median/min/max per benchmark and the change vs the previous record
+
+    Args:
+        param1: current record
+        param2: previous record (or `None`)
+    '''
+    name_width = max(len(name) for name in record['results'])
+    print(f'>>> pcli {record["version"]} ({record["commit"]}) - '
+          f'latency {record["latency"]}s - {record["runs"]} runs')
+    if prev is not None:
+        print(f'>>> compared to {prev["version"]} ({prev["commit"]}) of {prev["date"]}')
+    for name, res in record['results'].items():
+        line = (f'>>> {name:<{name_width}}  median {res["median"]:8.3f}s  '
+                f'min {res["min"]:8.3f}s  max {res["max"]:8.3f}s')
+        if prev is not None and name in prev['results']:
+            prev_median = prev['results'][name]['median']
+            line += f'  {(res["median"] - prev_median) / prev_median * 100:+6.1f}%'
+        if res['failed']:
+            line += f'  ({res["failed"]} failed)'
+            line = utl.print_err_str(line)
+        print(line)
+
+def main():
+    '''
+    Run the pcli benchmarks against stand-in terraform, ssh, scp and
+    ansible-playbook binaries, then append the results to the results file
+    '''
+    parser = argparse.ArgumentParser('bench')
+    parser.add_argument('--runs', type=int, default=5, metavar='',
+                        help='timed runs per benchmark (default: 5)')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='',
+                        help='seconds every fake binary call takes (default: 0)')
+    parser.add_argument('--nodes', default='1,10,100,1000', metavar='',
+                        help='node counts for `node list` (default: 1,10,100,1000)')
+    parser.add_argument('-k', metavar='', dest='filter',
+                        help='run only the benchmarks whose name contains this string')
+    parser.add_argument('-o', default=os.path.join(BENCH_DIR, 'results.jsonl'), metavar='',
+                        dest='results_path',
+                        help='results file (one json record per run, appended)')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='pcli-bench-')
+    env = dict(os.environ,
+               PATH=f'{os.path.join(BENCH_DIR, "bin")}{os.pathsep}{os.environ["PATH"]}',
+               PCLI_BENCH_LATENCY=str(args.latency),
+               PCLI_BENCH_ROOT=os.path.join(work_dir, 'root'),
+               PCLI_BENCH_SSH_PORT=str(start_ssh_listener()),
+               PCLI_BENCH_BRIDGE_PORT=str(start_bridge_server()),
+               ACCESS_KEY_ID='bench',
+               SECRET_ACCESS_KEY='bench')
+    results = {}
+    try:
+        for bench in benchmarks([int(n) for n in args.nodes.split(',')]):
+            if args.filter and args.filter not in bench[0]:
+                continue
+            print(f'>>> running: {bench[0]}')
+            results[bench[0]] = run_bench(bench, args.runs, env, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    record = {'version': utl.__version__,
+              'commit': git_commit(),
+              'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'latency': args.latency,
+              'runs': args.runs,
+              'results': results}
+    print_results(record, previous_record(args.results_path, args.latency))
+    with open(args.results_path, 'a') as f_results:
+        f_results.write(json.dumps(record) + '\n')
+    print(f'>>> results appended to {args.results_path}')
+    if any(res['failed'] for res in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
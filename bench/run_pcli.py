@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from client_config import CLI_CONFIG
+
+
+# pcli paths -> benchmark root subdir
+PATH_MAP = {'/etc/pcli/': 'etc/',
+            '/var/log/pcli/': 'log/',
+            '~/.ssh/pcli/': 'ssh/',
+            '/home/ec2-user/': 'home/'}
+
+def sandbox_config(bench_root):
+    '''
+    Point every pcli local path into the benchmark root, and the ssh,
+    bridge and dashboard checks to the harness local listeners
+
+    Args:
+        param1: benchmark root dir
+    '''
+    for key, value in CLI_CONFIG.items():
+        if not isinstance(value, str):
+            continue
+        for orig_path, bench_path in PATH_MAP.items():
+            if value.startswith(orig_path):
+                CLI_CONFIG[key] = os.path.join(bench_root, bench_path, value[len(orig_path):])
+    CLI_CONFIG['ssh_port'] = int(os.environ['PCLI_BENCH_SSH_PORT'])
+    CLI_CONFIG['bridge_api_port'] = int(os.environ['PCLI_BENCH_BRIDGE_PORT'])
+    CLI_CONFIG['dashboard_port'] = int(os.environ['PCLI_BENCH_BRIDGE_PORT'])
+
+def main():
+    '''
+    Run pcli (same args) inside the benchmark sandbox
+    '''
+    sandbox_config(os.environ['PCLI_BENCH_ROOT'])
+    import cli
+    sys.argv[0] = 'pcli'
+    cli.main()
+
+if __name__ == '__main__':
+    main()
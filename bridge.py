@@ -1,31 +1,105 @@
 import logging
+import shlex
 import sys
+import threading
+import time
 
 import utils as utl
 
 
 logger = logging.getLogger(__name__)
 
+BRIDGE_COMPONENTS = ('api', 'syncer_native', 'syncer_host')
+
+def bridge_cmd(action, components):
+    '''
+    Return the remote command running a bridge action on every component
+    in a single ssh session (every component is tried, the exit code is
+    the last failed one)
+
+    Args:
+        param1: bridge action
+        param2: components list (`['all']` for the whole bridge)
+        return: remote command
+    '''
+    if components == ['all']:
+        return f'ptokens_bridge {action}'
+    if len(components) == 1:
+        return f'ptokens_bridge {action} {shlex.quote(components[0])}'
+    comps_str = ' '.join(shlex.quote(comp) for comp in components)
+    return (f'rc=0; for comp in {comps_str}; do '
+            f'ptokens_bridge {action} "$comp" || rc=$?; done; exit $rc')
+
+def staggered(func, stagger):
+    '''
+    Wrap `func(node_name)` so that consecutive calls start at least
+    `stagger` seconds apart, whatever the pool size
+
+    Args:
+        param1: function to wrap
+        param2: seconds between two starts
+        return: wrapped function
+    '''
+    lock = threading.Lock()
+    next_start = [time.monotonic()]
+
+    def wrapper(node_name):
+        with lock:
+            start_at = max(next_start[0], time.monotonic())
+            next_start[0] = start_at + stagger
+        time.sleep(max(0, start_at - time.monotonic()))
+        return func(node_name)
+    return wrapper
+
 def bridge_mng(args):
     '''
     Manage the bridge commands:
-    - start, stop, restart and deploy (single/all) container/s by node-name
-    (and bridge name if not `all`)
+    - start, stop, restart and deploy the whole bridge (`all`)
+    - start_single, stop_single and restart_single one or more components
+      (comma-separated, ie: `syncer_host,syncer_native`)
+    on one node (`-n`), or on many (comma-separated `-n`, or `--all`) at most
+    `--parallel` at a time, every start `--stagger` seconds apart
 
     Args:
         param1: cli args
     '''
-    if args.action[0] in ('start', 'restart', 'stop', 'deploy') and args.bridge_comp[0] == 'all':
-        cmd = f'ptokens_bridge {args.action[0]}'
-        utl.run_remote_cmd(cmd, args.node_name)
-    elif args.action[0] in ('start_single',
-                            'restart_single',
-                            'stop_single') and args.bridge_comp[0] != 'all':
-        cmd = f'ptokens_bridge {args.action[0]} {args.bridge_comp[0]}'
-        utl.run_remote_cmd(cmd, args.node_name)
-    elif args.action[0] in ('start_single',
-                            'restart_single',
-                            'stop_single') and args.bridge_comp[0] is None:
+    components = list(dict.fromkeys(c.strip() for c in args.bridge_comp[0].split(',')
+                                    if c.strip()))
+    if not components:
+        logger.error('Missing component name')
+        print(utl.print_err_str('>>> the following arguments are required: component name'))
+        sys.exit(1)
+    unknown = [comp for comp in components if comp not in BRIDGE_COMPONENTS + ('all',)]
+    if unknown:
+        logger.error(f'Unexpected component: {", ".join(unknown)}')
+        print(utl.print_err_str(f'>>> unexpected component: {", ".join(unknown)} - choose '
+                                f'from: {", ".join(BRIDGE_COMPONENTS + ("all",))}'))
+        sys.exit(1)
+    if args.action[0] in ('start', 'restart', 'stop', 'deploy') and components != ['all']:
+        logger.error(f'{args.action[0]} works on the whole bridge only: component `all`')
+        print(f'>>> error - {args.action[0]} works on the whole bridge only: use `all` or '
+              f'{args.action[0]}_single')
+        sys.exit(1)
+    if args.action[0] in ('start_single', 'restart_single', 'stop_single') and 'all' in components:
         logger.error('The following arguments are required: component name')
         print('>>> the following arguments are required: component name')
         sys.exit(1)
+    if args.all_nodes is False and args.node_name is None:
+        logger.error('The following arguments are required: node name (or --all)')
+        print('>>> the following arguments are required: -n (or --all)')
+        sys.exit(1)
+    cmd = bridge_cmd(args.action[0], components)
+    if args.all_nodes is False and ',' not in args.node_name:
+        utl.run_remote_cmd(cmd, args.node_name)
+        return
+    import fleet
+    node_names = utl.select_nodes(args)
+    logger.info(f'Running {cmd} on {len(node_names)} nodes')
+    print(f'>>> {args.action[0]} {", ".join(components)} on {len(node_names)} nodes')
+    results = utl.run_parallel(staggered(lambda n: utl.run_remote_cmd(cmd, n, result=True),
+                                         args.stagger),
+                               node_names,
+                               args.parallel)
+    fleet.print_exec_results(results)
+    if any(isinstance(r, Exception) or r is None or r['rc'] != 0 for r in results.values()):
+        sys.exit(1)
@@ -1,20 +1,16 @@
 import argparse
+import importlib
 import logging
-import logging.config
 
-import bridge as brg
-import node
 import utils as utl
 from client_config import CLI_CONFIG
 
 
-def main():
+def configure_logging():
     '''
-    Start pCLI, initialize logger and argparse
+    Initialize logger (pcli log file)
     '''
-
-    logger = logging.getLogger(__name__)
-
+    import logging.config
     logging.config.dictConfig({
         'version': 1,
         'disable_existing_loggers': False,
@@ -42,13 +38,26 @@ def main():
         }
         })
 
+def build_parser():
+    '''
+    Build the argparse parser
+    Commands are referenced as `module.function` strings and imported only
+    once selected (see `resolve_func`), so that parsing costs no import
+
+    Args:
+        return: argparse parser
+    '''
     parser = argparse.ArgumentParser('pcli')
     parser.add_argument('-v', action='version', version=utl.__version__)
+    parser.add_argument('--trace',
+                        metavar='',
+                        dest='trace_path',
+                        help='write a timeline of the run (Chrome trace-event format)')
     subparsers = parser.add_subparsers(dest='command')
     subparsers.required = True
 
     p_bridge_commands = subparsers.add_parser('bridge', help='interact with bridge\'s components')
-    p_bridge_commands.set_defaults(func=brg.bridge_mng)
+    p_bridge_commands.set_defaults(func='bridge.bridge_mng')
     p_bridge_commands.add_argument(nargs=1,
                                    choices=['start', 'stop', 'restart',
                                             'deploy', 'start_single', 'stop_single',
@@ -56,25 +65,40 @@ def main():
                                    dest='action',
                                    help='specify action')
     p_bridge_commands.add_argument(nargs=1,
-                                   choices=['api',
-                                            'syncer_native',
-                                            'syncer_host',
-                                            'all'],
+                                   metavar='component',
                                    dest='bridge_comp',
-                                   help='specify component')
+                                   help='specify component: api, syncer_native, syncer_host '
+                                        'or all (comma-separated list for `*_single`)')
     p_bridge_commands.add_argument('-n',
-                                   required=True,
                                    metavar='',
                                    dest='node_name',
-                                   help='select node')
+                                   help='select node (comma-separated list for many)')
+    p_bridge_commands.add_argument('--all',
+                                   action='store_true',
+                                   dest='all_nodes',
+                                   help='select all nodes')
+    p_bridge_commands.add_argument('--parallel',
+                                   type=int,
+                                   default=CLI_CONFIG['fleet_parallel'],
+                                   metavar='',
+                                   dest='parallel',
+                                   help='max nodes to work on at the same time '
+                                        f'(default: {CLI_CONFIG["fleet_parallel"]})')
+    p_bridge_commands.add_argument('--stagger',
+                                   type=float,
+                                   default=0,
+                                   metavar='SECS',
+                                   dest='stagger',
+                                   help='min seconds between two node starts (default: 0)')
 
     p_node = subparsers.add_parser('node',
                                    help='interact with nodes')
-    p_node.set_defaults(func=node.node_mng)
+    p_node.set_defaults(func='node.node_mng')
     p_node.add_argument('-n',
                         metavar='',
                         dest='node_name',
-                        help='node name')
+                        help='node name (comma-separated list for `exec`, `logs`, `metrics`, '
+                             '`playbook`, `status` and `update`)')
     p_node.add_argument('-p',
                         nargs='+',
                         metavar='',
@@ -88,6 +112,72 @@ def main():
                         metavar='',
                         dest='exec_script',
                         help='run script on node')
+    p_node.add_argument('--all',
+                        action='store_true',
+                        dest='all_nodes',
+                        help='select all nodes (`exec`, `logs`, `metrics`, `playbook`, `status` '
+                             'and `update` only)')
+    p_node.add_argument('--parallel',
+                        type=int,
+                        default=CLI_CONFIG['fleet_parallel'],
+                        metavar='',
+                        dest='parallel',
+                        help='max nodes to work on at the same time '
+                             f'(default: {CLI_CONFIG["fleet_parallel"]})')
+    p_node.add_argument('--forks',
+                        type=int,
+                        default=CLI_CONFIG['ans_forks'],
+                        metavar='',
+                        dest='forks',
+                        help='max nodes configured at the same time by ansible '
+                             f'(`playbook` only - default: {CLI_CONFIG["ans_forks"]})')
+    p_node.add_argument('--batch-size',
+                        type=int,
+                        default=CLI_CONFIG['rolling_batch_size'],
+                        metavar='',
+                        dest='batch_size',
+                        help='nodes updated at the same time after the canary '
+                             f'(`update` on many nodes only - default: '
+                             f'{CLI_CONFIG["rolling_batch_size"]})')
+    p_node.add_argument('--canary',
+                        type=int,
+                        default=1,
+                        metavar='',
+                        dest='canary',
+                        help='nodes updated (and checked) before the others '
+                             '(`update` on many nodes only - default: 1)')
+    p_node.add_argument('--count',
+                        type=int,
+                        default=1,
+                        metavar='',
+                        dest='count',
+                        help='number of nodes to create (`provisioning` only)')
+    p_node.add_argument('--resume',
+                        metavar='',
+                        dest='resume_node',
+                        help='resume a failed provisioning of the given node')
+    p_node.add_argument('--region',
+                        metavar='',
+                        dest='region',
+                        help='only the nodes in this region (`list` only)')
+    p_node.add_argument('--type',
+                        metavar='',
+                        dest='inst_type',
+                        help='only the nodes of this instance type (`list` only)')
+    p_node.add_argument('--sort',
+                        choices=['name', 'created', 'ip', 'region', 'type', 'last_seen'],
+                        default='name',
+                        dest='sort_key',
+                        help='sort key (`list` only - default: name)')
+    p_node.add_argument('--watch',
+                        type=float,
+                        metavar='SECS',
+                        dest='watch_secs',
+                        help='redraw every SECS seconds (`status` only)')
+    p_node.add_argument('--since',
+                        metavar='',
+                        dest='since',
+                        help='time window, ie: 90m, 24h, 7d (`metrics show` only - default: 24h)')
     p_node.add_argument('--dev',
                         action='store_true',
                         dest='dev_mode',
@@ -97,21 +187,71 @@ def main():
                                  'destroy',
                                  'exec',
                                  'list',
+                                 'logs',
+                                 'metrics',
+                                 'playbook',
                                  'provisioning',
+                                 'reindex',
                                  'ssh',
+                                 'status',
                                  'update'],
                         dest='action',
                         help='specify action')
     p_node.add_argument(nargs='?',
                         metavar='',
                         dest='cmd_to_exec',
-                        help='run cmd on node')
+                        help='run cmd on node (playbook name for `playbook`, '
+                             '`pull` for `logs`, `collect` or `show` for `metrics`)')
+
+    p_providers = subparsers.add_parser('providers',
+                                        help='manage the shared terraform provider cache')
+    p_providers.set_defaults(func='terraform.providers_mng')
+    p_providers.add_argument(nargs=1,
+                             choices=['seed', 'status'],
+                             dest='action',
+                             help='specify action')
+    p_providers.add_argument('-f',
+                             metavar='',
+                             dest='tarball_path',
+                             help='seed from an offline mirror tarball')
 
     p_update = subparsers.add_parser('update', help='update pCLI')
-    p_update.set_defaults(func=utl.check_for_pcli_updates)
+    p_update.set_defaults(func='utils.check_for_pcli_updates')
+    return parser
+
+def resolve_func(func_spec):
+    '''
+    Import the selected command module and return its function
+
+    Args:
+        param1: `module.function` string
+        return: command function
+    '''
+    module_name, func_name = func_spec.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+def main():
+    '''
+    Start pCLI, parse args, then initialize logger and run the selected command
+    '''
+
+    logger = logging.getLogger(__name__)
 
-    args = parser.parse_args()
-    args.func(args)
+    args = build_parser().parse_args()
+    configure_logging()
+    func = resolve_func(args.func)
+    if args.trace_path is None:
+        func(args)
+        return
+    import tracing as trc
+    trc.enable()
+    try:
+        with trc.span(f'pcli {args.command}', 'pcli'):
+            func(args)
+    finally:
+        utl.write_file(trc.trace_events(), args.trace_path, json_f=True)
+        logger.info(f'Trace written in {args.trace_path}')
+        print(f'>>> trace written in {args.trace_path}')
 
 if __name__ == '__main__':
     main()
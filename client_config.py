@@ -1,12 +1,25 @@
 CLI_CONFIG = {
+    'ans_bootstrap': True,
+    'ans_cfg_path': '/etc/pcli/ansible/ansible.cfg',
+    'ans_fleet_playbooks': ['pnode_package.yml', 'sys_config.yml'],
+    'ans_forks': 20,
     'ans_hosts_path': '/etc/pcli/ansible/hosts',
     'ans_playbooks_path': '/etc/pcli/ansible/playbooks/',
     'ans_root': '/etc/pcli/ansible/',
+    'bridge_api_port': 4242,
+    'bridge_endpoints': ['pbtc-on-eth'],
+    'dashboard_port': 8080,
+    'fleet_parallel': 10,
+    'http_timeout': (3.05, 10),
     'iam_cred_path': '/home/ec2-user/.iam_credentials',
     'inst_config_path': '/etc/pcli/terraform/inst_config.json',
     'inst_cred_path': '/etc/pnode/data/.node-cred',
     'inst_user': 'ec2-user',
-    'inst_state_path': '/etc/pcli/.pcli/inst-state.pickle',
+    'inst_state_path': '/etc/pcli/.pcli/inst-state.json',
+    'logs_gzip_level': 6,
+    'logs_mirror_path': '/etc/pcli/logs/',
+    'metrics_path': '/etc/pcli/metrics/',
+    'metrics_spark_width': 40,
     'pcli_config_path': '/etc/pcli/.pcli/',
     'pcli_log_path': '/var/log/pcli/pcli.log',
     'pcli_ssh_key_path': '~/.ssh/pcli/',
@@ -14,9 +27,27 @@ CLI_CONFIG = {
     'pnetwork_pcli_url': 'https://release-server.nsw.p.network/pcli/',
     'pnetwork_pnode_url': 'https://release-server.nsw.p.network/pnode/rpm/',
     'pnetwork_pnode_url_dev': 'https://release-server.nsw.p.network/dev/pnode/rpm',
+    'pnode_logs_path': '/pnode-logs/',
+    'ready_bridge_timeout': 1800,
+    'ready_enclave_timeout': 900,
+    'ready_reboot_timeout': 900,
+    'ready_ssh_timeout': 600,
+    'registry_path': '/etc/pcli/.pcli/registry.db',
+    'rolling_batch_size': 5,
+    'rolling_health_timeout': 600,
+    'run_tail_lines': 200,
+    'ssh_control_path': '/etc/pcli/.pcli/ssh/',
+    'ssh_control_persist': '10m',
+    'ssh_port': 22,
+    'status_cache_ttl': 10,
+    'status_timeout': 2,
+    'tf_cli_config_path': '/etc/pcli/.pcli/terraformrc',
     'tf_config_dir': '/etc/pcli/terraform/',
     'tf_main_orig_path': '/etc/pcli/terraform/main.tf.orig',
+    'tf_mirror_providers': ['registry.terraform.io/hashicorp/*'],
     'tf_output_orig_path': '/etc/pcli/terraform/output.tf.orig',
+    'tf_plugin_cache_path': '/etc/pcli/.pcli/terraform-plugins/',
+    'tf_provider_mirror_path': '/etc/pcli/.pcli/terraform-mirror/',
     'tf_state_path': '/etc/pcli/terraform/',
     'tf_variables_orig_path': '/etc/pcli/terraform/variables.tf.json.orig'
 }
@@ -0,0 +1,272 @@
+import logging
+import sys
+import time
+
+import ansible as ans
+import readiness as rdy
+import registry as reg
+import utils as utl
+from client_config import CLI_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+def group_results(results):
+    '''
+    Group nodes by identical result (exit code and output)
+
+    Args:
+        param1: dict node name -> result dict (or exception)
+        return: list of (exit code, output, node names), biggest group first
+    '''
+    groups = {}
+    for node_name, res in results.items():
+        if isinstance(res, Exception) or res is None:
+            key = (None, str(res))
+        else:
+            key = (res['rc'], res['output'])
+        groups.setdefault(key, []).append(node_name)
+    return sorted(((rc, out, sorted(nodes)) for (rc, out), nodes in groups.items()),
+                  key=lambda group: (-len(group[2]), group[2][0]))
+
+def print_exec_results(results):
+    '''
+    Print exit code and duration per node, then every distinct output once
+    w/ the number of nodes which returned it
+
+    Args:
+        param1: dict node name -> result dict (or exception)
+    '''
+    name_width = max(len(n) for n in list(results) + ['node'])
+    print(f'>>> {"node":<{name_width}}  exit code  duration')
+    for node_name in sorted(results):
+        res = results[node_name]
+        if isinstance(res, Exception) or res is None:
+            print(utl.print_err_str(f'>>> {node_name:<{name_width}}  {"error":<9}  -'))
+            continue
+        line = f'>>> {node_name:<{name_width}}  {str(res["rc"]):<9}  {res["duration"]:.2f}s'
+        print(line if res['rc'] == 0 else utl.print_err_str(line))
+    for rc, out, nodes in group_results(results):
+        nodes_str = ', '.join(nodes)
+        print(f'\n>>> {len(nodes)} node(s) - exit code {rc if rc is not None else "error"}: '
+              f'{nodes_str}')
+        if out:
+            print(out)
+
+def exec_on_nodes(args, node_names):
+    '''
+    Run command (or `-s` script) on several nodes at once, at most
+    `--parallel` nodes at a time, and print the aggregated results
+    Exit w/ error if the command failed on at least one node
+
+    Args:
+        param1: CLI args
+        param2: node names list
+    '''
+    if args.exec_script:
+        logger.info(f'Running script {args.exec_script} on {len(node_names)} nodes')
+        print(f'>>> running script {args.exec_script} on {len(node_names)} nodes')
+        results = utl.run_parallel(lambda n: utl.run_remote_script(args.exec_script, n,
+                                                                   result=True),
+                                   node_names,
+                                   args.parallel)
+    else:
+        logger.info(f'Running command {args.cmd_to_exec} on {len(node_names)} nodes')
+        print(f'>>> running command {args.cmd_to_exec} on {len(node_names)} nodes')
+        results = utl.run_parallel(lambda n: utl.run_remote_cmd(args.cmd_to_exec, n,
+                                                                result=True),
+                                   node_names,
+                                   args.parallel)
+    for node_name, res in results.items():
+        logger.info(f'{node_name}: {res} returned')
+    print_exec_results(results)
+    if any(isinstance(r, Exception) or r is None or r['rc'] != 0 for r in results.values()):
+        sys.exit(1)
+
+def playbook_on_nodes(args, node_names):
+    '''
+    Apply a fleet playbook (`ans_fleet_playbooks`) to the selected nodes in
+    a single ansible run, at most `--forks` nodes at a time
+
+    Args:
+        param1: CLI args
+        param2: node names list (`None` for every node)
+    '''
+    playbook_name = args.cmd_to_exec or ''
+    if not playbook_name.endswith('.yml'):
+        playbook_name += '.yml'
+    if playbook_name not in CLI_CONFIG['ans_fleet_playbooks']:
+        logger.error(f'Unexpected playbook: {args.cmd_to_exec}')
+        print(utl.print_err_str(f'>>> unexpected playbook: {args.cmd_to_exec} - choose from '
+                                f'{", ".join(CLI_CONFIG["ans_fleet_playbooks"])}'))
+        sys.exit(1)
+    if args.dev_mode is True:
+        pnode_rel_url = CLI_CONFIG['pnetwork_pnode_url_dev']
+    else:
+        pnode_rel_url = CLI_CONFIG['pnetwork_pnode_url']
+    ans.fleet_playbook(playbook_name, pnode_rel_url, node_names=node_names, forks=args.forks)
+
+def running_containers(node_name):
+    '''
+    Return the running docker containers of a node w/ their status
+
+    Args:
+        param1: node name
+        return: dict container name -> status (`None` if docker can't be reached)
+    '''
+    res = utl.run_remote_cmd("sudo docker ps --format '{{.Names}}\t{{.Status}}'",
+                             node_name, result=True)
+    if res is None or res['rc'] != 0:
+        return None
+    return dict(line.split('\t', 1) for line in res['stdout'].splitlines() if '\t' in line)
+
+def containers_healthy(node_name, expected):
+    '''
+    Check that every expected container is up and none is restarting,
+    unhealthy or still starting its health check (a node w/o containers
+    is healthy as long as docker answers)
+
+    Args:
+        param1: node name
+        param2: container names running before the update
+        return: `True` if healthy, `False` if not
+    '''
+    containers = running_containers(node_name)
+    if containers is None:
+        return False
+    missing = [name for name in expected if name not in containers]
+    failing = [name for name, status in containers.items()
+               if not status.startswith('Up') or '(unhealthy)' in status
+               or '(health: starting)' in status]
+    if missing or failing:
+        logger.info(f'{node_name}: containers not ready - missing: {missing}, '
+                    f'failing: {failing}')
+        return False
+    return True
+
+def health_gate(node_name, expected, timeout):
+    '''
+    Wait for the node bridge endpoints to answer their ping and for its
+    containers to be healthy again, for at most `timeout` seconds
+
+    Args:
+        param1: node name
+        param2: container names running before the update
+        param3: deadline in seconds (raise TimeoutError if hit)
+    '''
+    start_time = time.monotonic()
+    rdy.wait_for_bridge(node_name, timeout=timeout)
+    rdy.wait_until(lambda: containers_healthy(node_name, expected),
+                   max(timeout - (time.monotonic() - start_time), 1),
+                   f'{node_name}: containers',
+                   initial_delay=5)
+
+def upgrade_node(node_name, pkgs, timeout):
+    '''
+    Update the packages of a node in a single transaction, then run its
+    health gate (see `health_gate`)
+
+    Args:
+        param1: node name
+        param2: package names (or patterns)
+        param3: health gate deadline in seconds
+        return: dict w/ package versions and duration (raise on failure)
+    '''
+    import node
+    start_time = time.monotonic()
+    expected = running_containers(node_name) or {}
+    versions = node.upgrade_packages(node_name, pkgs, log=True)
+    not_updated = [name for name, (_, _, status) in versions.items() if status == 'not updated']
+    if not_updated:
+        raise RuntimeError(f'{node_name}: {", ".join(not_updated)} not updated')
+    try:
+        health_gate(node_name, expected, timeout)
+    except TimeoutError:
+        reg.update_node(node_name, health='degraded (update)')
+        raise
+    reg.update_node(node_name, health='healthy', last_seen=time.time())
+    return {'versions': versions, 'duration': time.monotonic() - start_time}
+
+def update_batches(node_names, batch_size, canary):
+    '''
+    Split the nodes in the canary batch (if any) and the rolling batches
+
+    Args:
+        param1: node names list
+        param2: nodes per batch
+        param3: canary nodes
+        return: list of (batch label, node names)
+    '''
+    batches = []
+    if canary > 0:
+        batches.append(('canary', node_names[:canary]))
+    rest = node_names[canary:]
+    batch_size = max(1, batch_size)
+    chunks = [rest[idx:idx + batch_size] for idx in range(0, len(rest), batch_size)]
+    batches += [(f'batch {nr}/{len(chunks)}', chunk) for nr, chunk in enumerate(chunks, 1)]
+    return batches
+
+def print_update_results(results, node_names):
+    '''
+    Print result, pnode-nitro version and duration per node
+
+    Args:
+        param1: dict node name -> result dict (or exception)
+        param2: every selected node name
+    '''
+    name_width = max(len(n) for n in list(node_names) + ['node'])
+    print(f'>>> {"node":<{name_width}}  {"result":<12}  {"pnode-nitro":<14}  duration')
+    for node_name in node_names:
+        res = results.get(node_name)
+        if res is None:
+            print(f'>>> {node_name:<{name_width}}  {"not updated":<12}  {"-":<14}  -')
+        elif isinstance(res, Exception):
+            print(utl.print_err_str(f'>>> {node_name:<{name_width}}  {"failed":<12}  '
+                                    f'{"-":<14}  -  {res}'))
+        else:
+            updated = any(status == 'updated' for _, _, status in res['versions'].values())
+            version = res['versions'].get('pnode-nitro', (None, None, None))[1] or '-'
+            print(f'>>> {node_name:<{name_width}}  '
+                  f'{"updated" if updated else "up to date":<12}  {version:<14}  '
+                  f'{res["duration"]:.0f}s')
+
+def rolling_update(args, node_names):
+    '''
+    Update the pnode packages of many nodes: the `--canary` nodes first,
+    then `--batch-size` nodes at a time, every batch in parallel
+    A node passes once its bridge pings and its containers are healthy
+    again (`rolling_health_timeout`); the rollout stops at the first batch
+    w/ a failed node, so most bridges keep serving
+
+    Args:
+        param1: CLI args
+        param2: node names list
+    '''
+    import node
+    pkgs = node.pkg_names(args.pkg_name)
+    timeout = CLI_CONFIG['rolling_health_timeout']
+    node_names = sorted(node_names)
+    batches = update_batches(node_names, args.batch_size, args.canary)
+    logger.info(f'Rolling update of {", ".join(pkgs)} on {len(node_names)} nodes')
+    print(f'>>> rolling update of {", ".join(pkgs)} on {len(node_names)} nodes '
+          f'({len(batches)} batches)')
+    results = {}
+    failed = []
+    start_time = time.monotonic()
+    for label, batch in batches:
+        print(f'>>> {label}: {", ".join(batch)}')
+        batch_results = utl.run_parallel(lambda n: upgrade_node(n, pkgs, timeout),
+                                         batch, len(batch))
+        results.update(batch_results)
+        failed = [n for n in batch if isinstance(batch_results[n], Exception)]
+        if failed:
+            logger.error(f'{label}: health gate failed on {", ".join(failed)}')
+            print(utl.print_err_str(f'>>> {label}: failed on {", ".join(failed)} - '
+                                    'stopping the rollout'))
+            break
+        print(utl.print_ok_str(f'>>> {label}: healthy'))
+    print_update_results(results, node_names)
+    print(f'>>> {len(results) - len(failed)}/{len(node_names)} nodes up to date and healthy '
+          f'after {time.monotonic() - start_time:.0f}s')
+    if failed:
+        sys.exit(1)
@@ -120,6 +120,7 @@ function inst_terraform(){
 
 function config_setup(){
 	cp "$BASE_PATH/config/ansible/ansible.cfg" /etc/pcli/ansible/
+	cp "$BASE_PATH/config/ansible/playbooks/bootstrap.yml" /etc/pcli/ansible/playbooks/
 	cp "$BASE_PATH/config/ansible/playbooks/edit_user_pwd.yml" /etc/pcli/ansible/playbooks/
 	cp "$BASE_PATH/config/ansible/playbooks/pnode_package.yml" /etc/pcli/ansible/playbooks/
 	cp "$BASE_PATH/config/ansible/playbooks/sys_config.yml" /etc/pcli/ansible/playbooks/
@@ -127,7 +128,8 @@ function config_setup(){
 	cp "$BASE_PATH/config/terraform/variables.tf.json.orig" /etc/pcli/terraform/
 	cp "$BASE_PATH/config/terraform/main.tf.orig" /etc/pcli/terraform/
 	cp "$BASE_PATH/config/terraform/output.tf.orig" /etc/pcli/terraform/
-	FILES_ARRAY=("/etc/pcli/ansible/ansible.cfg" "/etc/pcli/ansible/playbooks/edit_user_pwd.yml"
+	FILES_ARRAY=("/etc/pcli/ansible/ansible.cfg" "/etc/pcli/ansible/playbooks/bootstrap.yml"
+		"/etc/pcli/ansible/playbooks/edit_user_pwd.yml"
 		"/etc/pcli/ansible/playbooks/pnode_package.yml" "/etc/pcli/ansible/playbooks/sys_config.yml"
 		"/etc/pcli/terraform/inst_config.json" "/etc/pcli/terraform/variables.tf.json.orig"
 		"/etc/pcli/terraform/main.tf.orig" "/etc/pcli/terraform/output.tf.orig")
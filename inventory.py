@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import functools
+import json
+import logging
+import os
+import re
+import sys
+
+from client_config import CLI_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+# tfstate path -> ((inode, mtime_ns, size), parsed tfstate)
+_TF_STATE_CACHE = {}
+
+@functools.lru_cache(maxsize=None)
+def list_nodes():
+    '''
+    Return the node names, i.e. the first-level (non hidden) dirs of `tf_config_dir`
+    Single shallow scan, done once per process (call `list_nodes.cache_clear()`
+    after creating or deleting a node dir)
+
+    Args:
+        return: sorted tuple of node names
+    '''
+    tf_form_dir = os.path.abspath(
+                      os.path.expanduser(
+                          os.path.expandvars(CLI_CONFIG['tf_config_dir'])))
+    try:
+        with os.scandir(tf_form_dir) as dir_entries:
+            return tuple(sorted(entry.name for entry in dir_entries
+                                if entry.is_dir() and not entry.name.startswith('.')))
+    except FileNotFoundError:
+        logger.error(f'{tf_form_dir} not found')
+        return ()
+
+def tf_state_file(node_name):
+    '''
+    Return the terraform state file path of a node
+
+    Args:
+        param1: node name
+        return: tfstate file path
+    '''
+    return os.path.expanduser(f'{CLI_CONFIG["tf_state_path"]}{node_name}/terraform.tfstate')
+
+def read_tf_state(node_name):
+    '''
+    Parse `<tf_state_path>/<node_name>/terraform.tfstate` and return its content
+    The parsed state is memoized on the file inode, mtime and size, so a state
+    rewritten by `terraform apply` or `terraform destroy` is parsed again
+
+    Args:
+        param1: node name
+        return: tfstate dict (empty if the state file does not exist)
+    '''
+    state_path = tf_state_file(node_name)
+    try:
+        st = os.stat(state_path)
+    except FileNotFoundError:
+        _TF_STATE_CACHE.pop(state_path, None)
+        return {}
+    stat_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _TF_STATE_CACHE.get(state_path)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+    with open(state_path) as f_state:
+        tf_state = json.load(f_state)
+    _TF_STATE_CACHE[state_path] = (stat_key, tf_state)
+    logger.info(f'{state_path} parsed')
+    return tf_state
+
+def _instance_attributes(tf_state):
+    '''
+    Return the attributes of the node's aws_instance resource
+
+    Args:
+        param1: tfstate dict
+        return: attributes dict (empty if no instance is found)
+    '''
+    for resource in tf_state.get('resources', []):
+        if resource.get('mode') == 'managed' and resource.get('type') == 'aws_instance':
+            instances = resource.get('instances') or [{}]
+            return instances[0].get('attributes', {})
+    return {}
+
+def get_node_info(node_name):
+    '''
+    Return node details read from its terraform state
+
+    Args:
+        param1: node name
+        return: dict w/ name, public_ip, region, availability_zone,
+                instance_type, ami and instance_id (`None` if unknown)
+    '''
+    tf_state = read_tf_state(node_name)
+    attrs = _instance_attributes(tf_state)
+    pub_ip = None
+    ip_output = tf_state.get('outputs', {}).get('public_ip', {}).get('value')
+    if ip_output:
+        pub_ip = ip_output[0] if isinstance(ip_output, list) else ip_output
+    elif attrs.get('public_ip'):
+        pub_ip = attrs['public_ip']
+    az = attrs.get('availability_zone')
+    return {'name': node_name,
+            'public_ip': pub_ip,
+            'region': az[:-1] if az else None,
+            'availability_zone': az,
+            'instance_type': attrs.get('instance_type'),
+            'ami': attrs.get('ami'),
+            'instance_id': attrs.get('id')}
+
+def _group_name(prefix, value):
+    '''
+    Return a valid ansible group name (letters, digits and underscores)
+
+    Args:
+        param1: group prefix
+        param2: group value (ie: region, instance type)
+        return: group name
+    '''
+    return f'{prefix}_{re.sub(r"[^A-Za-z0-9_]", "_", value)}'
+
+def host_vars(node_info):
+    '''
+    Return the ansible host variables of a node
+
+    Args:
+        param1: node info dict (see `get_node_info`)
+        return: host variables dict
+    '''
+    return {'ansible_host': node_info['public_ip'],
+            'ansible_user': CLI_CONFIG['inst_user'],
+            'ansible_ssh_private_key_file': os.path.expanduser(
+                CLI_CONFIG['pcli_ssh_key_path'] + node_info['name']),
+            'pnode_region': node_info['region'],
+            'pnode_instance_type': node_info['instance_type']}
+
+def ansible_inventory():
+    '''
+    Return the whole fleet as an ansible dynamic inventory, built from the
+    nodes terraform states (nodes w/o a public ip are left out)
+    Groups: `nodes` (every node), `region_<region>`, `type_<instance type>`
+
+    Args:
+        return: inventory dict (`--list` format, w/ `_meta.hostvars`)
+    '''
+    inventory = {'nodes': {'hosts': []}, '_meta': {'hostvars': {}}}
+    for node_name in list_nodes():
+        node_info = get_node_info(node_name)
+        if node_info['public_ip'] is None:
+            continue
+        inventory['nodes']['hosts'].append(node_name)
+        inventory['_meta']['hostvars'][node_name] = host_vars(node_info)
+        for prefix, value in (('region', node_info['region']),
+                              ('type', node_info['instance_type'])):
+            if value:
+                group = inventory.setdefault(_group_name(prefix, value), {'hosts': []})
+                group['hosts'].append(node_name)
+    return inventory
+
+def main(argv):
+    '''
+    Ansible dynamic inventory script entrypoint (`--list` or `--host <node>`)
+
+    Args:
+        param1: command line arguments
+    '''
+    if len(argv) == 1 and argv[0] == '--list':
+        print(json.dumps(ansible_inventory()))
+    elif len(argv) == 2 and argv[0] == '--host':
+        # hostvars are already returned by `--list` in `_meta`
+        print(json.dumps(ansible_inventory()['_meta']['hostvars'].get(argv[1], {})))
+    else:
+        print(f'usage: {os.path.basename(__file__)} --list | --host <node>', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
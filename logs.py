@@ -0,0 +1,299 @@
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+import zlib
+
+import utils as utl
+from client_config import CLI_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+# bytes read from the ssh stream at a time
+CHUNK_SIZE = 64 * 1024
+
+def mirror_dir(node_name):
+    '''
+    Return the local logs mirror dir of a node
+
+    Args:
+        param1: node name
+        return: mirror dir path
+    '''
+    return os.path.join(CLI_CONFIG['logs_mirror_path'], node_name)
+
+def sync_state_path(node_name):
+    '''
+    Return the sync state file path of a node (remote path -> inode, offset)
+
+    Args:
+        param1: node name
+        return: sync state file path
+    '''
+    return os.path.join(mirror_dir(node_name), '.sync-state.json')
+
+def list_remote_logs(node_name):
+    '''
+    List the node log files w/ their inode and size (single ssh call)
+
+    Args:
+        param1: node name
+        return: dict remote path -> (inode, size) (`None` if the listing failed)
+    '''
+    listing = []
+    logs_path = CLI_CONFIG['pnode_logs_path']
+    res = utl.run_argv(utl.ssh_argv(node_name)
+                       + [f'find {shlex.quote(logs_path)} -type f -printf "%i %s %p\\n"'],
+                       on_line=lambda line, stream: listing.append(line)
+                       if stream == 'stdout' else None)
+    if res['rc'] != 0:
+        logger.error(f'{node_name}: unable to list {logs_path}\n{res["output"]}')
+        return None
+    remote_files = {}
+    for line in listing:
+        inode, size, path = line.split(' ', 2)
+        remote_files[path] = (int(inode), int(size))
+    return remote_files
+
+def local_path(node_name, remote_path):
+    '''
+    Return the mirror path of a remote log file
+
+    Args:
+        param1: node name
+        param2: remote path
+        return: local path
+    '''
+    rel_path = os.path.relpath(remote_path, CLI_CONFIG['pnode_logs_path'])
+    return os.path.join(mirror_dir(node_name), rel_path)
+
+def local_size(path):
+    '''
+    Return the size of a local file
+
+    Args:
+        param1: file path
+        return: size in bytes (`None` if not found)
+    '''
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def sync_plan(node_name, remote_files, state):
+    '''
+    Compute what to transfer, comparing the remote files w/ the last sync
+    - same path and inode, grown: only the appended bytes
+    - same path and inode, shrunk (truncated): whole file
+    - inode last seen under another path (rotated): local copy renamed,
+      then only the appended bytes
+    - unknown inode (new file, or rotation w/ copy): whole file
+
+    Args:
+        param1: node name
+        param2: dict remote path -> (inode, size)
+        param3: last sync state (remote path -> {inode, offset})
+        return: renames list of (old remote path, new remote path),
+                transfers list of (remote path, offset, length)
+    '''
+    by_inode = {entry['inode']: path for path, entry in state.items()}
+    renames = []
+    transfers = []
+    for path, (inode, size) in sorted(remote_files.items()):
+        known_path = path if state.get(path, {}).get('inode') == inode else by_inode.get(inode)
+        offset = 0
+        if known_path is not None:
+            offset = state[known_path]['offset']
+            if local_size(local_path(node_name, known_path)) != offset or size < offset:
+                offset = 0
+            elif known_path != path:
+                renames.append((known_path, path))
+        if size > offset or (offset == 0 and local_size(local_path(node_name, path)) != 0):
+            transfers.append((path, offset, size - offset))
+    return renames, transfers
+
+def apply_renames(node_name, renames):
+    '''
+    Rename the local copies of rotated files (in two steps, so that chained
+    rotations like `a.1 -> a.2, a -> a.1` don't overwrite each other)
+
+    Args:
+        param1: node name
+        param2: list of (old remote path, new remote path)
+    '''
+    tmp_paths = []
+    for old_path, new_path in renames:
+        tmp_path = f'{local_path(node_name, old_path)}.rotating'
+        os.replace(local_path(node_name, old_path), tmp_path)
+        tmp_paths.append((tmp_path, local_path(node_name, new_path)))
+    for tmp_path, new_local_path in tmp_paths:
+        os.makedirs(os.path.dirname(new_local_path), exist_ok=True)
+        os.replace(tmp_path, new_local_path)
+
+def transfer_cmd(transfers):
+    '''
+    Return the remote command streaming every planned byte range, one after
+    the other, as a single gzip stream
+    Every range is exactly `length` bytes long (NUL padded if the file
+    shrank meanwhile, the next sync will fetch it again)
+
+    Args:
+        param1: transfers list of (remote path, offset, length)
+        return: remote command
+    '''
+    parts = [f'{{ tail -c +{offset + 1} {shlex.quote(path)} 2>/dev/null; cat /dev/zero; }} '
+             f'| head -c {length}'
+             for path, offset, length in transfers]
+    return f'{{ {"; ".join(parts)}; }} | gzip -c -{CLI_CONFIG["logs_gzip_level"]}'
+
+def receive(node_name, transfers):
+    '''
+    Run the transfer command and write every byte range in the local mirror
+    (appended, or replacing the local copy if fetched from offset 0)
+    The stream is decompressed on the fly, memory use doesn't depend on
+    the logs size
+
+    Args:
+        param1: node name
+        param2: transfers list of (remote path, offset, length)
+        return: compressed bytes received (raise RuntimeError on failure)
+    '''
+    proc = subprocess.Popen(utl.ssh_argv(node_name) + [transfer_cmd(transfers)],
+                            stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    wire_bytes = 0
+    pending = list(transfers)
+    current = None
+
+    def open_next():
+        path, offset, length = pending.pop(0)
+        dest_path = local_path(node_name, path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if offset == 0:
+            f_log = open(f'{dest_path}.partial', 'wb')
+        else:
+            f_log = open(dest_path, 'ab')
+        return [f_log, dest_path, offset, length]
+
+    try:
+        while True:
+            chunk = proc.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            wire_bytes += len(chunk)
+            data = decomp.decompress(chunk)
+            while data:
+                if current is None or current[3] == 0:
+                    current = open_next()
+                f_log, _, _, remaining = current
+                f_log.write(data[:remaining])
+                current[3] -= len(data[:remaining])
+                data = data[remaining:]
+                if current[3] == 0:
+                    finish(current)
+        if current is not None and current[3] == 0 and not current[0].closed:
+            finish(current)
+        while pending and pending[0][2] == 0:
+            finish(open_next())
+    finally:
+        if current is not None and not current[0].closed:
+            current[0].close()
+        proc.stdout.close()
+        rc = proc.wait()
+    if rc != 0 or pending or (current is not None and current[3] != 0):
+        raise RuntimeError(f'{node_name}: log transfer failed (exit code {rc})')
+    return wire_bytes
+
+def finish(current):
+    '''
+    Close a received file, moving it in place if fetched from offset 0
+
+    Args:
+        param1: [file, local path, offset, remaining bytes]
+    '''
+    f_log, dest_path, offset, _ = current
+    f_log.close()
+    if offset == 0:
+        os.replace(f'{dest_path}.partial', dest_path)
+
+def pull_node_logs(node_name):
+    '''
+    Sync the node logs dir into its local mirror, transferring only what
+    changed since the last sync (see `sync_plan`), gzip compressed
+
+    Args:
+        param1: node name
+        return: dict w/ files, bytes (uncompressed), wire bytes and duration
+    '''
+    start_time = time.monotonic()
+    state_path = sync_state_path(node_name)
+    state = {}
+    if os.path.isfile(state_path):
+        state = utl.read_file(state_path, json_f=True) or {}
+    remote_files = list_remote_logs(node_name)
+    if remote_files is None:
+        raise RuntimeError(f'{node_name}: unable to list {CLI_CONFIG["pnode_logs_path"]}')
+    os.makedirs(mirror_dir(node_name), mode=0o700, exist_ok=True)
+    renames, transfers = sync_plan(node_name, remote_files, state)
+    apply_renames(node_name, renames)
+    wire_bytes = receive(node_name, transfers) if transfers else 0
+    utl.write_file({path: {'inode': inode, 'offset': size}
+                    for path, (inode, size) in remote_files.items()},
+                   state_path,
+                   json_f=True)
+    logger.info(f'{node_name}: {len(transfers)} log files synced, '
+                f'{len(renames)} rotated, {wire_bytes} bytes received')
+    return {'files': len(transfers),
+            'rotated': len(renames),
+            'bytes': sum(length for _, _, length in transfers),
+            'wire_bytes': wire_bytes,
+            'duration': time.monotonic() - start_time}
+
+def human_size(size):
+    '''
+    Return a size in bytes as a human readable string
+
+    Args:
+        param1: size in bytes
+        return: size string (ie: 1.5MiB)
+    '''
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+
+def logs_mng(args, node_names):
+    '''
+    Manage the `node logs` commands (`pull`: sync the nodes logs into
+    `logs_mirror_path/<node>`, at most `--parallel` nodes at a time)
+
+    Args:
+        param1: CLI args
+        param2: node names list
+    '''
+    if args.cmd_to_exec != 'pull':
+        logger.error(f'Unexpected logs action: {args.cmd_to_exec}')
+        print(utl.print_err_str(f'>>> unexpected logs action: {args.cmd_to_exec} - '
+                                'choose from: pull'))
+        sys.exit(1)
+    print(f'>>> pulling logs from {len(node_names)} node(s)')
+    results = utl.run_parallel(pull_node_logs, node_names, args.parallel)
+    name_width = max(len(n) for n in list(results) + ['node'])
+    print(f'>>> {"node":<{name_width}}  files  rotated  {"new data":>10}  '
+          f'{"on the wire":>11}  duration')
+    for node_name in sorted(results):
+        res = results[node_name]
+        if isinstance(res, Exception):
+            print(utl.print_err_str(f'>>> {node_name:<{name_width}}  error: {res}'))
+            continue
+        print(f'>>> {node_name:<{name_width}}  {res["files"]:>5}  {res["rotated"]:>7}  '
+              f'{human_size(res["bytes"]):>10}  {human_size(res["wire_bytes"]):>11}  '
+              f'{res["duration"]:.2f}s')
+    print(f'>>> local mirror: {CLI_CONFIG["logs_mirror_path"]}')
+    if any(isinstance(r, Exception) for r in results.values()):
+        sys.exit(1)
@@ -0,0 +1,331 @@
+import logging
+import os
+import re
+import sys
+import time
+from array import array
+
+import utils as utl
+from client_config import CLI_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+# single ssh call: cpu counters 1s apart, load, memory, root volume, containers
+METRICS_CMD = ("head -1 /proc/stat; sleep 1; head -1 /proc/stat; "
+               "echo \"load $(cat /proc/loadavg)\"; "
+               "grep -E '^(MemTotal|MemAvailable):' /proc/meminfo; "
+               "echo \"disk $(df -P -B1 / | tail -1)\"; "
+               "sudo docker stats --no-stream "
+               "--format 'docker {{.Name}} {{.CPUPerc}} {{.MemPerc}}' 2>/dev/null")
+
+# fixed-width column items: uint32 timestamps, float32 values
+TS_ITEMSIZE = array('I').itemsize
+VAL_ITEMSIZE = array('f').itemsize
+
+# metric -> mean value shown as an error (ie: node under-sized, root volume full)
+METRIC_LIMITS = {'cpu_pct': 90, 'disk_pct': 85, 'mem_pct': 90}
+
+# sparkline levels, lowest to highest
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+# `--since` default window
+DEFAULT_SINCE = '24h'
+
+# `--since` units
+SINCE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_metrics(output):
+    '''
+    Parse the output of `METRICS_CMD`
+
+    Args:
+        param1: command output
+        return: dict metric name -> value (ie: `cpu_pct`, `docker.<name>.mem_pct`)
+    '''
+    samples = {}
+    cpu_lines = []
+    mem = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'cpu':
+            cpu_lines.append([int(val) for val in fields[1:]])
+        elif fields[0] == 'load' and len(fields) > 1:
+            samples['load1'] = float(fields[1])
+        elif fields[0] in ('MemTotal:', 'MemAvailable:'):
+            mem[fields[0][:-1]] = int(fields[1]) * 1024
+        elif fields[0] == 'disk' and len(fields) >= 5:
+            used, avail = int(fields[3]), int(fields[4])
+            samples['disk_used_gb'] = used / 1e9
+            samples['disk_pct'] = used / max(used + avail, 1) * 100
+        elif fields[0] == 'docker' and len(fields) == 4:
+            name = re.sub(r'[^A-Za-z0-9_.-]', '_', fields[1])
+            samples[f'docker.{name}.cpu_pct'] = float(fields[2].rstrip('%'))
+            samples[f'docker.{name}.mem_pct'] = float(fields[3].rstrip('%'))
+    if len(cpu_lines) == 2:
+        # idle = idle + iowait
+        deltas = [new - old for old, new in zip(*cpu_lines)]
+        total = sum(deltas[:8])
+        if total > 0:
+            samples['cpu_pct'] = (1 - (deltas[3] + deltas[4]) / total) * 100
+    if 'MemTotal' in mem and 'MemAvailable' in mem:
+        samples['mem_used_gb'] = (mem['MemTotal'] - mem['MemAvailable']) / 1e9
+        samples['mem_pct'] = (1 - mem['MemAvailable'] / mem['MemTotal']) * 100
+    return samples
+
+def metric_paths(node_name, metric):
+    '''
+    Return the column files of a node metric: timestamps (uint32) and
+    values (float32), one fixed-width item per sample
+
+    Args:
+        param1: node name
+        param2: metric name
+        return: timestamps file path, values file path
+    '''
+    base_path = os.path.join(CLI_CONFIG['metrics_path'], node_name, metric)
+    return f'{base_path}.ts', f'{base_path}.val'
+
+def column_len(ts_path, val_path):
+    '''
+    Return the number of complete samples of a metric, i.e. the shorter
+    column length (a collect interrupted between the two appends leaves
+    one column longer)
+
+    Args:
+        param1: timestamps file path
+        param2: values file path
+        return: number of samples
+    '''
+    try:
+        return min(os.path.getsize(ts_path) // TS_ITEMSIZE,
+                   os.path.getsize(val_path) // VAL_ITEMSIZE)
+    except FileNotFoundError:
+        return 0
+
+def append_samples(node_name, timestamp, samples):
+    '''
+    Append a sample of every metric to the node store
+    Both columns are first truncated to their common length, so a sample
+    lost by an interrupted collect never shifts the later ones
+
+    Args:
+        param1: node name
+        param2: unix timestamp
+        param3: dict metric name -> value
+    '''
+    os.makedirs(os.path.join(CLI_CONFIG['metrics_path'], node_name), exist_ok=True)
+    for metric, value in samples.items():
+        ts_path, val_path = metric_paths(node_name, metric)
+        count = column_len(ts_path, val_path)
+        for path, item, itemsize in ((ts_path, array('I', [int(timestamp)]), TS_ITEMSIZE),
+                                     (val_path, array('f', [value]), VAL_ITEMSIZE)):
+            with open(path, 'ab') as f_col:
+                if f_col.tell() != count * itemsize:
+                    f_col.truncate(count * itemsize)
+                item.tofile(f_col)
+
+def bisect_timestamps(f_ts, count, since):
+    '''
+    Binary search the first sample not older than `since` in a timestamps
+    file, reading one fixed-width item per step (the column is not loaded)
+
+    Args:
+        param1: timestamps file (binary mode)
+        param2: number of samples
+        param3: unix timestamp
+        return: sample index (`count` if all are older)
+    '''
+    low, high = 0, count
+    while low < high:
+        mid = (low + high) // 2
+        f_ts.seek(mid * TS_ITEMSIZE)
+        if array('I', f_ts.read(TS_ITEMSIZE))[0] < since:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+def read_metric(node_name, metric, since=0):
+    '''
+    Return the samples of a node metric newer than `since`
+    Timestamps are binary searched in place, then only the matching window
+    of both columns is read
+
+    Args:
+        param1: node name
+        param2: metric name
+        param3: [optional] unix timestamp
+        return: timestamps array, values array
+    '''
+    ts_path, val_path = metric_paths(node_name, metric)
+    count = column_len(ts_path, val_path)
+    timestamps, values = array('I'), array('f')
+    with open(ts_path, 'rb') as f_ts, open(val_path, 'rb') as f_val:
+        first = bisect_timestamps(f_ts, count, since)
+        f_ts.seek(first * TS_ITEMSIZE)
+        timestamps.frombytes(f_ts.read((count - first) * TS_ITEMSIZE))
+        f_val.seek(first * VAL_ITEMSIZE)
+        values.frombytes(f_val.read((count - first) * VAL_ITEMSIZE))
+    return timestamps, values
+
+def node_metrics(node_name):
+    '''
+    Return the metric names stored for a node
+
+    Args:
+        param1: node name
+        return: sorted metric names list
+    '''
+    try:
+        file_names = os.listdir(os.path.join(CLI_CONFIG['metrics_path'], node_name))
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len('.ts')] for name in file_names if name.endswith('.ts'))
+
+def collect_node(node_name, timestamp):
+    '''
+    Read the node metrics (single ssh call) and append them to its store
+
+    Args:
+        param1: node name
+        param2: sweep unix timestamp
+        return: dict metric name -> value (raise RuntimeError on failure)
+    '''
+    res = utl.run_remote_cmd(METRICS_CMD, node_name, result=True)
+    if res is None or res['rc'] not in (0, 1):
+        # `docker stats` may fail alone (rc 1), the host metrics are still there
+        raise RuntimeError(f'{node_name}: metrics command failed')
+    samples = parse_metrics(res['stdout'])
+    if 'cpu_pct' not in samples:
+        raise RuntimeError(f'{node_name}: unexpected metrics output')
+    append_samples(node_name, timestamp, samples)
+    return samples
+
+def collect(args, node_names):
+    '''
+    Collect the metrics of the nodes in one concurrent sweep (at most
+    `--parallel` at a time) and print them
+
+    Args:
+        param1: CLI args
+        param2: node names list
+    '''
+    if not node_names:
+        logger.info('No active nodes')
+        print('>>> no active nodes')
+        sys.exit(1)
+    timestamp = time.time()
+    start_time = time.monotonic()
+    results = utl.run_parallel(lambda n: collect_node(n, timestamp), node_names, args.parallel)
+    name_width = max(len(n) for n in list(results) + ['node'])
+    print(f'>>> {"node":<{name_width}}  {"cpu":>6}  {"load1":>6}  {"mem":>6}  {"disk":>6}  '
+          'containers')
+    for node_name in sorted(results):
+        res = results[node_name]
+        if isinstance(res, Exception):
+            print(utl.print_err_str(f'>>> {node_name:<{name_width}}  error: {res}'))
+            continue
+        containers = len([m for m in res if m.startswith('docker.') and m.endswith('.cpu_pct')])
+        print(f'>>> {node_name:<{name_width}}  {res["cpu_pct"]:>5.1f}%  '
+              f'{res.get("load1", 0):>6.2f}  {res.get("mem_pct", 0):>5.1f}%  '
+              f'{res.get("disk_pct", 0):>5.1f}%  {containers}')
+    print(f'>>> {len(node_names)} nodes collected in {time.monotonic() - start_time:.1f}s - '
+          f'store: {CLI_CONFIG["metrics_path"]}')
+    if any(isinstance(r, Exception) for r in results.values()):
+        sys.exit(1)
+
+def parse_since(since):
+    '''
+    Parse a `--since` duration (ie: `90m`, `24h`, `7d`)
+
+    Args:
+        param1: duration string
+        return: seconds (`None` if not valid)
+    '''
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdw])', since.strip())
+    if match is None:
+        return None
+    return float(match.group(1)) * SINCE_UNITS[match.group(2)]
+
+def sparkline(values, width):
+    '''
+    Return the values as a sparkline of (max) `width` chars, every char
+    being the mean of its bucket
+
+    Args:
+        param1: values sequence
+        param2: max chars
+        return: sparkline string
+    '''
+    buckets = min(width, len(values))
+    means = []
+    for idx in range(buckets):
+        bucket = values[idx * len(values) // buckets:(idx + 1) * len(values) // buckets]
+        means.append(sum(bucket) / len(bucket))
+    low, high = min(means), max(means)
+    if high - low < 1e-9:
+        return SPARK_CHARS[0] * len(means)
+    return ''.join(SPARK_CHARS[round((m - low) / (high - low) * (len(SPARK_CHARS) - 1))]
+                   for m in means)
+
+def show(args, node_name):
+    '''
+    Print last, min, mean and max value of every node metric since
+    `--since` (default: `DEFAULT_SINCE`), w/ a sparkline of the trend
+    Metrics whose mean is above `METRIC_LIMITS` are shown as errors
+
+    Args:
+        param1: CLI args
+        param2: node name
+    '''
+    since = args.since or DEFAULT_SINCE
+    since_secs = parse_since(since)
+    if since_secs is None:
+        logger.error(f'Unexpected duration: {since}')
+        print(utl.print_err_str(f'>>> unexpected duration: {since} - ie: 90m, 24h, 7d'))
+        sys.exit(1)
+    metric_names = node_metrics(node_name)
+    if not metric_names:
+        print(f'>>> {node_name}: no metrics - run `pcli node metrics collect` first')
+        sys.exit(1)
+    name_width = max(len(m) for m in metric_names + ['metric'])
+    print(f'>>> {node_name} - last {since}')
+    print(f'>>> {"metric":<{name_width}}  {"last":>8}  {"min":>8}  {"mean":>8}  {"max":>8}  '
+          f'{"samples":>7}  trend')
+    for metric in metric_names:
+        _, values = read_metric(node_name, metric, time.time() - since_secs)
+        if not values:
+            continue
+        mean = sum(values) / len(values)
+        line = (f'>>> {metric:<{name_width}}  {values[-1]:>8.2f}  {min(values):>8.2f}  '
+                f'{mean:>8.2f}  {max(values):>8.2f}  {len(values):>7}  '
+                f'{sparkline(values, CLI_CONFIG["metrics_spark_width"])}')
+        print(utl.print_err_str(line) if mean >= METRIC_LIMITS.get(metric, 100) else line)
+    print(f'>>> from {time.strftime("%Y-%m-%d %H:%M", time.localtime(time.time() - since_secs))}'
+          f' to {time.strftime("%Y-%m-%d %H:%M")}')
+
+def metrics_mng(args, node_names):
+    '''
+    Manage the `node metrics` commands (`collect` on the given nodes,
+    `show` on a single one)
+
+    Args:
+        param1: CLI args
+        param2: node names list
+    '''
+    if args.cmd_to_exec == 'collect':
+        collect(args, node_names)
+    elif args.cmd_to_exec == 'show' and len(node_names) > 1:
+        logger.error('The following argument is not enabled: multiple nodes')
+        print('>>> error - the following argument is not enabled: multiple nodes')
+        sys.exit(1)
+    elif args.cmd_to_exec == 'show':
+        show(args, node_names[0])
+    else:
+        logger.error(f'Unexpected metrics action: {args.cmd_to_exec}')
+        print(utl.print_err_str(f'>>> unexpected metrics action: {args.cmd_to_exec} - '
+                                'choose from: collect, show'))
+        sys.exit(1)
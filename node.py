@@ -1,16 +1,24 @@
 import logging
-import time
+import shlex
 import sys
-import requests
 from tqdm import tqdm
 
-import terraform as trf
+import fleet
+import inventory as inv
+import logs
+import metrics
+import readiness as rdy
+import registry as reg
+import status
 import utils as utl
 from client_config import CLI_CONFIG
 
 
 logger = logging.getLogger(__name__)
 
+# separates the installed versions from the available updates (see `pkg_query_cmd`)
+PKG_UPDATES_MARKER = '--- updates ---'
+
 def ssh_into_node(node_name):
     '''
     Open a ssh tunnel to the instance (by node-name if running nodes > 1)
@@ -21,10 +29,9 @@ def ssh_into_node(node_name):
     try:
         logger.info('Opening ssh tunnel')
         print('>>> opening ssh tunnel')
-        pub_ip = utl.get_pub_ip(node_name)
-        priv_key_path = CLI_CONFIG['pcli_ssh_key_path'] + node_name
-        utl.run_cmd(f'ssh -o StrictHostKeyChecking=no -i {priv_key_path} '
-                    f'{CLI_CONFIG["inst_user"]}@{pub_ip}', output=False,
+        ssh_args, ssh_host = utl.ssh_conn(node_name)
+        utl.run_cmd(f'ssh -o StrictHostKeyChecking=no {ssh_args} '
+                    f'{ssh_host}', output=False,
                     nowait=False, noerr=True)
     except Exception as exc:
         logger.error(f'Error retrieving node\'s pub IP\n{exc}')
@@ -47,32 +54,157 @@ def exec_cmd_on_node(args, node_name):
         res = utl.run_remote_cmd(args.cmd_to_exec, node_name)
         logger.info(f'{res} returned')
 
-def update_pnode_pkg(node_name, pkg=None):
+def pkg_query_cmd(pkgs, updates=True):
+    '''
+    Return the remote command printing the installed versions of the
+    packages and, if `updates=True`, the available updates (yum metadata is
+    refreshed only if expired, no `yum clean all`)
+
+    Args:
+        param1: package names (or patterns, ie: `pnode-nitro*`)
+        param2: [optional] query the available updates too
+        return: remote command
+    '''
+    pkgs_str = ' '.join(shlex.quote(pk) for pk in pkgs)
+    cmd = f"rpm -qa --qf '%{{NAME}} %{{VERSION}}-%{{RELEASE}}\\n' {pkgs_str}"
+    if updates is True:
+        cmd += f"; echo '{PKG_UPDATES_MARKER}'; sudo yum -q check-update {pkgs_str} 2>/dev/null; echo \"rc $?\""
+    return cmd
+
+def parse_pkg_query(output):
+    '''
+    Parse the output of `pkg_query_cmd`
+
+    Args:
+        param1: command output
+        return: dict package -> installed version, dict package -> available
+                version (raise RuntimeError if yum check-update failed)
+    '''
+    installed, available = {}, {}
+    lines = output.splitlines()
+    marker = lines.index(PKG_UPDATES_MARKER) if PKG_UPDATES_MARKER in lines else len(lines)
+    for line in lines[:marker]:
+        if len(line.split()) == 2:
+            name, version = line.split()
+            installed[name] = version
+    if marker == len(lines):
+        return installed, available
+    rc_line = [line for line in lines[marker:] if line.startswith('rc ')]
+    if not rc_line or rc_line[-1] not in ('rc 0', 'rc 100'):
+        raise RuntimeError(f'yum check-update failed:\n{output}')
+    # yum wraps long rows, so entries are read as (name.arch, version, repo) tokens
+    tokens = []
+    for line in lines[marker + 1:]:
+        if line.startswith('rc ') or line.strip().startswith('Obsoleting'):
+            break
+        tokens += line.split()
+    for idx in range(0, len(tokens) - 2, 3):
+        available[tokens[idx].rsplit('.', 1)[0]] = tokens[idx + 1]
+    return installed, available
+
+def upgrade_packages(node_name, pkgs, log=False):
     '''
-    Update single subpackage or whole pnode package (by node name if running nodes > 1)
+    Update the packages having an available update in a single yum
+    transaction (the others are skipped) and return their versions
+    The installed and available versions are read in a single round trip
 
     Args:
         param1: node name
-        param2: [optional] pkg name (if not `all`)
+        param2: package names (or patterns, ie: `pnode-nitro*`)
+        param3: [optional] yum output to the pcli log only (not the console)
+        return: dict package -> (version before, version after, status)
+                (raise RuntimeError on failure)
     '''
-    if pkg is None or (len(pkg) == 1 and 'all' in pkg):
-        logger.info('Update pnode')
-        print('>>> update pnode')
-        utl.run_remote_cmd('sudo yum clean all -q', node_name, output=False)
-        utl.run_remote_cmd('sudo yum info pnode-nitro*', node_name, output=False)
-        utl.run_remote_cmd('sudo yum update pnode-nitro* -y', node_name, output=False)
-    elif pkg is not None and (len(pkg) > 1 and 'all' not in pkg):
-        for pk in pkg:
-            logger.info(f'Update {pk}')
-            print(f'>>> update {pk}')
-            utl.run_remote_cmd(f'sudo yum update {pk} -y', node_name, output=False)
-    elif pkg is not None and (len(pkg) == 1 and 'all' not in pkg):
-        logger.info(f'Update {pkg[0]}')
-        print(f'>>> update {pkg[0]}')
-        utl.run_remote_cmd(f'sudo yum update {pkg[0]} -y', node_name, output=False)
+    res = utl.run_remote_cmd(pkg_query_cmd(pkgs), node_name, result=True)
+    if res is None or res['rc'] != 0:
+        raise RuntimeError(f'{node_name}: package query failed')
+    before, available = parse_pkg_query(res['stdout'])
+    to_update = sorted(available)
+    if to_update:
+        logger.info(f'{node_name}: updating {", ".join(to_update)}')
+        tx_res = utl.run_remote_cmd(f'sudo yum update -y {" ".join(to_update)}', node_name,
+                                    log=log)
+        if tx_res is None or tx_res['rc'] != 0:
+            raise RuntimeError(f'{node_name}: yum update failed')
+        res = utl.run_remote_cmd(pkg_query_cmd(pkgs, updates=False), node_name, result=True)
+        if res is None or res['rc'] != 0:
+            raise RuntimeError(f'{node_name}: package query failed')
+        after, _ = parse_pkg_query(res['stdout'])
     else:
-        logger.error('Unexpected package to update')
-        print(utl.print_err_str('Unexpected package to update'))
+        after = before
+    versions = {}
+    for name in sorted(set(before) | set(after) | set(available)):
+        if name not in before and name not in after:
+            status = 'not installed'
+        elif name not in available:
+            status = 'up to date'
+        elif after.get(name) == before.get(name):
+            status = 'not updated'
+        else:
+            status = 'updated'
+        versions[name] = (before.get(name), after.get(name), status)
+    for pk in pkgs:
+        if '*' not in pk and pk not in versions:
+            versions[pk] = (None, None, 'not installed')
+    if 'pnode-nitro' in after:
+        reg.update_node(node_name, pnode_version=after['pnode-nitro'])
+    return versions
+
+def print_pkg_versions(versions):
+    '''
+    Print before/after version and status of every package
+
+    Args:
+        param1: dict package -> (version before, version after, status)
+    '''
+    rows = [('package', 'before', 'after', 'status')]
+    rows += [(name, before or '-', after or '-', status)
+             for name, (before, after, status) in versions.items()]
+    widths = [max(len(row[col]) for row in rows) for col in range(3)]
+    for row in rows:
+        line = '>>> ' + '  '.join(f'{val:<{widths[col]}}'
+                                  for col, val in enumerate(row[:3])) + f'  {row[3]}'
+        print(line if row[3] != 'not updated' else utl.print_err_str(line))
+
+def pkg_names(pkg=None):
+    '''
+    Return the packages to update from the `-p` arg (exit if unexpected)
+
+    Args:
+        param1: [optional] pkg names list (`None` or `all` for whole package)
+        return: package names (or patterns) list
+    '''
+    if pkg is None or (len(pkg) == 1 and 'all' in pkg):
+        return ['pnode-nitro*']
+    if 'all' not in pkg:
+        return list(dict.fromkeys(pkg))
+    logger.error('Unexpected package to update')
+    print(utl.print_err_str('Unexpected package to update'))
+    sys.exit(1)
+
+def update_pnode_pkg(node_name, pkg=None):
+    '''
+    Update single subpackage, several ones or whole pnode package (by node
+    name if running nodes > 1), in a single yum transaction, skipping the
+    packages already up to date
+
+    Args:
+        param1: node name
+        param2: [optional] pkg names list (if not `all`)
+    '''
+    pkgs = pkg_names(pkg)
+    logger.info(f'Update {", ".join(pkgs)}')
+    print(f'>>> update {", ".join(pkgs)}')
+    try:
+        versions = upgrade_packages(node_name, pkgs)
+    except RuntimeError as exc:
+        logger.error(f'Package update error\n{exc}')
+        print(utl.print_err_str(f'>>> {exc}'))
+        sys.exit(1)
+    if not any(status == 'updated' for _, _, status in versions.values()):
+        print('>>> nothing to update')
+    print_pkg_versions(versions)
+    if any(status == 'not updated' for _, _, status in versions.values()):
         sys.exit(1)
 
 def node_clean(node_name):
@@ -82,7 +214,10 @@ def node_clean(node_name):
     Args:
         param1: node name
     '''
+    utl.close_ssh_master(node_name)
     utl.run_cmd(f'rm -rf {CLI_CONFIG["tf_config_dir"]}{node_name}')
+    inv.list_nodes.cache_clear()
+    reg.remove_node(node_name)
     logger.error(f'{node_name}: terraform folder deleted')
     print(f'>>> {node_name}: terraform folder deleted')
     utl.run_cmd(f'rm -rf {CLI_CONFIG["ans_hosts_path"]}-{node_name}')
@@ -92,90 +227,140 @@ def node_clean(node_name):
     logger.error(f'{node_name}: ssh keypair deleted')
     print(f'>>> {node_name}: ssh keypair deleted')
 
-def check_nitro_deploy_status(pub_ip):
-    '''
-    Call bridge ping api and return status_code
-
-    Args:
-        param1: public ip
-        return: call status code
-    '''
-    logger.info(f'Calling http://{pub_ip}:4242/pbtc-on-eth/ping to get bridge status')
-    nitro_ret_code = requests.get(f'http://{pub_ip}:4242/pbtc-on-eth/ping').status_code
-    return nitro_ret_code
-
 def pnode_setup_and_start_cmds(node_name, new_rnd_pwd):
     '''
     Run pnode tools suite commands on node
+    Raise TimeoutError if the nitro enclave or the bridge never gets ready
 
     Args:
         param1: node name
         param2: user password
     '''
-    nitro_ret_code = 0
-    pub_ip = utl.get_pub_ip(node_name)
     try:
-        utl.run_remote_cmd(f'pnode_logs_viewer start >> {CLI_CONFIG["pcli_log_path"]} 2>&1',
-                           node_name,
-                           output=True)
+        utl.run_remote_cmd('pnode_logs_viewer start', node_name, log=True)
         tqdm.write('>>> starting all pnode_nitro components')
     except Exception as exc:
         logger.error(f'Error running pnode_logs_viewer_start:\n{exc}')
         print('>>> error running pnode_logs_viewer_start')
     try:
-        utl.run_remote_cmd(f'pnode_nitro_enclave deploy >> {CLI_CONFIG["pcli_log_path"]} 2>&1',
-                           node_name,
-                           output=False,
-                           nowait=True)
+        utl.run_remote_cmd('pnode_nitro_enclave deploy', node_name, nowait=True, log=True)
     except Exception as exc:
         logger.error(f'Error running pnode_nitro_enclave deploy: \n{exc}')
         print('>>> error running pnode_nitro_enclave deploy')
-    time.sleep(120)
     try:
-        utl.run_remote_cmd(f'ptokens_bridge deploy >> {CLI_CONFIG["pcli_log_path"]} 2>&1',
-                           node_name,
-                           output=True)
+        rdy.wait_for_enclave(node_name)
+    except TimeoutError as exc:
+        logger.error(f'Nitro enclave not running:\n{exc}')
+        tqdm.write(utl.print_err_str(f'>>> {exc}'))
+        raise
+    try:
+        utl.run_remote_cmd('ptokens_bridge deploy', node_name, log=True)
     except Exception as exc:
         logger.error(f'Error running ptokens_bridge deploy: \n{exc}')
         print('>>> error running ptokens_bridge deploy')
     try:
-        start_dashboard_cmd = (f'pnode_dashboard start {new_rnd_pwd} '
-                               f'>> {CLI_CONFIG["pcli_log_path"]} 2>&1')
-        utl.run_remote_cmd(start_dashboard_cmd, node_name, output=True)
+        utl.run_remote_cmd(f'pnode_dashboard start {new_rnd_pwd}', node_name, log=True)
     except Exception as exc:
         logger.error(f'Error running pnode_dashboard start {new_rnd_pwd}:\n{exc}')
         print(f'>>> error running pnode_dashboard start {new_rnd_pwd}')
-    while nitro_ret_code != 200:
-        try:
-            time.sleep(5)
-            nitro_ret_code = check_nitro_deploy_status(pub_ip)
-            logger.info(f'nitro api ping return code: {nitro_ret_code}')
-        except Exception as exc:
-            time.sleep(5)
-            nitro_ret_code = 0
-            logger.error('nitro api ping not ready - retrying in 5s')
-    tqdm.write('>>> nitro enclave status: ready')
+    try:
+        rdy.wait_for_bridge(node_name)
+        tqdm.write('>>> nitro enclave status: ready')
+    except TimeoutError as exc:
+        logger.error(f'Bridge not ready:\n{exc}')
+        tqdm.write(utl.print_err_str(f'>>> {exc}'))
+        raise
 
 def node_mng(args):
     '''
     Manage all the `node` commands
     Checks:
-    - `--dev` enabled only on `provisioning` cmd
+    - `--dev` enabled only on `provisioning` and `playbook` cmds
+    - `--count` and `--resume` enabled only on `provisioning` cmd
+    - `--region`, `--type` and `--sort` enabled only on `list` cmd
+    - `--watch` enabled only on `status` cmd
+    - `--since` enabled only on `metrics` cmd
+    - `--batch-size` and `--canary` enabled only on `update` cmd (at least 1 and 0)
     - number of running nodes, if > 1 `node_name` is required
     - node name if running node == 1 (and `-n` is not required)
     - node name NOT required on `provisioning` cmd
     - node name required on `clean` cmd
     - active nodes before `exec`, `destroy`, `ssh` or `update` to avoid errors
+    - `--all` (or a comma-separated `-n`) enabled only on `exec`, `logs`, `metrics`,
+      `playbook`, `status` and `update`
+    - `metrics collect` w/o `-n` runs on all nodes
 
     Args:
         param1: CLI args
     '''
-    if args.action[0] != 'provisioning' and args.dev_mode is True:
+    if args.action[0] not in ('playbook', 'provisioning') and args.dev_mode is True:
         logger.error('The following argument is not enabled: dev mode')
         print('>>> error - the following argument is not enabled: dev mode')
         sys.exit(1)
-    if args.action[0] in ('destroy', 'exec',
-                          'ssh', 'update') and utl.get_inst_list(nodes_nr=True) > 1:
+    if args.action[0] != 'provisioning' and (args.count != 1 or args.resume_node is not None):
+        logger.error('The following argument is not enabled: count/resume')
+        print('>>> error - the following argument is not enabled: count/resume')
+        sys.exit(1)
+    if args.action[0] != 'list' and (args.region is not None or args.inst_type is not None
+                                     or args.sort_key != 'name'):
+        logger.error('The following argument is not enabled: region/type/sort')
+        print('>>> error - the following argument is not enabled: region/type/sort')
+        sys.exit(1)
+    if args.action[0] != 'status' and args.watch_secs is not None:
+        logger.error('The following argument is not enabled: watch')
+        print('>>> error - the following argument is not enabled: watch')
+        sys.exit(1)
+    if args.action[0] != 'metrics' and args.since is not None:
+        logger.error('The following argument is not enabled: since')
+        print('>>> error - the following argument is not enabled: since')
+        sys.exit(1)
+    if args.action[0] != 'update' and (args.batch_size != CLI_CONFIG['rolling_batch_size']
+                                       or args.canary != 1):
+        logger.error('The following argument is not enabled: batch size/canary')
+        print('>>> error - the following argument is not enabled: batch size/canary')
+        sys.exit(1)
+    if args.batch_size < 1 or args.canary < 0:
+        logger.error(f'Invalid batch size/canary: {args.batch_size}/{args.canary}')
+        print('>>> error - batch size must be at least 1 and canary at least 0')
+        sys.exit(1)
+    multi_node = args.all_nodes is True or (args.node_name is not None and ',' in args.node_name)
+    if multi_node is True and args.action[0] not in ('exec', 'logs', 'metrics', 'playbook',
+                                                         'status', 'update'):
+        logger.error('The following argument is not enabled: multiple nodes')
+        print('>>> error - the following argument is not enabled: multiple nodes')
+        sys.exit(1)
+    if multi_node is True and args.action[0] == 'playbook':
+        logger.info('Run command playbook on nodes')
+        node_names = utl.select_nodes(args)
+        fleet.playbook_on_nodes(args, None if args.all_nodes else node_names)
+        return
+    if multi_node is True and args.action[0] == 'logs':
+        logger.info('Run command logs on nodes')
+        logs.logs_mng(args, utl.select_nodes(args))
+        return
+    if multi_node is True and args.action[0] == 'metrics':
+        logger.info('Run command metrics on nodes')
+        metrics.metrics_mng(args, utl.select_nodes(args))
+        return
+    if args.action[0] == 'metrics' and args.cmd_to_exec == 'collect' and args.node_name is None:
+        logger.info('Run command metrics on all nodes')
+        metrics.metrics_mng(args, utl.get_inst_list(names=True))
+        return
+    if multi_node is True and args.action[0] == 'status':
+        logger.info('Run command status on nodes')
+        status.status_mng(args, utl.select_nodes(args))
+        return
+    if multi_node is True and args.action[0] == 'update':
+        logger.info('Run command update on nodes')
+        fleet.rolling_update(args, utl.select_nodes(args))
+        return
+    if multi_node is True:
+        logger.info('Run command exec on nodes')
+        fleet.exec_on_nodes(args, utl.select_nodes(args))
+        return
+    nodes_nr = utl.get_inst_list(nodes_nr=True)
+    if args.action[0] in ('destroy', 'exec', 'logs', 'metrics', 'playbook',
+                          'ssh', 'status', 'update') and nodes_nr > 1:
         if args.node_name is None:
             logger.error('More than one running node found - the following argument '
                          'is required: node name')
@@ -184,8 +369,8 @@ def node_mng(args):
             sys.exit(1)
         else:
             node_name = args.node_name
-    elif args.action[0] in ('destroy', 'exec',
-                            'ssh', 'update') and utl.get_inst_list(nodes_nr=True) == 1:
+    elif args.action[0] in ('destroy', 'exec', 'logs', 'metrics', 'playbook',
+                            'ssh', 'status', 'update') and nodes_nr == 1:
         node_name = utl.get_inst_list(nodes_nr=False, single_node=True)
     if args.action[0] == 'provisioning' and args.node_name is not None:
         logger.error('The following argument is not required: node name')
@@ -200,10 +385,11 @@ def node_mng(args):
         node_clean(args.node_name)
     elif args.action[0] == 'edit':
         logger.info('Run command node edit')
+        import terraform as trf
         trf.provisioning(args, update=True)
     elif args.action[0] == 'exec':
         logger.info('Run command exec on node')
-        if utl.get_inst_list(nodes_nr=True) == 0:
+        if nodes_nr == 0:
             logger.info('No active nodes')
             print('>>> no active nodes')
             sys.exit(1)
@@ -211,29 +397,66 @@ def node_mng(args):
             exec_cmd_on_node(args, node_name)
     elif args.action[0] == 'list':
         logger.info('Run command node list')
-        utl.get_inst_list()
+        reg.print_nodes(args)
     elif args.action[0] == 'destroy':
         logger.info('Run command node destroy')
-        if utl.get_inst_list(nodes_nr=True) == 0:
+        if nodes_nr == 0:
             logger.info('No active nodes')
             print('>>> no active nodes')
             sys.exit(1)
         else:
+            import terraform as trf
             trf.destroy_instance(node_name)
+    elif args.action[0] == 'logs':
+        logger.info('Run command logs on node')
+        if nodes_nr == 0:
+            logger.info('No active nodes')
+            print('>>> no active nodes')
+            sys.exit(1)
+        else:
+            logs.logs_mng(args, [node_name])
+    elif args.action[0] == 'metrics':
+        logger.info('Run command metrics on node')
+        if nodes_nr == 0:
+            logger.info('No active nodes')
+            print('>>> no active nodes')
+            sys.exit(1)
+        else:
+            metrics.metrics_mng(args, [node_name])
+    elif args.action[0] == 'playbook':
+        logger.info('Run command playbook on node')
+        if nodes_nr == 0:
+            logger.info('No active nodes')
+            print('>>> no active nodes')
+            sys.exit(1)
+        else:
+            fleet.playbook_on_nodes(args, [node_name])
     elif args.action[0] == 'provisioning':
         logger.info('Run command node provisioning')
+        import terraform as trf
         trf.provisioning(args)
+    elif args.action[0] == 'reindex':
+        logger.info('Run command node reindex')
+        print(f'>>> {reg.reindex()} nodes indexed')
     elif args.action[0] == 'ssh':
         logger.info('Run command node ssh')
-        if utl.get_inst_list(nodes_nr=True) == 0:
+        if nodes_nr == 0:
             logger.info('No active nodes')
             print('>>> no active nodes')
             sys.exit(1)
         else:
             ssh_into_node(node_name)
+    elif args.action[0] == 'status':
+        logger.info('Run command status on node')
+        if nodes_nr == 0:
+            logger.info('No active nodes')
+            print('>>> no active nodes')
+            sys.exit(1)
+        else:
+            status.status_mng(args, [node_name])
     elif args.action[0] == 'update':
         logger.info('Update pnode package')
-        if utl.get_inst_list(nodes_nr=True) == 0:
+        if nodes_nr == 0:
             logger.info('No active nodes')
             print('>>> no active nodes')
             sys.exit(1)
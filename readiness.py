@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import random
+import socket
+import time
+from tqdm import tqdm
+
+import tracing as trc
+import utils as utl
+from client_config import CLI_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+@trc.traced('wait', label_arg='desc', arg_names=('desc', 'timeout'))
+def wait_until(check, timeout, desc, initial_delay=2, max_delay=20, jitter=False):
+    '''
+    Call `check()` until it returns a truthy value, sleeping w/ exponential
+    backoff between attempts, for at most `timeout` seconds
+    Exceptions raised by `check()` count as a failed attempt
+
+    Args:
+        param1: check function
+        param2: deadline in seconds
+        param3: condition description (for logs/errors)
+        param4: [optional] first delay in seconds
+        param5: [optional] max delay in seconds
+        param6: [optional] randomize each delay between 50% and 150%
+        return: `check()` result (raise TimeoutError if the deadline is hit)
+    '''
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    delay = initial_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            res = check()
+        except Exception as exc:
+            logger.info(f'{desc}: attempt {attempt} failed\n{exc}')
+            res = None
+        if res:
+            logger.info(f'{desc}: ready after {time.monotonic() - start_time:.1f}s '
+                        f'({attempt} attempts)')
+            return res
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.error(f'{desc}: not ready after {timeout}s')
+            raise TimeoutError(f'{desc}: not ready after {timeout}s')
+        sleep_time = min(delay * random.uniform(0.5, 1.5) if jitter else delay, remaining)
+        logger.info(f'{desc}: not ready - retrying in {sleep_time:.0f}s')
+        time.sleep(sleep_time)
+        delay = min(delay * 2, max_delay)
+
+def is_port_open(pub_ip, port, timeout=3):
+    '''
+    Check if a TCP port is reachable
+
+    Args:
+        param1: public ip
+        param2: port
+        param3: [optional] connect timeout in seconds
+        return: `True` if reachable, `False` if not
+    '''
+    try:
+        with socket.create_connection((pub_ip, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def probe_ssh_cmd(node_name, remote_cmd):
+    '''
+    Run command on node over a new (non multiplexed) non-interactive ssh
+    connection, so that a stale master connection can't fake the result
+
+    Args:
+        param1: node name
+        param2: remote command
+        return: result dict (see `utils.run_cmd`)
+    '''
+    pub_ip = utl.get_pub_ip(node_name)
+    priv_key_path = os.path.expanduser(CLI_CONFIG['pcli_ssh_key_path'] + node_name)
+    return utl.run_argv(['ssh', '-i', priv_key_path,
+                         '-o', 'ControlPath=none',
+                         '-o', 'BatchMode=yes',
+                         '-o', 'ConnectTimeout=5',
+                         '-o', 'StrictHostKeyChecking=no',
+                         '-o', 'UserKnownHostsFile=/dev/null',
+                         '-o', 'LogLevel=ERROR',
+                         f'{CLI_CONFIG["inst_user"]}@{pub_ip}', remote_cmd])
+
+def get_boot_id(node_name):
+    '''
+    Return the node's current boot id
+
+    Args:
+        param1: node name
+        return: boot id (`None` if unreachable)
+    '''
+    res = probe_ssh_cmd(node_name, 'cat /proc/sys/kernel/random/boot_id')
+    if res['rc'] != 0:
+        return None
+    return res['stdout'].strip()
+
+def wait_for_ssh(node_name, timeout=None):
+    '''
+    Wait for node's ssh port to be reachable, then for ssh authentication
+    to succeed
+
+    Args:
+        param1: node name
+        param2: [optional] deadline in seconds (default `ready_ssh_timeout`)
+    '''
+    timeout = timeout or CLI_CONFIG['ready_ssh_timeout']
+    start_time = time.monotonic()
+    wait_until(lambda: is_port_open(utl.get_pub_ip(node_name), CLI_CONFIG['ssh_port']),
+               timeout,
+               f'{node_name}: ssh port')
+    wait_until(lambda: probe_ssh_cmd(node_name, 'true')['rc'] == 0,
+               max(timeout - (time.monotonic() - start_time), 1),
+               f'{node_name}: ssh authentication')
+    tqdm.write(f'>>> {node_name}: ssh ready in {time.monotonic() - start_time:.0f}s')
+
+def wait_for_reboot(node_name, old_boot_id, timeout=None):
+    '''
+    Wait for node to come back after a reboot: ssh authentication succeeds
+    and the boot id differs from the one read before rebooting
+
+    Args:
+        param1: node name
+        param2: boot id before reboot
+        param3: [optional] deadline in seconds (default `ready_reboot_timeout`)
+    '''
+    timeout = timeout or CLI_CONFIG['ready_reboot_timeout']
+    start_time = time.monotonic()
+    if old_boot_id is None:
+        # boot id unknown, wait for the node to go down first
+        wait_until(lambda: not is_port_open(utl.get_pub_ip(node_name),
+                                            CLI_CONFIG['ssh_port']),
+                   timeout,
+                   f'{node_name}: shutdown')
+    wait_until(lambda: get_boot_id(node_name) not in (None, old_boot_id),
+               max(timeout - (time.monotonic() - start_time), 1),
+               f'{node_name}: reboot')
+    # any master connection opened before the reboot is dead now
+    utl.close_ssh_master(node_name)
+    tqdm.write(f'>>> {node_name}: back online in {time.monotonic() - start_time:.0f}s')
+
+def enclave_running(node_name):
+    '''
+    Check if a nitro enclave is running on node
+
+    Args:
+        param1: node name
+        return: `True` if running, `False` if not
+    '''
+    res = utl.run_remote_cmd('nitro-cli describe-enclaves', node_name, result=True)
+    if res is None or res['rc'] != 0:
+        return False
+    return any(enclave.get('State') == 'RUNNING' for enclave in json.loads(res['stdout']))
+
+def wait_for_enclave(node_name, timeout=None):
+    '''
+    Wait for the nitro enclave to be running on node
+
+    Args:
+        param1: node name
+        param2: [optional] deadline in seconds (default `ready_enclave_timeout`)
+    '''
+    timeout = timeout or CLI_CONFIG['ready_enclave_timeout']
+    start_time = time.monotonic()
+    wait_until(lambda: enclave_running(node_name),
+               timeout,
+               f'{node_name}: nitro enclave',
+               initial_delay=5)
+    tqdm.write(f'>>> {node_name}: nitro enclave running in '
+               f'{time.monotonic() - start_time:.0f}s')
+
+def http_session(pool_size=10):
+    '''
+    Return a keep-alive HTTP session w/ a connection pool (no retries,
+    callers handle them)
+
+    Args:
+        param1: [optional] max pooled connections per host
+        return: requests session
+    '''
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size,
+                                            max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def bridge_ping_urls(pub_ip, endpoints=None):
+    '''
+    Return the bridge ping urls of a node
+
+    Args:
+        param1: public ip
+        param2: [optional] bridge endpoints list (default `bridge_endpoints`)
+        return: dict endpoint -> ping url
+    '''
+    return {endpoint: f'http://{pub_ip}:{CLI_CONFIG["bridge_api_port"]}/{endpoint}/ping'
+            for endpoint in endpoints or CLI_CONFIG['bridge_endpoints']}
+
+def wait_for_http(urls, timeout, desc, session=None):
+    '''
+    Wait for every url to answer 200, probing the pending ones concurrently
+    over a keep-alive session w/ connect/read timeouts and jittered backoff
+
+    Args:
+        param1: dict name -> url
+        param2: overall deadline in seconds
+        param3: description (for logs/errors)
+        param4: [optional] requests session
+        return: dict name -> seconds to ready (raise TimeoutError if the deadline is hit)
+    '''
+    import requests
+    session = session or http_session(pool_size=len(urls))
+    pending = dict(urls)
+    ready = {}
+    start_time = time.monotonic()
+
+    def probe(name):
+        try:
+            return session.get(pending[name], timeout=CLI_CONFIG['http_timeout']).status_code
+        except requests.RequestException as exc:
+            logger.info(f'{desc}: {name} unreachable\n{exc}')
+            return None
+
+    def all_ready():
+        codes = utl.run_parallel(probe, list(pending), len(pending))
+        for name, code in codes.items():
+            if code == 200:
+                ready[name] = time.monotonic() - start_time
+                del pending[name]
+                logger.info(f'{desc}: {name} ready in {ready[name]:.1f}s')
+                tqdm.write(f'>>> {desc}: {name} ready in {ready[name]:.0f}s')
+            else:
+                logger.info(f'{desc}: {name} returned {code}')
+        return not pending
+
+    try:
+        wait_until(all_ready, timeout, desc, initial_delay=2, max_delay=15, jitter=True)
+    except TimeoutError as exc:
+        raise TimeoutError(f'{desc}: {", ".join(pending)} not ready after {timeout}s') from exc
+    return ready
+
+def wait_for_bridge(node_name, endpoints=None, timeout=None):
+    '''
+    Wait for the node's bridge endpoints to answer their ping api
+
+    Args:
+        param1: node name
+        param2: [optional] bridge endpoints list (default `bridge_endpoints`)
+        param3: [optional] deadline in seconds (default `ready_bridge_timeout`)
+        return: dict endpoint -> seconds to ready
+    '''
+    return wait_for_http(bridge_ping_urls(utl.get_pub_ip(node_name), endpoints),
+                         timeout or CLI_CONFIG['ready_bridge_timeout'],
+                         f'{node_name}: bridge')
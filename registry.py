@@ -0,0 +1,290 @@
+import datetime
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import inventory as inv
+from client_config import CLI_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+# bump (and extend `SCHEMA`) when the table changes
+SCHEMA_VERSION = 1
+
+SCHEMA = f'''
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS nodes (
+    name TEXT PRIMARY KEY,
+    ip TEXT,
+    region TEXT,
+    availability_zone TEXT,
+    ami TEXT,
+    instance_type TEXT,
+    instance_id TEXT,
+    created REAL,
+    pnode_version TEXT,
+    health TEXT,
+    last_seen REAL
+);
+CREATE INDEX IF NOT EXISTS nodes_region ON nodes (region, instance_type);
+CREATE INDEX IF NOT EXISTS nodes_instance_type ON nodes (instance_type);
+CREATE INDEX IF NOT EXISTS nodes_created ON nodes (created);
+PRAGMA user_version = {SCHEMA_VERSION};
+'''
+
+# `node list --sort` key -> column
+SORT_COLUMNS = {'name': 'name',
+                'created': 'created',
+                'ip': 'ip',
+                'region': 'region',
+                'type': 'instance_type',
+                'last_seen': 'last_seen'}
+
+def connect():
+    '''
+    Open the registry database (created, w/ its indexes, on first use)
+
+    Args:
+        return: sqlite connection (rows as `sqlite3.Row`)
+    '''
+    db_path = CLI_CONFIG['registry_path']
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+        conn.executescript(SCHEMA)
+    return conn
+
+def node_created(node_name):
+    '''
+    Return the node creation time, i.e. the oldest file of its terraform dir
+
+    Args:
+        param1: node name
+        return: unix timestamp (`None` if the node dir is not found)
+    '''
+    try:
+        with os.scandir(f'{CLI_CONFIG["tf_config_dir"]}{node_name}') as dir_entries:
+            return min((entry.stat().st_mtime for entry in dir_entries), default=None)
+    except FileNotFoundError:
+        return None
+
+def tf_fields(node_name):
+    '''
+    Return the registry fields read from the node terraform state and dir
+
+    Args:
+        param1: node name
+        return: fields dict
+    '''
+    node_info = inv.get_node_info(node_name)
+    return {'name': node_name,
+            'ip': node_info['public_ip'],
+            'region': node_info['region'],
+            'availability_zone': node_info['availability_zone'],
+            'ami': node_info['ami'],
+            'instance_type': node_info['instance_type'],
+            'instance_id': node_info['instance_id'],
+            'created': node_created(node_name)}
+
+def _upsert(conn, fields):
+    '''
+    Insert a node row, or update only the given fields of an existing one
+
+    Args:
+        param1: sqlite connection
+        param2: fields dict (`name` included)
+    '''
+    cols = list(fields)
+    updates = ', '.join(f'{col} = excluded.{col}' for col in cols if col != 'name')
+    conn.execute(f'INSERT INTO nodes ({", ".join(cols)}) '
+                 f'VALUES ({", ".join("?" for _ in cols)}) '
+                 f'ON CONFLICT (name) DO UPDATE SET {updates}',
+                 [fields[col] for col in cols])
+
+def _update(conn, node_name, fields):
+    '''
+    Update some fields of a node row (a node not registered yet is
+    added from its terraform state first)
+
+    Args:
+        param1: sqlite connection
+        param2: node name
+        param3: fields dict
+    '''
+    cur = conn.execute(f'UPDATE nodes SET {", ".join(f"{col} = ?" for col in fields)} '
+                       'WHERE name = ?',
+                       list(fields.values()) + [node_name])
+    if cur.rowcount == 0:
+        _upsert(conn, dict(tf_fields(node_name), **fields))
+
+def record_node(node_name, **fields):
+    '''
+    Add (or refresh) a node in the registry from its terraform state
+    Extra fields (ie: `health`, `pnode_version`) are stored as well
+
+    Args:
+        param1: node name
+        param2: [optional] extra fields
+    '''
+    try:
+        with closing(connect()) as conn, conn:
+            _upsert(conn, dict(tf_fields(node_name), **fields))
+        logger.info(f'{node_name}: registry updated')
+    except (sqlite3.Error, OSError) as exc:
+        logger.error(f'{node_name}: registry update error\n{exc}')
+
+def update_node(node_name, **fields):
+    '''
+    Update some fields of a registered node (ie: `health`, `last_seen`)
+
+    Args:
+        param1: node name
+        param2: fields to update
+    '''
+    try:
+        with closing(connect()) as conn, conn:
+            _update(conn, node_name, fields)
+    except (sqlite3.Error, OSError) as exc:
+        logger.error(f'{node_name}: registry update error\n{exc}')
+
+def update_nodes(fields_by_node):
+    '''
+    Update some fields of several registered nodes in a single transaction
+
+    Args:
+        param1: dict node name -> fields to update
+    '''
+    try:
+        with closing(connect()) as conn, conn:
+            for node_name, fields in fields_by_node.items():
+                _update(conn, node_name, fields)
+    except (sqlite3.Error, OSError) as exc:
+        logger.error(f'Registry update error\n{exc}')
+
+def remove_node(node_name):
+    '''
+    Remove a node from the registry
+
+    Args:
+        param1: node name
+    '''
+    try:
+        with closing(connect()) as conn, conn:
+            conn.execute('DELETE FROM nodes WHERE name = ?', (node_name,))
+        logger.info(f'{node_name}: removed from registry')
+    except (sqlite3.Error, OSError) as exc:
+        logger.error(f'{node_name}: registry update error\n{exc}')
+
+def sync_names(conn):
+    '''
+    Add the nodes missing from the registry and drop the ones whose
+    terraform dir is gone (node dirs are listed, tfstates are parsed only
+    for the missing nodes)
+
+    Args:
+        param1: sqlite connection
+    '''
+    node_names = set(inv.list_nodes())
+    registered = {row['name'] for row in conn.execute('SELECT name FROM nodes')}
+    for node_name in sorted(node_names - registered):
+        _upsert(conn, tf_fields(node_name))
+    for node_name in registered - node_names:
+        conn.execute('DELETE FROM nodes WHERE name = ?', (node_name,))
+
+def reindex():
+    '''
+    Rebuild the registry from the terraform states (health and pnode
+    version of the nodes still present are kept)
+    An unreadable database is replaced
+
+    Args:
+        return: number of indexed nodes
+    '''
+    try:
+        conn = connect()
+        conn.execute('SELECT COUNT(*) FROM nodes').fetchone()
+    except sqlite3.DatabaseError as exc:
+        logger.error(f'Registry unreadable, recreating it\n{exc}')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(CLI_CONFIG['registry_path'] + suffix):
+                os.remove(CLI_CONFIG['registry_path'] + suffix)
+        conn = connect()
+    node_names = inv.list_nodes()
+    with closing(conn), conn:
+        conn.execute(f'DELETE FROM nodes WHERE name NOT IN ({", ".join("?" for _ in node_names)})',
+                     node_names)
+        for node_name in node_names:
+            _upsert(conn, tf_fields(node_name))
+    return len(node_names)
+
+def query_nodes(region=None, inst_type=None, sort='name'):
+    '''
+    Return the registered nodes, filtered and sorted on the indexed columns
+
+    Args:
+        param1: [optional] region
+        param2: [optional] instance type
+        param3: [optional] sort key (see `SORT_COLUMNS`)
+        return: list of row dicts
+    '''
+    clauses, params = [], []
+    if region is not None:
+        clauses.append('region = ?')
+        params.append(region)
+    if inst_type is not None:
+        clauses.append('instance_type = ?')
+        params.append(inst_type)
+    where = f'WHERE {" AND ".join(clauses)} ' if clauses else ''
+    with closing(connect()) as conn, conn:
+        sync_names(conn)
+        rows = conn.execute(f'SELECT * FROM nodes {where}'
+                            f'ORDER BY {SORT_COLUMNS[sort]}, name', params).fetchall()
+    return [dict(row) for row in rows]
+
+def format_time(timestamp):
+    '''
+    Return a unix timestamp as a local `YYYY-MM-DD HH:MM` string
+
+    Args:
+        param1: unix timestamp (or `None`)
+        return: time string (`-` if unknown)
+    '''
+    if timestamp is None:
+        return '-'
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+
+def print_nodes(args):
+    '''
+    Print the registered nodes (`node list`), w/ the `--region`, `--type`
+    and `--sort` selection
+
+    Args:
+        param1: CLI args
+    '''
+    start_time = time.monotonic()
+    nodes = query_nodes(args.region, args.inst_type, args.sort_key)
+    logger.info(f'{len(nodes)} nodes listed in {time.monotonic() - start_time:.3f}s')
+    if not nodes and (args.region is not None or args.inst_type is not None):
+        logger.info('No matching nodes')
+        print('>>> no matching nodes')
+        return
+    if not nodes:
+        logger.info('No active nodes')
+        print('>>> no active nodes')
+        return
+    rows = [('node', 'IP', 'region', 'type', 'created', 'pnode', 'health')]
+    rows += [(node['name'],
+              node['ip'] or 'unknown ip',
+              node['region'] or '-',
+              node['instance_type'] or '-',
+              format_time(node['created']),
+              node['pnode_version'] or '-',
+              node['health'] or '-')
+             for node in nodes]
+    widths = [max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+    for row in rows:
+        print('>>> ' + '  '.join(f'{val:<{widths[col]}}' for col, val in enumerate(row)).rstrip())
@@ -0,0 +1,96 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import tracing as trc
+
+
+logger = logging.getLogger(__name__)
+
+def check_stages(stages):
+    '''
+    Check that every stage dependency exists and that there are no cycles
+
+    Args:
+        param1: dict stage name -> (stage function, dependencies list)
+        return: raise ValueError if the graph is not valid
+    '''
+    for name, (_, deps) in stages.items():
+        unknown_deps = [dep for dep in deps if dep not in stages]
+        if unknown_deps:
+            raise ValueError(f'{name}: unknown dependencies {unknown_deps}')
+    visited = set()
+    visiting = set()
+
+    def visit(name, path):
+        if name in visiting:
+            raise ValueError(f'dependency cycle: {" -> ".join(path + [name])}')
+        if name in visited:
+            return
+        visiting.add(name)
+        for dep in stages[name][1]:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        visited.add(name)
+
+    for name in stages:
+        visit(name, [])
+
+def _run_stage(stage_name, func, ctx):
+    '''
+    Run a single stage, traced as a `stage` span
+
+    Args:
+        param1: stage name
+        param2: stage function
+        param3: context dict
+    '''
+    with trc.span(stage_name, 'stage', node=ctx.get('node_name')):
+        func(ctx)
+
+def run_stages(stages, ctx, parallel=4, done=None, on_stage_done=None,
+               thread_name_prefix='stages'):
+    '''
+    Run named stages as soon as all their dependencies are completed,
+    overlapping independent stages on (max) `parallel` threads
+    Every stage function is called w/ the shared `ctx` dict
+    After a failure no new stage is started, running ones are awaited
+
+    Args:
+        param1: dict stage name -> (stage function, dependencies list)
+        param2: context dict passed to every stage
+        param3: [optional] max stages running at the same time
+        param4: [optional] already completed stage names (not run again)
+        param5: [optional] function called w/ the stage name when a stage completes
+        param6: [optional] worker threads name prefix (ie: node name, for traces)
+        return: dict w/ `done` (completed stage names), `failed`
+                (stage name -> exception) and `pending` (not run stage names)
+    '''
+    check_stages(stages)
+    done = set(done or ())
+    pending = [name for name in stages if name not in done]
+    failed = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=parallel,
+                            thread_name_prefix=thread_name_prefix) as pool:
+        while True:
+            if not failed:
+                for name in [n for n in pending if all(d in done for d in stages[n][1])]:
+                    logger.info(f'Stage {name} started')
+                    running[pool.submit(_run_stage, name, stages[name][0], ctx)] = name
+                    pending.remove(name)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except BaseException as exc:
+                    logger.error(f'Stage {name} failed\n{exc!r}')
+                    failed[name] = exc
+                    continue
+                logger.info(f'Stage {name} completed')
+                done.add(name)
+                if on_stage_done is not None:
+                    on_stage_done(name)
+    return {'done': done, 'failed': failed, 'pending': pending}
@@ -0,0 +1,233 @@
+import collections
+import logging
+import math
+import sys
+import threading
+import time
+
+import readiness as rdy
+import registry as reg
+import utils as utl
+from client_config import CLI_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+# (node name, check name) -> (probe time, result), see `cached_probe`
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+# latency samples kept per check for the percentiles
+LATENCY_SAMPLES = 1000
+
+def node_checks(node_name):
+    '''
+    Return the checks of a node: ssh port, dashboard and every bridge ping
+    endpoint (a strict check is ok only on 200, the others on any answer
+    below 500, ie: the dashboard login)
+
+    Args:
+        param1: node name
+        return: dict check name -> (url, strict), `None` if the IP is unknown
+    '''
+    pub_ip = utl.get_pub_ip(node_name)
+    if pub_ip == 'unknown ip':
+        return None
+    checks = {'ssh': (f'tcp://{pub_ip}:{CLI_CONFIG["ssh_port"]}', True),
+              'dashboard': (f'http://{pub_ip}:{CLI_CONFIG["dashboard_port"]}/', False)}
+    for endpoint, url in rdy.bridge_ping_urls(pub_ip).items():
+        checks[endpoint] = (url, True)
+    return checks
+
+def probe(session, url, strict):
+    '''
+    Run a single check w/ the `status_timeout` connect and read timeouts
+
+    Args:
+        param1: requests session
+        param2: check url (`tcp://ip:port` for a port check)
+        param3: ok only on 200 (`False`: on any answer below 500)
+        return: dict w/ ok, latency (seconds, `None` if no answer) and detail
+    '''
+    import requests
+    timeout = CLI_CONFIG['status_timeout']
+    start_time = time.monotonic()
+    if url.startswith('tcp://'):
+        host, port = url[len('tcp://'):].rsplit(':', 1)
+        is_open = rdy.is_port_open(host, int(port), timeout=timeout)
+        return {'ok': is_open,
+                'latency': time.monotonic() - start_time if is_open else None,
+                'detail': 'open' if is_open else 'closed'}
+    try:
+        code = session.get(url, timeout=(timeout, timeout), allow_redirects=False).status_code
+    except requests.Timeout:
+        return {'ok': False, 'latency': None, 'detail': 'timeout'}
+    except requests.RequestException:
+        return {'ok': False, 'latency': None, 'detail': 'unreachable'}
+    return {'ok': code == 200 if strict else code < 500,
+            'latency': time.monotonic() - start_time,
+            'detail': str(code)}
+
+def cached_probe(session, node_name, check_name, check, latencies):
+    '''
+    Return the last result of a check if younger than `status_cache_ttl`,
+    else run it again (fresh latencies are added to `latencies`)
+
+    Args:
+        param1: requests session
+        param2: node name
+        param3: check name
+        param4: (url, strict)
+        param5: dict check name -> latency samples deque
+        return: result dict (see `probe`)
+    '''
+    now = time.monotonic()
+    with _CACHE_LOCK:
+        cached = _CACHE.get((node_name, check_name))
+    if cached is not None and now - cached[0] < CLI_CONFIG['status_cache_ttl']:
+        return cached[1]
+    res = probe(session, *check)
+    with _CACHE_LOCK:
+        _CACHE[(node_name, check_name)] = (now, res)
+        if res['latency'] is not None:
+            latencies[check_name].append(res['latency'])
+    return res
+
+def node_health(checks):
+    '''
+    Summarize the results of a node
+
+    Args:
+        param1: dict check name -> result dict (`None` if the IP is unknown)
+        return: `healthy`, `degraded (<failed checks>)` or `down`
+    '''
+    if checks is None or not checks['ssh']['ok']:
+        return 'down'
+    failed = [name for name, res in checks.items() if not res['ok']]
+    return f'degraded ({", ".join(failed)})' if failed else 'healthy'
+
+def sweep(session, node_names, parallel, latencies):
+    '''
+    Run every check of every node concurrently (at most `parallel` at a
+    time), then record health and last seen time in the registry
+
+    Args:
+        param1: requests session
+        param2: node names list
+        param3: max concurrent checks
+        param4: dict check name -> latency samples deque
+        return: dict node name -> dict check name -> result (`None` if the IP is unknown)
+    '''
+    node_checks_map = {n: node_checks(n) for n in node_names}
+    tasks = [(node_name, check_name, check)
+             for node_name, checks in node_checks_map.items() if checks is not None
+             for check_name, check in checks.items()]
+    results = utl.run_parallel(lambda task: cached_probe(session, *task, latencies),
+                               tasks, parallel)
+    by_node = {node_name: None if checks is None else {} for node_name, checks
+               in node_checks_map.items()}
+    for (node_name, check_name, _), res in results.items():
+        if isinstance(res, Exception):
+            res = {'ok': False, 'latency': None, 'detail': 'error'}
+        by_node[node_name][check_name] = res
+    now = time.time()
+    node_fields = {}
+    for node_name, checks in by_node.items():
+        node_fields[node_name] = {'health': node_health(checks)}
+        if checks is not None and checks['ssh']['ok']:
+            node_fields[node_name]['last_seen'] = now
+    reg.update_nodes(node_fields)
+    return by_node
+
+def percentile(samples, pct):
+    '''
+    Return the nearest-rank percentile of the samples
+
+    Args:
+        param1: sorted samples list
+        param2: percentile (0-100)
+        return: sample value
+    '''
+    return samples[max(0, min(len(samples) - 1, math.ceil(pct / 100 * len(samples)) - 1))]
+
+def format_cell(res):
+    '''
+    Return a check result as a table cell
+
+    Args:
+        param1: result dict (or `None`)
+        return: cell string (ie: `ok 12ms`, `503`, `timeout`)
+    '''
+    if res is None:
+        return '-'
+    if res['ok']:
+        return f'ok {res["latency"] * 1000:.0f}ms'
+    return res['detail']
+
+def print_status(by_node, latencies, duration):
+    '''
+    Print a row per node (one column per check, then the node health) and
+    the latency percentiles per check
+
+    Args:
+        param1: dict node name -> dict check name -> result (`None` if the IP is unknown)
+        param2: dict check name -> latency samples deque
+        param3: sweep duration in seconds
+    '''
+    check_names = ['ssh', 'dashboard'] + list(CLI_CONFIG['bridge_endpoints'])
+    rows = [['node'] + check_names + ['health']]
+    for node_name in sorted(by_node):
+        checks = by_node[node_name] or {}
+        rows.append([node_name]
+                    + [format_cell(checks.get(name)) for name in check_names]
+                    + [node_health(by_node[node_name])])
+    widths = [max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+    for row in rows:
+        line = '>>> ' + '  '.join(f'{val:<{widths[col]}}' for col, val in enumerate(row)).rstrip()
+        print(line if row[-1] in ('health', 'healthy') else utl.print_err_str(line))
+    healthy = sum(1 for checks in by_node.values() if node_health(checks) == 'healthy')
+    print(f'\n>>> {healthy}/{len(by_node)} healthy - checked in {duration:.2f}s')
+    name_width = max(len(name) for name in check_names + ['latency'])
+    print(f'>>> {"latency":<{name_width}}  {"p50":>7}  {"p90":>7}  {"p99":>7}  samples')
+    for name in check_names:
+        samples = sorted(latencies[name])
+        if not samples:
+            print(f'>>> {name:<{name_width}}  {"-":>7}  {"-":>7}  {"-":>7}  0')
+            continue
+        pcts = '  '.join(f'{percentile(samples, pct) * 1000:>5.0f}ms' for pct in (50, 90, 99))
+        print(f'>>> {name:<{name_width}}  {pcts}  {len(samples)}')
+
+def status_mng(args, node_names):
+    '''
+    Manage `node status`: check ssh, dashboard and bridge endpoints of the
+    nodes over a pooled keep-alive session and print a table
+    `--watch SECS` redraws it every SECS seconds (results younger than
+    `status_cache_ttl` are reused), until ctrl+c
+    Exit w/ error if a node is not healthy (no watch)
+
+    Args:
+        param1: CLI args
+        param2: node names list
+    '''
+    parallel = max(1, args.parallel * (2 + len(CLI_CONFIG['bridge_endpoints'])))
+    session = rdy.http_session(pool_size=parallel)
+    latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+    try:
+        while True:
+            start_time = time.monotonic()
+            by_node = sweep(session, node_names, parallel, latencies)
+            if args.watch_secs is not None:
+                # redraw in place
+                sys.stdout.write('\033[H\033[J')
+            print_status(by_node, latencies, time.monotonic() - start_time)
+            if args.watch_secs is None:
+                break
+            print(f'>>> refreshing every {args.watch_secs:g}s - ctrl+c to quit')
+            time.sleep(max(0, args.watch_secs - (time.monotonic() - start_time)))
+    except KeyboardInterrupt:
+        print()
+        return
+    finally:
+        session.close()
+    if any(node_health(checks) != 'healthy' for checks in by_node.values()):
+        sys.exit(1)
@@ -1,19 +1,36 @@
+import functools
 import json
 import logging
 import os
-import time
+import re
+import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
+from contextlib import nullcontext
 from tqdm import tqdm
 import hcl
 
 import ansible as ans
+import inventory as inv
 import node
+import readiness as rdy
+import registry as reg
+import stages as stg
+import tracing as trc
 import utils as utl
 from client_config import CLI_CONFIG
 
 
 logger = logging.getLogger(__name__)
 
+# guards the terraform CLI config rewrite (concurrent `--count N` stages)
+_TF_RC_LOCK = threading.Lock()
+
+# `terraform init` is not safe on a shared plugin cache, run one at a time
+_TF_INIT_LOCK = threading.Lock()
+
 def replace_variables_tf(args_dict, node_name):
     '''
     Dynamically load variables template
@@ -43,20 +60,191 @@ def replace_variables_tf(args_dict, node_name):
         logger.error(f'Error writing {node_name}/variables.tf.json\n{exc}')
         print(utl.print_err_str(f'>>> error writing {node_name}/variables.tf.json'))
 
-def tf_cmd(cmd, node_name):
+@functools.lru_cache(maxsize=None)
+def tf_cli_config():
+    '''
+    Write the terraform CLI config used by every node dir (once per process,
+    atomically and under a lock, as node stages may run concurrently):
+    providers are linked from the shared plugin cache and, once the local
+    mirror is seeded (`pcli providers seed`), installed from the mirror
+    instead of the registry
+
+    Args:
+        return: terraform CLI config file path
+    '''
+    cache_path = CLI_CONFIG['tf_plugin_cache_path']
+    mirror_path = CLI_CONFIG['tf_provider_mirror_path']
+    os.makedirs(cache_path, exist_ok=True)
+    tf_rc = f'plugin_cache_dir = "{cache_path}"\n'
+    if os.path.isdir(mirror_path) and os.listdir(mirror_path):
+        tf_rc += ('provider_installation {\n'
+                  '  filesystem_mirror {\n'
+                  f'    path    = "{mirror_path}"\n'
+                  f'    include = {json.dumps(CLI_CONFIG["tf_mirror_providers"])}\n'
+                  '  }\n'
+                  '  direct {\n'
+                  f'    exclude = {json.dumps(CLI_CONFIG["tf_mirror_providers"])}\n'
+                  '  }\n'
+                  '}\n')
+    with _TF_RC_LOCK:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(CLI_CONFIG['tf_cli_config_path']),
+                                        prefix='.terraformrc.')
+        with os.fdopen(fd, 'w') as f_tf_rc:
+            f_tf_rc.write(tf_rc)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, CLI_CONFIG['tf_cli_config_path'])
+    logger.info(f'{CLI_CONFIG["tf_cli_config_path"]} written')
+    return CLI_CONFIG['tf_cli_config_path']
+
+def tf_required_providers_block():
+    '''
+    Return the `terraform { required_providers {...} }` block of the main.tf template
+
+    Args:
+        return: terraform block string
+    '''
+    with open(CLI_CONFIG['tf_main_orig_path']) as f_main:
+        main_tf = f_main.read()
+    start = main_tf.index('terraform {')
+    depth = 0
+    for pos in range(main_tf.index('{', start), len(main_tf)):
+        if main_tf[pos] == '{':
+            depth += 1
+        elif main_tf[pos] == '}':
+            depth -= 1
+            if depth == 0:
+                return main_tf[start:pos + 1] + '\n'
+    raise ValueError(f'{CLI_CONFIG["tf_main_orig_path"]}: unterminated terraform block')
+
+def extract_tarball(f_tar, dest_path):
+    '''
+    Extract a tarball refusing members outside `dest_path`, links, devices
+    and special permission bits (the `data` extraction filter, where available)
+
+    Args:
+        param1: open tarfile
+        param2: destination dir path
+        return: raise tarfile.TarError if a member is not allowed
+    '''
+    if hasattr(tarfile, 'data_filter'):
+        f_tar.extractall(dest_path, filter='data')
+        return
+    dest_path = os.path.realpath(dest_path)
+    for member in f_tar.getmembers():
+        member_path = os.path.realpath(os.path.join(dest_path, member.name))
+        if os.path.commonpath([dest_path, member_path]) != dest_path:
+            raise tarfile.TarError(f'{member.name}: outside the destination dir')
+        if not (member.isfile() or member.isdir()):
+            raise tarfile.TarError(f'{member.name}: not a file or a dir')
+        member.mode &= 0o755
+    f_tar.extractall(dest_path)
+
+def seed_providers(tarball_path=None):
+    '''
+    Fill the local provider mirror, from the registry (`terraform providers mirror`)
+    or from an offline tarball of a mirror dir, then pre-load the shared plugin
+    cache from it, so that `terraform init` in node dirs only links providers
+
+    Args:
+        param1: [optional] offline mirror tarball path
+    '''
+    mirror_path = CLI_CONFIG['tf_provider_mirror_path']
+    os.makedirs(mirror_path, exist_ok=True)
+    with tempfile.TemporaryDirectory() as seed_dir:
+        with open(f'{seed_dir}/versions.tf', 'w') as f_versions:
+            f_versions.write(tf_required_providers_block())
+        if tarball_path is not None:
+            logger.info(f'Extracting {tarball_path} in {mirror_path}')
+            print(f'>>> extracting {tarball_path} in {mirror_path}')
+            with tarfile.open(tarball_path) as f_tar:
+                extract_tarball(f_tar, mirror_path)
+        else:
+            logger.info(f'Mirroring terraform providers in {mirror_path}')
+            print(f'>>> mirroring terraform providers in {mirror_path}')
+            if not utl.run_cmd(f'cd {seed_dir}; terraform providers mirror '
+                               f'-platform=linux_amd64 {mirror_path} '
+                               f'>> {CLI_CONFIG["pcli_log_path"]} 2>&1'):
+                raise RuntimeError('terraform providers mirror failed')
+        tf_cli_config.cache_clear()
+        logger.info('Loading terraform providers in plugin cache')
+        print('>>> loading terraform providers in plugin cache')
+        if not utl.run_cmd(f'cd {seed_dir}; TF_CLI_CONFIG_FILE={tf_cli_config()} '
+                           'terraform init -backend=false -input=false '
+                           f'>> {CLI_CONFIG["pcli_log_path"]} 2>&1'):
+            raise RuntimeError('terraform init failed while loading the plugin cache')
+    print(utl.print_ok_str('>>> terraform providers seeded'))
+
+def providers_status():
+    '''
+    Print the providers found in the local mirror and in the plugin cache
+
+    Args:
+        return: None
+    '''
+    for desc, path in (('mirror', CLI_CONFIG['tf_provider_mirror_path']),
+                       ('plugin cache', CLI_CONFIG['tf_plugin_cache_path'])):
+        found = False
+        for root, _, files in os.walk(path):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                if file_name.startswith('terraform-provider-') or file_name.endswith('.zip'):
+                    found = True
+                    size_mb = os.path.getsize(file_path) / 2**20
+                    print(f'>>> {desc}: {os.path.relpath(file_path, path)} ({size_mb:.0f} MB)')
+        if not found:
+            print(f'>>> {desc}: empty')
+
+def providers_mng(args):
+    '''
+    Manage the `providers` commands (shared terraform provider cache)
+
+    Args:
+        param1: CLI args
+    '''
+    if args.action[0] == 'seed':
+        logger.info('Run command providers seed')
+        try:
+            seed_providers(args.tarball_path)
+        except Exception as exc:
+            logger.error(f'Error seeding terraform providers\n{exc}')
+            print(utl.print_err_str(f'>>> error seeding terraform providers: {exc}'))
+            sys.exit(1)
+    elif args.action[0] == 'status':
+        logger.info('Run command providers status')
+        providers_status()
+
+# terraform subcommands are built by pcli (no secrets), recorded in full
+@trc.traced('terraform', label_arg='cmd', redact=())
+def tf_cmd(cmd, node_name, interactive=False):
     '''
-    Move into terraform bin folder and run command
-    (terraform init works on dir so need to move into that folder in order to run
+    Run terraform command in the node's terraform folder
+    (terraform init works on dir so need to run it into that folder in order to run
     terraform commands related to that instance [<node_name>.tfstate file])
+    Output is streamed line by line in the pcli log (to the console in
+    interactive mode, ie: `apply` w/o `-auto-approve`)
+    `init` runs one at a time (the shared plugin cache is not concurrency safe)
 
     Args:
         param1: command to run
         param2: node name
+        param3: [optional] interactive mode
+        return: raise RuntimeError if the command fails
     '''
     logger.info(f'Running: terraform {cmd}')
     tqdm.write(f'>>> running: terraform {cmd}')
-    utl.run_cmd(f'cd {CLI_CONFIG["tf_config_dir"]}{node_name}; terraform {cmd} '
-                f'>> {CLI_CONFIG["pcli_log_path"]} 2>&1')
+    argv = ['terraform'] + cmd.split()
+    tf_dir = f'{CLI_CONFIG["tf_config_dir"]}{node_name}'
+    tf_env = dict(os.environ, TF_CLI_CONFIG_FILE=tf_cli_config())
+    with _TF_INIT_LOCK if argv[1] == 'init' else nullcontext():
+        if interactive is True:
+            rc = subprocess.run(argv, cwd=tf_dir, env=tf_env).returncode
+            output = ''
+        else:
+            res = utl.run_argv(argv, cwd=tf_dir, env=tf_env,
+                               on_line=utl.line_logger(f'{node_name}: terraform {argv[1]}'))
+            rc, output = res['rc'], '\n'.join(res['output'].splitlines()[-20:])
+    if rc != 0:
+        raise RuntimeError(f'terraform {cmd} failed on {node_name} (exit code {rc})\n{output}')
     logger.info(f'Terraform {cmd}: complete')
     tqdm.write(f'>>> terraform {cmd}: complete')
 
@@ -69,20 +257,27 @@ def destroy_instance(node_name):
     '''
     if str(input(f'>>> DESTROY {node_name}? ARE YOU REALLY SURE? (y/n): ') or 'n') == 'y':
         logger.info(f'Destroy {node_name} confirmed')
+        utl.close_ssh_master(node_name)
 
-        tf_cmd(f'destroy -auto-approve', node_name)
+        try:
+            tf_cmd(f'destroy -auto-approve', node_name)
+        except RuntimeError as exc:
+            logger.error(f'terraform destroy error:\n{exc}')
+            print(utl.print_err_str(f'>>> terraform destroy error: {exc}'))
+            sys.exit(1)
         utl.run_cmd(f'rm -rf {CLI_CONFIG["tf_config_dir"]}{node_name}')
         utl.run_cmd(f'rm -rf {CLI_CONFIG["pcli_ssh_key_path"]}{node_name}*')
         utl.run_cmd(f'rm -rf {CLI_CONFIG["ans_hosts_path"]}-{node_name}')
         utl.run_cmd(f'rm -rf {CLI_CONFIG["tf_config_dir"]}.{node_name}')
+        inv.list_nodes.cache_clear()
+        reg.remove_node(node_name)
         logger.info(f'{node_name} destroyed')
         print(f'>>> {node_name} destroyed')
 
 def input_str(i_key, i_value, args_dict, node_name, PICK=''):
     '''
     Dynamically ask for values on stdin
-    Write operator access_key_id and secret_key_id on instance path ~/.iam_credentials
-    If `PICK` -> pickle state found, so check if key in PICK (var in state) and
+    If `PICK` -> saved state found, so check if key in PICK (var in state) and
     print in stdout as default to not loose last stdin values
     If no state found, ask user for value while printing a default
 
@@ -93,7 +288,6 @@ def input_str(i_key, i_value, args_dict, node_name, PICK=''):
         param4: [optional] PICK dict
         return: args dictionary got in input, edited (exit if `KeyboardInterrupt`)
     '''
-    iam_cred_dict = {}
     try:
         if PICK:
             old_val = list({k:v for k, v in PICK.items() if k == i_key}.values())[0]
@@ -110,14 +304,11 @@ def input_str(i_key, i_value, args_dict, node_name, PICK=''):
                                 f'(default: {i_value}): ') or i_value)
         else:
             new_val = str(input(f'>>> insert {i_key} (default: {i_value}): ') or i_value)
-            iam_cred_dict[i_key[:-3]] = new_val
-        json_iam_cred = json.dumps(iam_cred_dict)
-        utl.write_file(json.loads(json_iam_cred), CLI_CONFIG['iam_cred_path'])
         if new_val != '':
             args_dict[i_key] = new_val
             return args_dict
     except KeyboardInterrupt:
-        utl.write_file(args_dict, CLI_CONFIG['inst_state_path'], state=True)
+        utl.save_inst_state(node_name, args_dict)
         utl.run_cmd(f'rm -rf {CLI_CONFIG["tf_config_dir"]}/{node_name}')
         sys.exit(1)
 
@@ -131,11 +322,8 @@ def loop_inst_config_and_edit_dict(node_name):
         param1: node name
         return: args dictionary, edited
     '''
-    state = False
     args_dict = json.load(open(CLI_CONFIG['inst_config_path']))
-    if os.path.isfile(CLI_CONFIG['inst_state_path']):
-        PICK = utl.read_file(CLI_CONFIG['inst_state_path'], state=True)
-        state = True
+    state_node, PICK = utl.read_inst_state(node_name)
     for key, value in args_dict.items():
         if key in ('access_key_id', 'secret_access_key') and os.getenv(key.upper()):
             logger.info('Found {key} in env')
@@ -150,11 +338,12 @@ def loop_inst_config_and_edit_dict(node_name):
         elif key == 'region':
             args_dict[key] = utl.pick_up_a_region()
         else:
-            if state is True and [k_s for k_s in PICK.keys() if key in k_s]:
+            if PICK and key in PICK:
                 args_dict = input_str(key, value, args_dict, node_name, PICK=PICK)
             else:
                 args_dict = input_str(key, value, args_dict, node_name)
-    utl.run_cmd(f'rm -rf {CLI_CONFIG["inst_state_path"]}')
+    if state_node is not None:
+        utl.save_inst_state(state_node)
     return args_dict
 
 def dump_default_variable_tf(node_name):
@@ -196,138 +385,546 @@ def dump_default_variable_tf(node_name):
             if new_val != '':
                 args_dict[key] = new_val
             iam_cred_dict[key[:-3]] = new_val
-            with open('./.iam_credentials', 'w') as f:
-                f.write(json.dumps(iam_cred_dict))
     return args_dict, iam_cred_dict
 
+def iam_cred_file(node_name):
+    '''
+    Return the local operator IAM credentials file path of a node
+
+    Args:
+        param1: node name
+        return: credentials file path (in the node dir)
+    '''
+    return f'{CLI_CONFIG["tf_config_dir"]}{node_name}/.iam_credentials'
+
+def dump_iam_cred(node_name, args_dict):
+    '''
+    Write the operator IAM credentials (`*_op` inputs, or `*_OP` env vars)
+    in the node dir, whatever the input mode, to be copied on the node
+
+    Args:
+        param1: node name
+        param2: args dictionary
+        return: credentials file path (`None` if no credentials were given)
+    '''
+    iam_cred_dict = {key: args_dict.get(f'{key}_op') or os.getenv(f'{key.upper()}_OP', '')
+                     for key in ('access_key_id', 'secret_access_key')}
+    if not any(iam_cred_dict.values()):
+        logger.warning(f'{node_name}: no operator IAM credentials given')
+        return None
+    iam_cred_path = iam_cred_file(node_name)
+    utl.write_file(iam_cred_dict, iam_cred_path, json_f=True)
+    logger.info(f'{node_name}: operator IAM credentials dumped in {iam_cred_path}')
+    return iam_cred_path
+
+def stage_keygen(ctx):
+    '''
+    Provisioning stage: create the node ssh keypair (if not found)
+
+    Args:
+        param1: provisioning context
+    '''
+    node_name = ctx['node_name']
+    if not utl.check_for_file_in_path(f'{node_name}',
+                                      CLI_CONFIG['pcli_ssh_key_path']):
+        utl.create_ssh_keypair(node_name)
+    else:
+        logger.info(f'Found ssh keypair in {CLI_CONFIG["pcli_ssh_key_path"]}.ssh')
+        tqdm.write(f'>>> found ssh keypair in {CLI_CONFIG["pcli_ssh_key_path"]}.ssh')
+
+def stage_tf_files(ctx):
+    '''
+    Provisioning stage: write the node terraform files
+
+    Args:
+        param1: provisioning context
+    '''
+    node_name = ctx['node_name']
+    replace_variables_tf(ctx['args_dict'], node_name)
+    main_tf_path = CLI_CONFIG['tf_config_dir'] + f'{node_name}/main.tf'
+    output_tf_path = CLI_CONFIG['tf_config_dir'] + f'{node_name}/output.tf'
+    utl.copy_file_in_path(CLI_CONFIG['tf_main_orig_path'],
+                          main_tf_path)
+    utl.copy_file_in_path(CLI_CONFIG['tf_output_orig_path'],
+                          output_tf_path)
+
+def stage_tf_init(ctx):
+    '''
+    Provisioning stage: terraform init
+
+    Args:
+        param1: provisioning context
+    '''
+    tf_cmd('init', ctx['node_name'])
+
+def stage_tf_plan(ctx):
+    '''
+    Provisioning stage: terraform plan
+
+    Args:
+        param1: provisioning context
+    '''
+    tf_cmd('plan', ctx['node_name'])
+
+def stage_tf_apply(ctx):
+    '''
+    Provisioning stage: terraform apply (interactive in advanced mode)
+
+    Args:
+        param1: provisioning context
+    '''
+    if ctx['adv_mode'] is None:
+        tf_cmd('apply -auto-approve', ctx['node_name'])
+    else:
+        tf_cmd('apply', ctx['node_name'], interactive=True)
+
+def stage_hosts_file(ctx):
+    '''
+    Provisioning stage: write the node ansible hosts file
+
+    Args:
+        param1: provisioning context
+    '''
+    node_name = ctx['node_name']
+    ctx['pub_ip'] = utl.get_pub_ip(node_name)
+    hosts_file_name = f'hosts-{node_name}'
+    if not utl.check_for_file_in_path(hosts_file_name,
+                                      CLI_CONFIG["ans_root"]):
+        ans.write_ansible_hosts_file(ctx['pub_ip'],
+                                     CLI_CONFIG['inst_user'],
+                                     CLI_CONFIG['pcli_ssh_key_path'] + node_name,
+                                     node_name)
+
+def stage_wait_ssh(ctx):
+    '''
+    Provisioning stage: wait for the new machine to accept ssh connections
+
+    Args:
+        param1: provisioning context
+    '''
+    logger.info('Wait for machine to be ready')
+    tqdm.write('>>> waiting for machine to be ready')
+    rdy.wait_for_ssh(ctx['node_name'])
+
+def stage_iam_cred(ctx):
+    '''
+    Provisioning stage: copy operator IAM credentials on the node (skipped
+    w/ a warning if none were given)
+
+    Args:
+        param1: provisioning context
+    '''
+    iam_cred_path = ctx.get('iam_cred_path') or iam_cred_file(ctx['node_name'])
+    if not os.path.isfile(iam_cred_path):
+        logger.warning(f'{ctx["node_name"]}: {iam_cred_path} not found, IAM credentials '
+                       'not copied')
+        tqdm.write(utl.print_err_str(f'>>> {ctx["node_name"]}: operator IAM credentials '
+                                     'not found, not copied on the node'))
+        return
+    utl.scp_file(CLI_CONFIG['iam_cred_path'], iam_cred_path, ctx['node_name'], to_node=True)
+
+def stage_sys_config(ctx):
+    '''
+    Provisioning stage: install tools on the node (sys_config playbook)
+
+    Args:
+        param1: provisioning context
+    '''
+    ans.sys_config(ctx['node_name'])
+
+def saved_user_pwd(pwd_file_path):
+    '''
+    Return the instance user password dumped by a previous run (resume)
+
+    Args:
+        param1: credentials file path
+        return: password (`None` if not found)
+    '''
+    try:
+        with open(pwd_file_path) as f_cred:
+            match = re.search(r' - pwd: (\S+) - ', f_cred.readline())
+    except FileNotFoundError:
+        return None
+    return match.group(1) if match else None
+
+def stage_user_pwd(ctx):
+    '''
+    Provisioning stage: generate and dump the instance user password
+    On resume the password of the checkpoint (or of the credentials file)
+    is kept, so the node and the dumped credentials stay in sync
+
+    Args:
+        param1: provisioning context
+    '''
+    node_name = ctx['node_name']
+    pwd_file_path = f'{CLI_CONFIG["tf_config_dir"]}{node_name}/.{node_name}-cred'
+    ctx['cred_path'] = pwd_file_path
+    saved_pwd = saved_user_pwd(pwd_file_path)
+    ctx['pwd'] = ctx.get('pwd') or saved_pwd or utl.random_pwd_generator()
+    if saved_pwd == ctx['pwd']:
+        logger.info(f'Credentials found in {pwd_file_path}')
+        return
+    pwd_file_content = (f'user: {CLI_CONFIG["inst_user"]} - pwd: '
+                        f'{ctx["pwd"]} - IP: {ctx["pub_ip"]}\n')
+    if saved_pwd is not None:
+        os.remove(pwd_file_path)
+    utl.write_file(pwd_file_content, pwd_file_path)
+    logger.info(f'Credentials dumped in {pwd_file_path}')
+    tqdm.write(f'>>> credentials dumped in {pwd_file_path}')
+
+def stage_set_user_pwd(ctx):
+    '''
+    Provisioning stage: set the instance user password (edit_user_pwd playbook)
+
+    Args:
+        param1: provisioning context
+    '''
+    ans.edit_inst_user_pwd(ctx['node_name'], ctx['pwd'])
+
+def stage_node_cred(ctx):
+    '''
+    Provisioning stage: store the password on the node, once sshd is back
+
+    Args:
+        param1: provisioning context
+    '''
+    rdy.wait_for_ssh(ctx['node_name'])
+    utl.run_remote_cmd(f"echo '{ctx['pwd']}' > {CLI_CONFIG['inst_cred_path']}",
+                       ctx['node_name'], log=True)
+
+def stage_reboot(ctx):
+    '''
+    Provisioning stage: reboot the node and wait for it to come back
+
+    Args:
+        param1: provisioning context
+    '''
+    node_name = ctx['node_name']
+    boot_id = rdy.get_boot_id(node_name)
+    utl.reboot_system(node_name)
+    logger.info('Wait for machine to come back online after reboot')
+    tqdm.write('>>> waiting for machine to come back online after reboot')
+    rdy.wait_for_reboot(node_name, boot_id)
+
+def pnode_rel_url(ctx):
+    '''
+    Return the pnode release-server url (prod or dev - based on `--dev` arg)
+
+    Args:
+        param1: provisioning context
+        return: release-server url
+    '''
+    if ctx['dev_mode'] is True:
+        return CLI_CONFIG['pnetwork_pnode_url_dev']
+    return CLI_CONFIG['pnetwork_pnode_url']
+
+def stage_pnode_package(ctx):
+    '''
+    Provisioning stage: install the pnode package (prod or dev release server)
+
+    Args:
+        param1: provisioning context
+    '''
+    ans.deploy_pnode_package_playbook(ctx['node_name'], pnode_rel_url(ctx))
+
+def stage_bootstrap(ctx):
+    '''
+    Provisioning stage: install tools, set the user password, store the
+    credentials, reboot and install the pnode package in a single ansible run
+
+    Args:
+        param1: provisioning context
+    '''
+    ans.bootstrap_node(ctx['node_name'], ctx['pwd'], pnode_rel_url(ctx),
+                       ctx.get('iam_cred_path') or iam_cred_file(ctx['node_name']))
+    # the machine rebooted, any master connection opened before is dead
+    utl.close_ssh_master(ctx['node_name'])
+
+def stage_pnode_start(ctx):
+    '''
+    Provisioning stage: start every pnode component
+
+    Args:
+        param1: provisioning context
+    '''
+    node.pnode_setup_and_start_cmds(ctx['node_name'], ctx['pwd'])
+
+def provisioning_stages(update=False, bootstrap=True):
+    '''
+    Return the provisioning stages graph (in update mode, terraform stages only)
+    In bootstrap mode the ansible playbooks, credentials and reboot stages
+    are replaced by a single ansible run (see `ansible.bootstrap_node`)
+
+    Args:
+        param1: [optional] update mode
+        param2: [optional] bootstrap mode
+        return: dict stage name -> (stage function, dependencies list)
+    '''
+    stages = {'terraform files': (stage_tf_files, []),
+              'terraform init': (stage_tf_init, ['terraform files']),
+              'terraform plan': (stage_tf_plan, ['terraform init']),
+              'terraform apply': (stage_tf_apply, ['terraform plan'])}
+    if update is True:
+        return stages
+    stages['ssh keypair'] = (stage_keygen, [])
+    stages['terraform plan'] = (stage_tf_plan, ['terraform init', 'ssh keypair'])
+    stages.update({
+        'ansible hosts file': (stage_hosts_file, ['terraform apply']),
+        'startup machine': (stage_wait_ssh, ['terraform apply']),
+        'user password': (stage_user_pwd, ['ansible hosts file'])})
+    if bootstrap is True:
+        stages.update({
+            'bootstrap node': (stage_bootstrap, ['user password', 'startup machine']),
+            'start node': (stage_pnode_start, ['bootstrap node'])})
+        return stages
+    stages.update({
+        'iam credentials': (stage_iam_cred, ['startup machine']),
+        'install tools on machine': (stage_sys_config, ['ansible hosts file',
+                                                        'startup machine']),
+        'set user password': (stage_set_user_pwd, ['user password',
+                                                   'install tools on machine']),
+        'node credentials': (stage_node_cred, ['set user password']),
+        'reboot machine': (stage_reboot, ['node credentials', 'iam credentials']),
+        'setup node': (stage_pnode_package, ['reboot machine']),
+        'start node': (stage_pnode_start, ['setup node'])})
+    return stages
+
+def node_args_dict(args_dict, tmpl_node_name, node_name):
+    '''
+    Return a copy of the terraform variables collected for `tmpl_node_name`
+    w/ the node-specific values set for `node_name`
+
+    Args:
+        param1: args dictionary
+        param2: node name the args dictionary was collected for
+        param3: node name
+        return: args dictionary, edited
+    '''
+    new_args_dict = dict(args_dict)
+    for key in ('inst_name', 'key_name', 'sg_name', 'sg_desc', 'vpc_name'):
+        if new_args_dict.get(key) == tmpl_node_name:
+            new_args_dict[key] = node_name
+    new_args_dict['priv_key_path'] = CLI_CONFIG['pcli_ssh_key_path'] + node_name
+    new_args_dict['pub_key_path'] = CLI_CONFIG['pcli_ssh_key_path'] + node_name + '.pub'
+    return new_args_dict
+
+def new_node_names(count):
+    '''
+    Generate `count` random node names not already in use
+
+    Args:
+        param1: number of names
+        return: node names list
+    '''
+    node_names = []
+    while len(node_names) < count:
+        node_name = utl.random_name_generator()
+        if node_name in node_names or utl.check_for_file_in_path(node_name,
+                                                                 CLI_CONFIG['tf_config_dir'],
+                                                                 isdir=True):
+            logger.info(f'{node_name}: name already in use')
+            print(f'>>> {node_name}: name already in use - generating a new one')
+            continue
+        node_names.append(node_name)
+    return node_names
+
+def checkpoint_path(node_name):
+    '''
+    Return the provisioning checkpoint file path of a node
+
+    Args:
+        param1: node name
+        return: checkpoint file path
+    '''
+    return f'{CLI_CONFIG["tf_config_dir"]}{node_name}/.{node_name}-checkpoint.json'
+
+def provision_node(ctx, update=False, position=None, done=None):
+    '''
+    Run the provisioning stages of a single node
+    Completed stages and the context they filled (IP, password, ...) are
+    checkpointed in the node dir after every stage, so a failed provisioning
+    can be resumed w/ `pcli node provisioning --resume <node>`
+
+    Args:
+        param1: provisioning context (node name, args dictionary, modes)
+        param2: [optional] update mode
+        param3: [optional] progress bar position (batch provisioning)
+        param4: [optional] already completed stage names (resume)
+        return: provisioning context, `run_stages` result
+    '''
+    node_name = ctx['node_name']
+    stages = provisioning_stages(update, bootstrap=ctx.get('bootstrap', False))
+    done_stages = [name for name in stages if name in (done or ())]
+    p_bar = tqdm(total=len(stages),
+                 initial=len(done_stages),
+                 position=position,
+                 desc=node_name if position is not None else None,
+                 bar_format='{desc} {percentage:.0f}%|{bar}| {n_fmt}/{total_fmt}')
+
+    def stage_done(stage_name):
+        done_stages.append(stage_name)
+        if update is False:
+            utl.write_file({'stages': done_stages, 'ctx': dict(ctx)},
+                           checkpoint_path(node_name),
+                           json_f=True)
+        if position is None:
+            p_bar.set_description(stage_name)
+        p_bar.update(1)
+
+    res = stg.run_stages(stages, ctx, done=done_stages, on_stage_done=stage_done,
+                         thread_name_prefix=node_name)
+    p_bar.close()
+    for stage_name, exc in res['failed'].items():
+        logger.error(f'{node_name}: {stage_name} error:\n{exc!r}')
+        tqdm.write(utl.print_err_str(f'>>> {node_name}: {stage_name} error: {exc!r}'))
+    if 'terraform apply' in done_stages:
+        reg.record_node(node_name,
+                        health='provisioned' if not res['failed'] else 'provisioning failed')
+    return ctx, res
+
+def resume_provisioning(args):
+    '''
+    Resume a failed provisioning from its first incomplete stage, re-using
+    the inputs, password and files of the previous run
+
+    Args:
+        param1: CLI args
+    '''
+    node_name = args.resume_node
+    if not utl.check_for_file_in_path(os.path.basename(checkpoint_path(node_name)),
+                                      os.path.dirname(checkpoint_path(node_name)) + '/',
+                                      no_stdout=True):
+        logger.error(f'{node_name}: no provisioning checkpoint found')
+        print(utl.print_err_str(f'>>> {node_name}: no provisioning checkpoint found'))
+        sys.exit(1)
+    checkpoint = utl.read_file(checkpoint_path(node_name), json_f=True)
+    stages = provisioning_stages(bootstrap=checkpoint['ctx'].get('bootstrap', False))
+    pending = [name for name in stages if name not in checkpoint['stages']]
+    if not pending:
+        print(f'>>> {node_name}: provisioning already completed')
+        return
+    logger.info(f'Resuming {node_name} provisioning from {pending[0]}')
+    print(f'>>> resuming {node_name} provisioning from: {pending[0]}')
+    ctx, res = provision_node(checkpoint['ctx'], done=checkpoint['stages'])
+    if res['failed']:
+        print(f'>>> please run `pcli node provisioning --resume {node_name}` to retry or '
+              f'`pcli node clean -n {node_name}` to delete unused files')
+        sys.exit(1)
+    print_node_details(ctx)
+
+def print_node_details(ctx):
+    '''
+    Print access details of a provisioned node
+
+    Args:
+        param1: provisioning context
+    '''
+    pub_ip, new_rnd_pwd, node_name = ctx['pub_ip'], ctx['pwd'], ctx['node_name']
+    print(utl.print_ok_str('##########################'))
+    print(utl.print_ok_str('>>> configuration ended - details:'))
+    print(utl.print_ok_str(f'>>> ec2-user password: {new_rnd_pwd}'))
+    print(utl.print_ok_str(f'>>> {pub_ip} - {node_name}'))
+    print(utl.print_ok_str('>>> remember to save the password!'))
+    print(utl.print_ok_str('>>> node dashboard details:'))
+    print(utl.print_ok_str(f'>>> http://{pub_ip}:{CLI_CONFIG["dashboard_port"]}'))
+    print(utl.print_ok_str('>>> user: operator'))
+    print(utl.print_ok_str(f'>>> password: {new_rnd_pwd}'))
+
+def print_batch_summary(results):
+    '''
+    Print IP, credentials file and status of every node of a batch provisioning
+
+    Args:
+        param1: dict node name -> (provisioning context, `run_stages` result)
+                (or the raised exception)
+    '''
+    rows = [('node', 'IP', 'credentials', 'status')]
+    for node_name in sorted(results):
+        if isinstance(results[node_name], Exception):
+            rows.append((node_name, '-', '-', 'error'))
+            continue
+        ctx, res = results[node_name]
+        status = 'ok' if not res['failed'] else f'failed ({", ".join(res["failed"])})'
+        rows.append((node_name, ctx.get('pub_ip', '-'), ctx.get('cred_path', '-'), status))
+    widths = [max(len(str(row[col])) for row in rows) for col in range(3)]
+    print(utl.print_ok_str('##########################'))
+    for row in rows:
+        line = '>>> ' + '  '.join(f'{str(val):<{widths[col]}}'
+                                  for col, val in enumerate(row[:3])) + f'  {row[3]}'
+        print(line if row[3] in ('ok', 'status') else utl.print_err_str(line))
+
 def provisioning(args, update=False):
     '''
     Terraform instance provisioning, deploy the node via terraform, setup
     server w/ needed tools via ansible playbooks, start every service via pnode
     commands
+    Once the user inputs are collected, the provisioning stages run as soon
+    as their dependencies are completed (see `provisioning_stages`)
+    w/ `--count N`, N nodes are provisioned concurrently (max `--parallel`)
+    w/ the same inputs, a failing node doesn't stop the others
 
     Args:
         param1: CLI args
         param2: [optional] update mode
     '''
-    dev_mode = False
-    if args.dev_mode is True:
-        dev_mode = True
-    print('>>> given your selection, we will be provisioning a pnetwork node of type NITRO')
-    node_name = utl.random_name_generator()
-    if update is False and utl.check_for_file_in_path(node_name,
-                                                      CLI_CONFIG['tf_config_dir'],
-                                                      isdir=True):
-        logger.error(f'{node_name}: name already in use')
-        print(f'>>> {node_name}: name already in use')
+    if args.resume_node is not None:
+        resume_provisioning(args)
+        return
+    count = args.count if update is False else 1
+    if count < 1:
+        logger.error(f'Unexpected number of nodes: {count}')
+        print(utl.print_err_str(f'>>> unexpected number of nodes: {count}'))
+        sys.exit(1)
+    if count > 1 and args.adv_mode is not None:
+        logger.error('The following argument is not enabled w/ count > 1: advanced mode')
+        print('>>> error - the following argument is not enabled w/ count > 1: advanced mode')
         sys.exit(1)
+    print('>>> given your selection, we will be provisioning a pnetwork node of type NITRO')
     if update is False:
+        node_names = new_node_names(count)
         logger.info('Node provisioning called')
         print('>>> node provisioning called')
         print('>>> node name is valid')
-        utl.run_cmd(f'mkdir -p {CLI_CONFIG["tf_config_dir"]}{node_name}')
-        if not utl.check_for_file_in_path(f'{node_name}',
-                                          CLI_CONFIG['pcli_ssh_key_path']):
-            utl.create_ssh_keypair(node_name)
-        else:
-            logger.info(f'Found ssh keypair in {CLI_CONFIG["pcli_ssh_key_path"]}.ssh')
-            print(f'>>> found ssh keypair in {CLI_CONFIG["pcli_ssh_key_path"]}.ssh')
+        for node_name in node_names:
+            utl.run_cmd(f'mkdir -p {CLI_CONFIG["tf_config_dir"]}{node_name}')
+        inv.list_nodes.cache_clear()
     else:
+        node_names = [utl.random_name_generator()]
         logger.info('Node update called')
         print('>>> node update called')
         print('>>> node name is valid')
+    node_name = node_names[0]
     if args.adv_mode is None:
-        args_dict, iam_cred_dict = dump_default_variable_tf(node_name)
-        replace_variables_tf(args_dict, node_name)
+        args_dict, _ = dump_default_variable_tf(node_name)
     else:
-        replace_variables_tf(loop_inst_config_and_edit_dict(node_name),
-                             node_name)
-    main_tf_path = CLI_CONFIG['tf_config_dir'] + f'{node_name}/main.tf'
-    output_tf_path = CLI_CONFIG['tf_config_dir'] + f'{node_name}/output.tf'
-    utl.copy_file_in_path(CLI_CONFIG['tf_main_orig_path'],
-                          main_tf_path)
-    utl.copy_file_in_path(CLI_CONFIG['tf_output_orig_path'],
-                          output_tf_path)
-    p_bar = tqdm(total=100, bar_format='{desc} {percentage:.0f}%|{bar}| {n_fmt}/{total_fmt}')
-    p_bar.set_description('terraform init')
-    tf_cmd('init', node_name)
-    p_bar.update(5)
-    try:
-        p_bar.set_description('terraform plan')
-        tf_cmd('plan', node_name)
-        p_bar.update(15)
-    except Exception as exc:
-        logger.info(f'terraform plan error:\n{exc}')
-        tqdm.write(f'>>> terraform plan error:\n{exc}')
-        tqdm.write(f'>>> please run `pcli node clean -n {node_name}` to delete unused files')
-        sys.exit(1)
-    try:
-        p_bar.set_description('terraform apply')
-        if args.adv_mode is None:
-            tf_cmd(f'apply -auto-approve', node_name)
-        else:
-            tf_cmd(f'apply', node_name)
-        p_bar.update(15)
-    except Exception as exc:
-        logger.info(f'terraform apply error:\n{exc}')
-        tqdm.write(f'>>> terraform apply error:\n{exc}')
-        tqdm.write(f'>>> please run `pcli node clean -n {node_name}` to delete unused files')
+        args_dict = loop_inst_config_and_edit_dict(node_name)
+
+    def node_ctx(n):
+        ctx = {'node_name': n,
+               'args_dict': node_args_dict(args_dict, node_name, n),
+               'adv_mode': args.adv_mode,
+               'dev_mode': args.dev_mode,
+               'bootstrap': CLI_CONFIG['ans_bootstrap']}
+        if update is False:
+            ctx['iam_cred_path'] = dump_iam_cred(n, ctx['args_dict'])
+        return ctx
+
+    if count > 1:
+        results = utl.run_parallel(
+            lambda n: provision_node(node_ctx(n), position=node_names.index(n)),
+            node_names,
+            args.parallel)
+        print_batch_summary(results)
+        if any(isinstance(r, Exception) or r[1]['failed'] for r in results.values()):
+            print('>>> please run `pcli node provisioning --resume <node>` on failed nodes '
+                  'to retry or `pcli node clean -n <node>` to delete unused files')
+            sys.exit(1)
+        return
+    ctx, res = provision_node(node_ctx(node_name), update=update)
+    if res['failed']:
+        if update is False:
+            print(f'>>> please run `pcli node provisioning --resume {node_name}` to retry')
+        print(f'>>> please run `pcli node clean -n {node_name}` to delete unused files')
         sys.exit(1)
     if update is False:
-        pub_ip = utl.get_pub_ip(node_name)
-        hosts_file_name = f'hosts-{node_name}'
-        if not utl.check_for_file_in_path(hosts_file_name,
-                                          CLI_CONFIG["ans_root"]):
-            ans.write_ansible_hosts_file(pub_ip,
-                                         CLI_CONFIG['inst_user'],
-                                         CLI_CONFIG['pcli_ssh_key_path'] + node_name,
-                                         node_name)
-        logger.info('Wait for machine to be ready')
-        tqdm.write('>>> waiting for machine to be ready')
-        p_bar.set_description('startup machine')
-        time.sleep(40)
-        p_bar.update(10)
-        utl.scp_file('/home/ec2-user/.iam_credentials',
-                     './.iam_credentials',
-                     node_name, to_node=True)
-        p_bar.set_description('install tools on machine')
-        ans.sys_config(node_name)
-        p_bar.update(5)
-        p_bar.set_description('startup machine')
-        new_rnd_pwd = utl.random_pwd_generator()
-        pwd_file_content = (f'user: {CLI_CONFIG["inst_user"]} - pwd: '
-                            f'{new_rnd_pwd} - IP: {pub_ip}\n')
-        pwd_file_path = f'{CLI_CONFIG["tf_config_dir"]}{node_name}/.{node_name}-cred'
-        utl.write_file(pwd_file_content, pwd_file_path)
-        logger.info(f'Credentials dumped in {pwd_file_path}')
-        tqdm.write(f'>>> credentials dumped in {pwd_file_path}')
-        ans.edit_inst_user_pwd(node_name, new_rnd_pwd)
-        p_bar.update(5)
-        p_bar.set_description('startup machine')
-        time.sleep(20)
-        cred_file_echo_str = f"'{new_rnd_pwd}' > {CLI_CONFIG['inst_cred_path']}"
-        utl.run_remote_cmd(f'"echo {cred_file_echo_str}"', node_name)
-        p_bar.update(15)
-        p_bar.set_description('reboot machine')
-        utl.reboot_system(node_name)
-        logger.info('Wait for machine to come back online after reboot')
-        tqdm.write('>>> waiting for machine to come back online after reboot')
-        time.sleep(120)
-        p_bar.update(20)
-        p_bar.set_description('setup node')
-        if dev_mode is True:
-            ans.deploy_pnode_package_playbook(node_name, CLI_CONFIG['pnetwork_pnode_url_dev'])
-        else:
-            ans.deploy_pnode_package_playbook(node_name, CLI_CONFIG['pnetwork_pnode_url'])
-        node.pnode_setup_and_start_cmds(node_name, new_rnd_pwd)
-        print(utl.print_ok_str('##########################'))
-        print(utl.print_ok_str('>>> configuration ended - details:'))
-        print(utl.print_ok_str(f'>>> ec2-user password: {new_rnd_pwd}'))
-        print(utl.print_ok_str(f'>>> {pub_ip} - {node_name}'))
-        print(utl.print_ok_str('>>> remember to save the password!'))
-        print(utl.print_ok_str('>>> node dashboard details:'))
-        print(utl.print_ok_str(f'>>> http://{pub_ip}:8080'))
-        print(utl.print_ok_str('>>> user: operator'))
-        print(utl.print_ok_str(f'>>> password: {new_rnd_pwd}'))
-        p_bar.update(10)
-        p_bar.close()
+        print_node_details(ctx)
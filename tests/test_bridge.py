@@ -0,0 +1,57 @@
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+sys.path.append('../')
+import bridge
+import utils as utl
+
+
+class TestBridge(unittest.TestCase):
+
+    def test_bridge_cmd(self):
+        assert bridge.bridge_cmd('restart', ['all']) == 'ptokens_bridge restart'
+        assert bridge.bridge_cmd('stop_single', ['api']) == 'ptokens_bridge stop_single api'
+        cmd = bridge.bridge_cmd('restart_single', ['syncer_host', 'syncer_native'])
+        assert cmd == ('rc=0; for comp in syncer_host syncer_native; do '
+                       'ptokens_bridge restart_single "$comp" || rc=$?; done; exit $rc')
+
+    def test_staggered(self):
+        starts = {}
+        func = bridge.staggered(lambda n: starts.setdefault(n, time.monotonic()), 0.05)
+        utl.run_parallel(func, ['n1', 'n2', 'n3'], 3)
+        times = sorted(starts.values())
+        assert times[1] - times[0] >= 0.045
+        assert times[2] - times[1] >= 0.045
+
+    def test_all_without_nodes(self):
+        args = SimpleNamespace(action=['restart'], bridge_comp=['all'], node_name=None,
+                               all_nodes=True, parallel=10, stagger=0)
+        with mock.patch.object(utl, 'get_inst_list', return_value=[]) as get_inst_list, \
+             mock.patch.object(utl, 'run_remote_cmd') as run_remote_cmd, \
+             self.assertRaises(SystemExit) as exit_ctx:
+            bridge.bridge_mng(args)
+        assert exit_ctx.exception.code == 1
+        get_inst_list.assert_called_once_with(names=True)
+        run_remote_cmd.assert_not_called()
+        with mock.patch.object(utl, 'get_inst_list', return_value=[]), \
+             self.assertRaises(SystemExit) as exit_ctx:
+            utl.select_nodes(SimpleNamespace(all_nodes=True, node_name=None))
+        assert exit_ctx.exception.code == 1
+
+    def test_component_names(self):
+        for comp, error in ((',', 'the following arguments are required: component name'),
+                            ('api,db', 'unexpected component: db - choose from')):
+            args = SimpleNamespace(action=['restart_single'], bridge_comp=[comp],
+                                   node_name=['n1'], all_nodes=False, parallel=10, stagger=0)
+            with mock.patch('builtins.print') as print_mock, \
+                 mock.patch.object(utl, 'run_remote_cmd') as run_remote_cmd, \
+                 self.assertRaises(SystemExit):
+                bridge.bridge_mng(args)
+            assert error in print_mock.call_args.args[0]
+            run_remote_cmd.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
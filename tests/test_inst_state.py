@@ -0,0 +1,46 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('../')
+import utils as utl
+from client_config import CLI_CONFIG
+
+
+class TestInstState(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.root, '.pcli', 'inst-state.json')
+        self.config = mock.patch.dict(CLI_CONFIG, {'inst_state_path': self.state_path})
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        shutil.rmtree(self.root)
+
+    def test_no_state(self):
+        assert utl.read_inst_state('n1') == (None, None)
+
+    def test_keyed_and_last(self):
+        utl.save_inst_state('n1', {'inst_type': 'c5a.xlarge'})
+        utl.save_inst_state('n2', {'inst_type': 'c5a.2xlarge'})
+        assert utl.read_inst_state('n1') == ('n1', {'inst_type': 'c5a.xlarge'})
+        assert utl.read_inst_state('n3') == ('n2', {'inst_type': 'c5a.2xlarge'})
+
+    def test_overwrite_and_drop(self):
+        for session in range(20):
+            utl.save_inst_state('n1', {'session': session})
+        size = os.path.getsize(self.state_path)
+        utl.save_inst_state('n1', {'session': 99})
+        assert os.path.getsize(self.state_path) == size
+        assert utl.read_inst_state('n1') == ('n1', {'session': 99})
+        utl.save_inst_state('n1')
+        assert utl.read_inst_state('n1') == (None, None)
+        assert os.stat(self.state_path).st_mode & 0o077 == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
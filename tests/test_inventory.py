@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import sys
+sys.path.append('../')
+import inventory as inv
+from client_config import CLI_CONFIG
+
+
+def tf_state(pub_ip, az='eu-west-1a'):
+    return {'version': 4,
+            'outputs': {'public_ip': {'value': [pub_ip]}},
+            'resources': [{'mode': 'managed',
+                           'type': 'aws_instance',
+                           'instances': [{'attributes': {'public_ip': pub_ip,
+                                                         'availability_zone': az,
+                                                         'instance_type': 'c5a.xlarge',
+                                                         'ami': 'ami-01720b5f421cf0179',
+                                                         'id': 'i-0123'}}]}]}
+
+
+class TestReadTfState(unittest.TestCase):
+
+    def setUp(self):
+        self.tf_dir = tempfile.mkdtemp() + '/'
+        os.mkdir(f'{self.tf_dir}node-1')
+        self.state_path = f'{self.tf_dir}node-1/terraform.tfstate'
+        patcher = patch.dict(CLI_CONFIG, {'tf_state_path': self.tf_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.tf_dir)
+
+    def write_state(self, content):
+        with open(self.state_path, 'w') as f_state:
+            json.dump(content, f_state)
+
+    def test_node_info(self):
+        self.write_state(tf_state('1.2.3.4'))
+        info = inv.get_node_info('node-1')
+        assert info['public_ip'] == '1.2.3.4'
+        assert info['region'] == 'eu-west-1'
+        assert info['instance_type'] == 'c5a.xlarge'
+
+    def test_state_parsed_once(self):
+        self.write_state(tf_state('1.2.3.4'))
+        inv.read_tf_state('node-1')
+        with patch('json.load') as mock_json_load:
+            inv.read_tf_state('node-1')
+            mock_json_load.assert_not_called()
+
+    def test_state_rewritten(self):
+        self.write_state(tf_state('1.2.3.4'))
+        assert inv.get_node_info('node-1')['public_ip'] == '1.2.3.4'
+        self.write_state(tf_state('10.20.30.40'))
+        assert inv.get_node_info('node-1')['public_ip'] == '10.20.30.40'
+        self.write_state({'version': 4, 'outputs': {}, 'resources': []})
+        assert inv.get_node_info('node-1')['public_ip'] is None
+
+    def test_state_missing(self):
+        assert inv.read_tf_state('node-2') == {}
+
+
+class TestAnsibleInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.tf_dir = tempfile.mkdtemp() + '/'
+        states = {'node-1': tf_state('1.2.3.4'),
+                  'node-2': tf_state('5.6.7.8', az='us-east-1b'),
+                  'node-3': {'version': 4, 'outputs': {}, 'resources': []}}
+        for node_name, state in states.items():
+            os.mkdir(f'{self.tf_dir}{node_name}')
+            with open(f'{self.tf_dir}{node_name}/terraform.tfstate', 'w') as f_state:
+                json.dump(state, f_state)
+        patcher = patch.dict(CLI_CONFIG, {'tf_config_dir': self.tf_dir,
+                                          'tf_state_path': self.tf_dir})
+        patcher.start()
+        inv.list_nodes.cache_clear()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(inv.list_nodes.cache_clear)
+        self.addCleanup(shutil.rmtree, self.tf_dir)
+
+    def test_groups(self):
+        inventory = inv.ansible_inventory()
+        assert inventory['nodes']['hosts'] == ['node-1', 'node-2']
+        assert inventory['region_eu_west_1']['hosts'] == ['node-1']
+        assert inventory['region_us_east_1']['hosts'] == ['node-2']
+        assert inventory['type_c5a_xlarge']['hosts'] == ['node-1', 'node-2']
+
+    def test_hostvars(self):
+        hostvars = inv.ansible_inventory()['_meta']['hostvars']
+        assert 'node-3' not in hostvars
+        assert hostvars['node-2']['ansible_host'] == '5.6.7.8'
+        assert hostvars['node-2']['ansible_user'] == CLI_CONFIG['inst_user']
+        assert hostvars['node-2']['ansible_ssh_private_key_file'].endswith('/node-2')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
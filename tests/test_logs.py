@@ -0,0 +1,81 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('../')
+import logs
+import utils as utl
+from client_config import CLI_CONFIG
+
+
+class TestLogsPull(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.remote = os.path.join(self.root, 'remote') + '/'
+        os.makedirs(self.remote)
+        self.config = mock.patch.dict(CLI_CONFIG,
+                                      {'pnode_logs_path': self.remote,
+                                       'logs_mirror_path': os.path.join(self.root, 'mirror')})
+        self.config.start()
+        # the "remote" shell is a local one
+        self.ssh = mock.patch.object(utl, 'ssh_argv', lambda node_name, tty=False: ['sh', '-c'])
+        self.ssh.start()
+
+    def tearDown(self):
+        self.ssh.stop()
+        self.config.stop()
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        with open(self.remote + name, 'a') as f_log:
+            f_log.write(data)
+
+    def assert_mirrored(self):
+        for name in os.listdir(self.remote):
+            with open(self.remote + name, 'rb') as f_remote, \
+                 open(logs.local_path('n1', self.remote + name), 'rb') as f_local:
+                assert f_remote.read() == f_local.read(), name
+
+    def test_append_only(self):
+        self.write('a.log', 'x' * 100000)
+        res = logs.pull_node_logs('n1')
+        assert res['files'] == 1 and res['bytes'] == 100000
+        assert res['wire_bytes'] < 1000
+        self.write('a.log', 'appended\n')
+        res = logs.pull_node_logs('n1')
+        assert res['bytes'] == 9
+        self.assert_mirrored()
+        assert logs.pull_node_logs('n1')['files'] == 0
+
+    def test_rotation(self):
+        self.write('a.log', 'first\n')
+        logs.pull_node_logs('n1')
+        os.rename(self.remote + 'a.log', self.remote + 'a.log.1')
+        self.write('a.log.1', 'last line\n')
+        self.write('a.log', 'new\n')
+        res = logs.pull_node_logs('n1')
+        assert res['rotated'] == 1
+        assert res['bytes'] == len('last line\n') + len('new\n')
+        self.assert_mirrored()
+
+    def test_truncated(self):
+        self.write('a.log', 'long content\n')
+        logs.pull_node_logs('n1')
+        with open(self.remote + 'a.log', 'w') as f_log:
+            f_log.write('short\n')
+        res = logs.pull_node_logs('n1')
+        assert res['bytes'] == len('short\n')
+        self.assert_mirrored()
+
+    def test_shrunk_during_transfer(self):
+        self.write('a.log', 'abc')
+        logs.receive('n1', [(self.remote + 'a.log', 0, 5)])
+        with open(logs.local_path('n1', self.remote + 'a.log'), 'rb') as f_local:
+            assert f_local.read() == b'abc\0\0'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('../')
+import metrics
+from client_config import CLI_CONFIG
+
+
+METRICS_OUTPUT = '''cpu  4705 150 1120 16250 520 0 25 0 0 0
+cpu  4725 150 1125 16320 525 0 25 0 0 0
+load 0.42 0.35 0.30 1/210 4242
+MemTotal:        8000000 kB
+MemAvailable:    6000000 kB
+disk /dev/nvme0n1p1 64000000000 16000000000 48000000000 25% /
+docker pnode_bridge 3.25% 12.40%
+'''
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = mock.patch.dict(CLI_CONFIG, {'metrics_path': self.root})
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        shutil.rmtree(self.root)
+
+    def test_parse_metrics(self):
+        samples = metrics.parse_metrics(METRICS_OUTPUT)
+        assert samples['cpu_pct'] == 25.0
+        assert samples['load1'] == 0.42
+        assert samples['mem_pct'] == 25.0
+        assert samples['disk_pct'] == 25.0
+        assert samples['docker.pnode_bridge.mem_pct'] == 12.4
+        assert 'cpu_pct' not in metrics.parse_metrics('ok\n')
+
+    def test_store_since(self):
+        for timestamp in range(100, 200, 10):
+            metrics.append_samples('n1', timestamp, {'cpu_pct': timestamp / 10})
+        timestamps, values = metrics.read_metric('n1', 'cpu_pct', since=150)
+        assert list(timestamps) == [150, 160, 170, 180, 190]
+        assert list(values) == [15.0, 16.0, 17.0, 18.0, 19.0]
+        assert metrics.node_metrics('n1') == ['cpu_pct']
+        assert metrics.node_metrics('n2') == []
+
+    def test_store_partial_append(self):
+        metrics.append_samples('n1', 1000, {'mem_pct': 10.0})
+        # collect interrupted after the timestamp append
+        ts_path, _ = metrics.metric_paths('n1', 'mem_pct')
+        with open(ts_path, 'ab') as f_ts:
+            f_ts.write(b'\xd0\x07\x00\x00')
+        timestamps, values = metrics.read_metric('n1', 'mem_pct')
+        assert (list(timestamps), list(values)) == ([1000], [10.0])
+        metrics.append_samples('n1', 3000, {'mem_pct': 30.0})
+        timestamps, values = metrics.read_metric('n1', 'mem_pct')
+        assert (list(timestamps), list(values)) == ([1000, 3000], [10.0, 30.0])
+
+    def test_bisect_window(self):
+        for timestamp in range(1, 1001):
+            metrics.append_samples('n1', timestamp, {'load1': timestamp})
+        for since in (0, 1, 2, 500, 1000, 1001):
+            timestamps, values = metrics.read_metric('n1', 'load1', since=since)
+            assert list(timestamps) == list(range(max(since, 1), 1001))
+            assert list(values) == [float(t) for t in timestamps]
+
+    def test_since_and_sparkline(self):
+        assert metrics.parse_since('24h') == 86400
+        assert metrics.parse_since('90m') == 5400
+        assert metrics.parse_since('1y') is None
+        assert metrics.sparkline([0, 1, 2, 3, 4, 5, 6, 7], 8) == '▁▂▃▄▅▆▇█'
+        assert metrics.sparkline([0, 0, 10, 10], 2) == '▁█'
+        assert metrics.sparkline([5, 5], 40) == '▁▁'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,8 @@
-import responses
 import unittest
 from unittest.mock import patch
 import sys
 sys.path.append('../')
-from utils import check_for_file_in_path, download_file
+from utils import check_for_file_in_path
 from client_config import CLI_CONFIG
 
 
@@ -19,11 +18,6 @@ class TestFileInPath(unittest.TestCase):
         mock_os_is_file.return_value = False
         assert check_for_file_in_path('terraform', f'{CLI_CONFIG["pcli_config_path"]}') == False
 
-class TestDownloadFile(unittest.TestCase):
-
-    def test_download_file_succeed(self):
-        assert download_file(CLI_CONFIG['tf_binary_url_linux']) == 200
-
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
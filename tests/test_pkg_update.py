@@ -0,0 +1,58 @@
+import sys
+import unittest
+from unittest import mock
+sys.path.append('../')
+import node
+
+
+QUERY_OUTPUT = '''pnode-nitro 1.4.0-1
+pnode-nitro-bridge 1.4.0-1
+pnode-nitro-dashboard 1.3.2-1
+--- updates ---
+
+pnode-nitro.x86_64                      1.5.0-1                      pnode
+pnode-nitro-dashboard-with-a-very-long-name.x86_64
+                                        1.3.3-1                      pnode
+rc 100'''
+
+
+class TestPkgUpdate(unittest.TestCase):
+
+    def test_parse_query(self):
+        installed, available = node.parse_pkg_query(QUERY_OUTPUT)
+        assert installed == {'pnode-nitro': '1.4.0-1',
+                             'pnode-nitro-bridge': '1.4.0-1',
+                             'pnode-nitro-dashboard': '1.3.2-1'}
+        assert available == {'pnode-nitro': '1.5.0-1',
+                             'pnode-nitro-dashboard-with-a-very-long-name': '1.3.3-1'}
+
+    def test_parse_query_failed(self):
+        with self.assertRaises(RuntimeError):
+            node.parse_pkg_query('pnode-nitro 1.4.0-1\n--- updates ---\nrc 1')
+
+    def test_upgrade_single_transaction(self):
+        outputs = [{'rc': 0, 'stdout': 'pnode-nitro 1.4.0-1\npnode-nitro-bridge 1.4.0-1\n'
+                                       '--- updates ---\npnode-nitro.x86_64 1.5.0-1 pnode\n'
+                                       'rc 100'},
+                   {'rc': 0, 'stdout': ''},
+                   {'rc': 0, 'stdout': 'pnode-nitro 1.5.0-1\npnode-nitro-bridge 1.4.0-1'}]
+        with mock.patch.object(node.utl, 'run_remote_cmd', side_effect=outputs) as remote, \
+             mock.patch.object(node.reg, 'update_node') as update_node:
+            versions = node.upgrade_packages('n1', ['pnode-nitro*'])
+        assert remote.call_args_list[1][0][0] == 'sudo yum update -y pnode-nitro'
+        assert versions == {'pnode-nitro': ('1.4.0-1', '1.5.0-1', 'updated'),
+                            'pnode-nitro-bridge': ('1.4.0-1', '1.4.0-1', 'up to date')}
+        update_node.assert_called_once_with('n1', pnode_version='1.5.0-1')
+
+    def test_upgrade_nothing_to_do(self):
+        output = {'rc': 0, 'stdout': 'pnode-nitro 1.5.0-1\n--- updates ---\nrc 0'}
+        with mock.patch.object(node.utl, 'run_remote_cmd', return_value=output) as remote, \
+             mock.patch.object(node.reg, 'update_node'):
+            versions = node.upgrade_packages('n1', ['pnode-nitro', 'pnode-extra'])
+        assert remote.call_count == 1
+        assert versions == {'pnode-nitro': ('1.5.0-1', '1.5.0-1', 'up to date'),
+                            'pnode-extra': (None, None, 'not installed')}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import unittest
+from unittest import mock
+sys.path.append('../')
+import terraform as trf
+from client_config import CLI_CONFIG
+
+
+def tarball(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as f_tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            f_tar.addfile(info, io.BytesIO(data))
+    buf.seek(0)
+    return tarfile.open(fileobj=buf, mode='r:gz')
+
+
+class TestProviders(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.config = mock.patch.dict(
+            CLI_CONFIG, {'tf_cli_config_path': os.path.join(self.root, 'terraformrc'),
+                         'tf_plugin_cache_path': os.path.join(self.root, 'plugins'),
+                         'tf_provider_mirror_path': os.path.join(self.root, 'mirror')})
+        self.config.start()
+        trf.tf_cli_config.cache_clear()
+
+    def tearDown(self):
+        self.config.stop()
+        trf.tf_cli_config.cache_clear()
+        shutil.rmtree(self.root)
+
+    def test_cli_config_concurrent(self):
+        errors = []
+
+        def write_config():
+            try:
+                trf.tf_cli_config.__wrapped__()
+            except Exception as exc:
+                errors.append(exc)
+        threads = [threading.Thread(target=write_config) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        # no tmp file left behind
+        assert sorted(os.listdir(self.root)) == ['plugins', 'terraformrc']
+
+    def test_extract_tarball(self):
+        mirror_path = os.path.join(self.root, 'mirror')
+        with tarball({'registry.terraform.io/hashicorp/aws/aws.zip': b'zip'}) as f_tar:
+            trf.extract_tarball(f_tar, mirror_path)
+        assert os.path.isfile(os.path.join(mirror_path, 'registry.terraform.io/hashicorp/aws/aws.zip'))
+        with tarball({'../outside': b'x'}) as f_tar:
+            with self.assertRaises(tarfile.TarError):
+                trf.extract_tarball(f_tar, mirror_path)
+        assert not os.path.exists(os.path.join(self.root, 'outside'))
+
+
+if __name__ == '__main__':
+    unittest.main()
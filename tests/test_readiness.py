@@ -0,0 +1,95 @@
+import collections
+import http.server
+import sys
+import threading
+import unittest
+from unittest import mock
+sys.path.append('../')
+import readiness as rdy
+from client_config import CLI_CONFIG
+
+
+class PingHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Answer 503 to the first `not_ready[path]` GETs on a path, then 200
+    '''
+    not_ready = {}
+    hits = collections.Counter()
+
+    def do_GET(self):
+        self.hits[self.path] += 1
+        code = 200 if self.hits[self.path] > self.not_ready.get(self.path, 0) else 503
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestReadiness(unittest.TestCase):
+
+    def setUp(self):
+        PingHandler.not_ready = {}
+        PingHandler.hits.clear()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), PingHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05},
+                         daemon=True).start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    def test_wait_until_backoff(self):
+        attempts = iter([None, False, ValueError('refused'), None, 'ready'])
+
+        def check():
+            res = next(attempts)
+            if isinstance(res, Exception):
+                raise res
+            return res
+        with mock.patch.object(rdy.time, 'sleep') as sleep:
+            assert rdy.wait_until(check, 60, 'test', initial_delay=1, max_delay=4) == 'ready'
+        assert [call.args[0] for call in sleep.call_args_list] == [1, 2, 4, 4]
+
+    def test_wait_until_deadline(self):
+        check = mock.Mock(return_value=None)
+        with self.assertRaises(TimeoutError):
+            rdy.wait_until(check, 0.3, 'test', initial_delay=0.1, max_delay=10)
+        # the last sleep is cut at the deadline instead of a full backoff step
+        assert check.call_count == 3
+
+    def test_wait_for_http(self):
+        PingHandler.not_ready = {'/b/ping': 2}
+        urls = {'a': self.url('/a/ping'), 'b': self.url('/b/ping')}
+        with mock.patch.object(rdy.time, 'sleep'):
+            ready = rdy.wait_for_http(urls, 60, 'test')
+        assert sorted(ready) == ['a', 'b']
+        # ready endpoints are not probed again
+        assert PingHandler.hits == {'/a/ping': 1, '/b/ping': 3}
+
+    def test_wait_for_http_timeout(self):
+        PingHandler.not_ready = {'/b/ping': 1000}
+        urls = {'a': self.url('/a/ping'), 'b': self.url('/b/ping'),
+                'c': 'http://127.0.0.1:1/c/ping'}
+        with self.assertRaisesRegex(TimeoutError, r'test: b, c not ready after 0.5s'):
+            rdy.wait_for_http(urls, 0.5, 'test')
+        assert PingHandler.hits['/a/ping'] == 1
+
+    def test_wait_for_bridge(self):
+        PingHandler.not_ready = {'/pbtc-on-eth/ping': 1}
+        with mock.patch.object(rdy.utl, 'get_pub_ip', return_value='127.0.0.1'), \
+             mock.patch.dict(CLI_CONFIG, {'bridge_api_port': self.port}), \
+             mock.patch.object(rdy.time, 'sleep'):
+            ready = rdy.wait_for_bridge('n1', endpoints=['pbtc-on-eth', 'pbtc-on-eos'])
+        assert sorted(ready) == ['pbtc-on-eos', 'pbtc-on-eth']
+        assert PingHandler.hits['/pbtc-on-eth/ping'] == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
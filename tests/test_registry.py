@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('../')
+import inventory as inv
+import registry as reg
+from client_config import CLI_CONFIG
+
+
+def tf_state(region, inst_type, ip):
+    return {'outputs': {'public_ip': {'value': ip}},
+            'resources': [{'mode': 'managed',
+                           'type': 'aws_instance',
+                           'instances': [{'attributes': {'availability_zone': f'{region}a',
+                                                         'instance_type': inst_type,
+                                                         'ami': 'ami-1',
+                                                         'id': 'i-1'}}]}]}
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        tf_dir = os.path.join(self.root, 'terraform') + '/'
+        self.config = mock.patch.dict(CLI_CONFIG,
+                                      {'tf_config_dir': tf_dir,
+                                       'tf_state_path': tf_dir,
+                                       'registry_path': os.path.join(self.root, 'registry.db')})
+        self.config.start()
+        self.add_node('n1', 'eu-west-1', 'c5a.xlarge', '1.1.1.1', 300)
+        self.add_node('n2', 'us-east-1', 'c5a.xlarge', '2.2.2.2', 100)
+        self.add_node('n3', 'eu-west-1', 'c5a.2xlarge', '3.3.3.3', 200)
+
+    def tearDown(self):
+        self.config.stop()
+        inv.list_nodes.cache_clear()
+        shutil.rmtree(self.root)
+
+    def add_node(self, node_name, region, inst_type, ip, created):
+        node_dir = os.path.join(CLI_CONFIG['tf_config_dir'], node_name)
+        os.makedirs(node_dir)
+        state_path = os.path.join(node_dir, 'terraform.tfstate')
+        with open(state_path, 'w') as f_state:
+            json.dump(tf_state(region, inst_type, ip), f_state)
+        os.utime(state_path, (created, created))
+        inv.list_nodes.cache_clear()
+
+    def test_query(self):
+        assert [n['name'] for n in reg.query_nodes()] == ['n1', 'n2', 'n3']
+        assert [n['name'] for n in reg.query_nodes(sort='created')] == ['n2', 'n3', 'n1']
+        nodes = reg.query_nodes(region='eu-west-1', inst_type='c5a.xlarge')
+        assert [(n['name'], n['ip'], n['created']) for n in nodes] == [('n1', '1.1.1.1', 300)]
+
+    def test_sync_and_updates(self):
+        reg.query_nodes()
+        reg.update_node('n1', health='ok', pnode_version='1.2.3')
+        shutil.rmtree(os.path.join(CLI_CONFIG['tf_config_dir'], 'n2'))
+        inv.list_nodes.cache_clear()
+        self.add_node('n4', 'eu-west-1', 'c5a.xlarge', '4.4.4.4', 400)
+        nodes = reg.query_nodes(region='eu-west-1', inst_type='c5a.xlarge')
+        assert [(n['name'], n['health']) for n in nodes] == [('n1', 'ok'), ('n4', None)]
+        assert reg.reindex() == 3
+        assert reg.query_nodes(region='eu-west-1')[0]['pnode_version'] == '1.2.3'
+        reg.remove_node('n1')
+        with reg.connect() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM nodes').fetchone()[0] == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
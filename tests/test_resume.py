@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('../')
+import terraform as trf
+import utils as utl
+from client_config import CLI_CONFIG
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'n1'))
+        self.config = mock.patch.dict(CLI_CONFIG, {'tf_config_dir': self.root + '/'})
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        shutil.rmtree(self.root)
+
+    def test_user_pwd_kept(self):
+        ctx = {'node_name': 'n1', 'pub_ip': '1.1.1.1'}
+        trf.stage_user_pwd(ctx)
+        pwd = ctx['pwd']
+        # resume from a checkpoint saved before the password was saved
+        ctx = {'node_name': 'n1', 'pub_ip': '1.1.1.1'}
+        trf.stage_user_pwd(ctx)
+        assert ctx['pwd'] == pwd
+        with open(ctx['cred_path']) as f_cred:
+            assert f_cred.read() == f'user: {CLI_CONFIG["inst_user"]} - pwd: {pwd} - IP: 1.1.1.1\n'
+
+    def test_bridge_timeout_not_checkpointed(self):
+        stages = {'user password': (trf.stage_user_pwd, []),
+                  'start node': (trf.stage_pnode_start, ['user password'])}
+        ctx = {'node_name': 'n1', 'pub_ip': '1.1.1.1'}
+        with mock.patch.object(trf, 'provisioning_stages', return_value=stages), \
+             mock.patch.object(utl, 'run_remote_cmd'), \
+             mock.patch.object(trf.node.rdy, 'wait_for_enclave'), \
+             mock.patch.object(trf.node.rdy, 'wait_for_bridge',
+                               side_effect=TimeoutError('bridge not ready')):
+            _, res = trf.provision_node(ctx)
+        assert list(res['failed']) == ['start node']
+        checkpoint = utl.read_file(trf.checkpoint_path('n1'), json_f=True)
+        assert checkpoint['stages'] == ['user password']
+        assert checkpoint['ctx']['pwd'] == ctx['pwd']
+
+    def test_iam_cred_every_mode(self):
+        args_dict = {'access_key_id_op': 'AKIA', 'secret_access_key_op': 'secret'}
+        path = trf.dump_iam_cred('n1', args_dict)
+        assert path == os.path.join(self.root, 'n1', '.iam_credentials')
+        assert utl.read_file(path, json_f=True) == {'access_key_id': 'AKIA',
+                                                    'secret_access_key': 'secret'}
+        with mock.patch.dict(os.environ, {'ACCESS_KEY_ID_OP': 'AKENV',
+                                          'SECRET_ACCESS_KEY_OP': 'envsecret'}):
+            path = trf.dump_iam_cred('n1', {'access_key_id_op': '', 'secret_access_key_op': ''})
+        assert utl.read_file(path, json_f=True)['access_key_id'] == 'AKENV'
+
+    def test_iam_cred_missing_skipped(self):
+        with mock.patch.dict(os.environ, {'ACCESS_KEY_ID_OP': '', 'SECRET_ACCESS_KEY_OP': ''}):
+            assert trf.dump_iam_cred('n1', {}) is None
+        with mock.patch.object(trf.ans, 'run_playbook') as run_playbook:
+            trf.ans.bootstrap_node('n1', 'pwd', 'url', trf.iam_cred_file('n1'))
+        assert run_playbook.call_args.kwargs['extra_vars']['iam_cred_src'] == ''
+        with mock.patch.object(utl, 'scp_file') as scp_file:
+            trf.stage_iam_cred({'node_name': 'n1', 'iam_cred_path': None})
+        scp_file.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
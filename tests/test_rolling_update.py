@@ -0,0 +1,54 @@
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+sys.path.append('../')
+import fleet
+
+
+class TestRollingUpdate(unittest.TestCase):
+
+    def test_batches(self):
+        nodes = [f'n{nr}' for nr in range(8)]
+        assert fleet.update_batches(nodes, 3, 1) == [('canary', ['n0']),
+                                                     ('batch 1/3', ['n1', 'n2', 'n3']),
+                                                     ('batch 2/3', ['n4', 'n5', 'n6']),
+                                                     ('batch 3/3', ['n7'])]
+        assert fleet.update_batches(nodes[:2], 5, 0) == [('batch 1/1', ['n0', 'n1'])]
+
+    def test_containers_healthy(self):
+        def docker_ps(output):
+            return mock.patch.object(fleet.utl, 'run_remote_cmd',
+                                     return_value={'rc': 0, 'output': output, 'stdout': output})
+        with docker_ps('bridge\tUp 2 minutes (healthy)\nsyncer\tUp 3 seconds'):
+            assert fleet.containers_healthy('n1', ['bridge', 'syncer']) is True
+            assert fleet.containers_healthy('n1', ['bridge', 'api']) is False
+        with docker_ps('bridge\tUp 5 seconds (health: starting)'):
+            assert fleet.containers_healthy('n1', ['bridge']) is False
+        with docker_ps('bridge\tRestarting (1) 2 seconds ago'):
+            assert fleet.containers_healthy('n1', []) is False
+        with docker_ps(''):
+            assert fleet.containers_healthy('n1', []) is True
+            assert fleet.containers_healthy('n1', ['bridge']) is False
+        with mock.patch.object(fleet.utl, 'run_remote_cmd',
+                               return_value={'rc': 1, 'output': '', 'stdout': ''}):
+            assert fleet.containers_healthy('n1', []) is False
+
+    def test_stops_on_failed_batch(self):
+        updated = []
+
+        def upgrade_node(node_name, pkgs, timeout):
+            updated.append(node_name)
+            if node_name == 'n2':
+                raise TimeoutError('n2: bridge not ready')
+            return {'versions': {}, 'duration': 0}
+
+        args = SimpleNamespace(pkg_name=None, batch_size=2, canary=1)
+        with mock.patch.object(fleet, 'upgrade_node', side_effect=upgrade_node), \
+             self.assertRaises(SystemExit):
+            fleet.rolling_update(args, ['n4', 'n3', 'n2', 'n1', 'n0'])
+        assert sorted(updated) == ['n0', 'n1', 'n2']
+
+
+if __name__ == '__main__':
+    unittest.main()
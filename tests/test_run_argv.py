@@ -0,0 +1,73 @@
+import sys
+import unittest
+from unittest import mock
+sys.path.append('../')
+import utils as utl
+
+
+def py_argv(code):
+    return [sys.executable, '-c', code]
+
+
+class TestRunArgv(unittest.TestCase):
+
+    def test_result(self):
+        res = utl.run_argv(py_argv('import sys; print("out"); sys.exit(3)'))
+        assert res['rc'] == 3
+        assert res['output'] == 'out'
+        assert res['lines'] == 1
+        assert res['truncated'] is False
+        assert res['duration'] > 0
+
+    def test_streams(self):
+        lines = []
+        utl.run_argv(py_argv('import sys; print("a", flush=True); '
+                             'print("b", file=sys.stderr, flush=True)'),
+                     on_line=lambda line, stream: lines.append((stream, line)))
+        assert ('stdout', 'a') in lines
+        assert ('stderr', 'b') in lines
+
+    def test_stdout_only(self):
+        res = utl.run_argv(py_argv('import sys; print("a", flush=True); '
+                                   'print("Warning: Permanently added", file=sys.stderr)'))
+        assert res['stdout'] == 'a'
+        assert 'Warning: Permanently added' in res['output']
+
+    def test_callbacks_list(self):
+        first, second = [], []
+        utl.run_argv(py_argv('print("a")'),
+                     on_line=[lambda l, s: first.append(l), lambda l, s: second.append(l)])
+        assert first == second == ['a']
+
+    def test_bounded_tail(self):
+        collected = []
+        res = utl.run_argv(py_argv('for i in range(1000): print(i)'),
+                           on_line=lambda line, stream: collected.append(line),
+                           tail_lines=10)
+        assert len(collected) == 1000
+        assert res['output'].splitlines() == [str(i) for i in range(990, 1000)]
+        assert res['lines'] == 1000
+        assert res['truncated'] is True
+
+    def test_long_line(self):
+        res = utl.run_argv(py_argv(f'print("x" * {utl.RUN_MAX_LINE * 3})'))
+        assert res['rc'] == 0
+        assert max(len(line) for line in res['output'].splitlines()) <= utl.RUN_MAX_LINE + 65536
+
+    def test_no_shell(self):
+        res = utl.run_argv(['echo', '$HOME', '>', '/dev/null'])
+        assert res['output'] == '$HOME > /dev/null'
+
+    def test_missing_binary(self):
+        res = utl.run_argv(['pcli-missing-binary'])
+        assert res['rc'] is None
+
+    def test_remote_output(self):
+        with mock.patch.object(utl, 'ssh_argv', return_value=['/bin/sh', '-c']):
+            assert utl.run_remote_cmd('echo out', 'node-1', output=True) == 'out'
+            assert utl.run_remote_cmd('echo out; echo warning >&2', 'node-1', output=True) == 'out'
+            assert utl.run_remote_cmd('echo out; exit 2', 'node-1', output=True) is None
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
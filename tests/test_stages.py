@@ -0,0 +1,49 @@
+import threading
+import unittest
+import sys
+sys.path.append('../')
+from stages import check_stages, run_stages
+
+
+class TestRunStages(unittest.TestCase):
+
+    def test_dependency_order(self):
+        order = []
+        stages = {'c': (lambda ctx: order.append('c'), ['a', 'b']),
+                  'a': (lambda ctx: order.append('a'), []),
+                  'b': (lambda ctx: order.append('b'), ['a'])}
+        res = run_stages(stages, {})
+        assert order == ['a', 'b', 'c']
+        assert res['done'] == {'a', 'b', 'c'} and not res['failed']
+
+    def test_independent_stages_overlap(self):
+        barrier = threading.Barrier(2, timeout=5)
+        stages = {'a': (lambda ctx: barrier.wait(), []),
+                  'b': (lambda ctx: barrier.wait(), [])}
+        res = run_stages(stages, {})
+        assert not res['failed']
+
+    def test_failure_stops_dependents(self):
+        def fail(ctx):
+            raise RuntimeError('boom')
+        ran = []
+        stages = {'a': (fail, []),
+                  'b': (lambda ctx: ran.append('b'), ['a'])}
+        res = run_stages(stages, {})
+        assert list(res['failed']) == ['a']
+        assert res['pending'] == ['b'] and ran == []
+
+    def test_done_stages_skipped(self):
+        ran = []
+        stages = {'a': (lambda ctx: ran.append('a'), []),
+                  'b': (lambda ctx: ran.append('b'), ['a'])}
+        run_stages(stages, {}, done={'a'})
+        assert ran == ['b']
+
+    def test_cycle(self):
+        stages = {'a': (None, ['b']), 'b': (None, ['a'])}
+        self.assertRaises(ValueError, check_stages, stages)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
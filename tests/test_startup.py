@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules only the commands doing the actual work may import
+HEAVY_MODULES = ('ansible', 'hcl', 'logging.config', 'node', 'pickle', 'random_name',
+                 'readiness', 'requests', 'terraform', 'tqdm', 'yaml')
+
+# max seconds on top of a bare interpreter startup
+STARTUP_BUDGET = 0.15
+
+# run pcli w/ the given args (w/o executing the command), dump loaded modules
+STARTUP_SCRIPT = '''
+import json, sys
+import cli
+try:
+    args = cli.build_parser().parse_args(sys.argv[1:])
+    cli.resolve_func(args.func)
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps(sorted(sys.modules)))
+'''
+
+
+def run_python(*args):
+    start_time = time.perf_counter()
+    proc = subprocess.run([sys.executable, *args], cwd=REPO_DIR, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - start_time, proc
+
+
+def startup_time(*args):
+    return min(run_python(*args)[0] for _ in range(5))
+
+
+class TestStartup(unittest.TestCase):
+
+    def loaded_modules(self, pcli_args):
+        _, proc = run_python('-c', STARTUP_SCRIPT, *pcli_args)
+        return set(json.loads(proc.stderr))
+
+    def test_version_imports(self):
+        loaded = self.loaded_modules(['-v'])
+        assert [m for m in HEAVY_MODULES if m in loaded] == []
+
+    def test_bridge_imports(self):
+        loaded = self.loaded_modules(['bridge', 'restart', 'all', '-n', 'node-1'])
+        assert 'bridge' in loaded
+        assert [m for m in HEAVY_MODULES if m in loaded] == []
+
+    def test_node_imports(self):
+        loaded = self.loaded_modules(['node', 'list'])
+        assert 'node' in loaded
+        assert [m for m in ('hcl', 'requests', 'terraform') if m in loaded] == []
+
+    def test_version_budget(self):
+        bare_time = startup_time('-c', 'pass')
+        assert startup_time('cli.py', '-v') - bare_time < STARTUP_BUDGET
+
+    def test_bridge_budget(self):
+        bare_time = startup_time('-c', 'pass')
+        pcli_time = startup_time('-c', STARTUP_SCRIPT, 'bridge', 'restart', 'all', '-n', 'node-1')
+        assert pcli_time - bare_time < STARTUP_BUDGET
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,57 @@
+import collections
+import sys
+import unittest
+from unittest import mock
+sys.path.append('../')
+import status
+from client_config import CLI_CONFIG
+
+
+def ok(latency=0.01):
+    return {'ok': True, 'latency': latency, 'detail': '200'}
+
+
+class TestStatus(unittest.TestCase):
+
+    def setUp(self):
+        status._CACHE.clear()
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        assert status.percentile(samples, 50) == 50
+        assert status.percentile(samples, 99) == 99
+        assert status.percentile([7], 90) == 7
+        assert status.percentile([1, 2, 3, 4, 5], 50) == 3
+        assert status.percentile([1, 2, 3, 4, 5], 90) == 5
+        assert status.percentile([1, 2, 3, 4], 0) == 1
+
+    def test_node_health(self):
+        failed = {'ok': False, 'latency': None, 'detail': 'timeout'}
+        assert status.node_health(None) == 'down'
+        assert status.node_health({'ssh': failed, 'dashboard': ok()}) == 'down'
+        assert status.node_health({'ssh': ok(), 'dashboard': ok()}) == 'healthy'
+        assert status.node_health({'ssh': ok(), 'dashboard': failed,
+                                   'pbtc-on-eth': failed}) == 'degraded (dashboard, pbtc-on-eth)'
+
+    def test_cache_ttl(self):
+        latencies = collections.defaultdict(list)
+        check = ('http://127.0.0.1:1/', True)
+        with mock.patch.object(status, 'probe', return_value=ok()) as probe, \
+             mock.patch.dict(CLI_CONFIG, {'status_cache_ttl': 60}):
+            status.cached_probe(None, 'n1', 'dashboard', check, latencies)
+            status.cached_probe(None, 'n1', 'dashboard', check, latencies)
+            assert probe.call_count == 1
+            assert latencies['dashboard'] == [0.01]
+        with mock.patch.object(status, 'probe', return_value=ok()) as probe, \
+             mock.patch.dict(CLI_CONFIG, {'status_cache_ttl': 0}):
+            status.cached_probe(None, 'n1', 'dashboard', check, latencies)
+            assert probe.call_count == 1
+
+    def test_port_probe(self):
+        with mock.patch.dict(CLI_CONFIG, {'status_timeout': 0.5}):
+            res = status.probe(None, 'tcp://127.0.0.1:1', True)
+        assert res == {'ok': False, 'latency': None, 'detail': 'closed'}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import threading
+import unittest
+import sys
+from unittest import mock
+sys.path.append('../')
+import tracing as trc
+import utils as utl
+
+
+@trc.traced('cmd', label_arg='cmd', arg_names=('cmd',))
+def fake_cmd(cmd, secret=None):
+    return {'rc': 2}
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        trc.enable()
+        self.addCleanup(setattr, trc, '_EVENTS', None)
+
+    def spans(self):
+        return [e for e in trc.trace_events()['traceEvents'] if e['ph'] == 'X']
+
+    def test_traced_call(self):
+        fake_cmd('ls', secret='pwd')
+        span = self.spans()[0]
+        assert span['name'] == 'fake_cmd: ls'
+        assert span['cat'] == 'cmd'
+        assert span['args'] == {'cmd': 'ls', 'rc': 2}
+        assert span['dur'] >= 0
+
+    def test_commands_redacted(self):
+        pwd = 'Xy7secretPwd'
+        with mock.patch.object(utl, 'ssh_argv', return_value=['true']):
+            utl.run_remote_cmd(f'pnode_dashboard start {pwd}', 'node-1', log=True)
+            utl.run_remote_cmd(f"echo '{pwd}' > /etc/pnode/data/.node-cred", 'node-1', log=True)
+        trace = json.dumps(trc.trace_events())
+        assert pwd not in trace
+        names = [span['name'] for span in self.spans()]
+        assert 'run_remote_cmd: pnode_dashboard' in names
+        assert 'run_remote_cmd: echo' in names
+
+    def test_command_labels(self):
+        pwd = 'Xy7secretPwd'
+        assert trc.command_label(['ssh', '-i', '/keys/node-1', '-o', 'ControlMaster=no',
+                                  'ec2-user@10.0.0.1', f'pnode_dashboard start {pwd}']) \
+            == 'ssh ec2-user@10.0.0.1'
+        assert trc.command_label(['scp', '-i', '/keys/node-1', '/tmp/f',
+                                  'ec2-user@10.0.0.1:/etc/f']) == 'scp ec2-user@10.0.0.1'
+        assert trc.command_label(['ansible-playbook', '/pcli/playbooks/bootstrap.yml',
+                                  '-i', '/pcli/hosts-node-1', '--limit', 'node-1',
+                                  '--extra-vars', '@/tmp/pcli-vars-1.json']) \
+            == 'ansible-playbook bootstrap.yml -i hosts-node-1 --limit node-1'
+        assert trc.command_label(f'echo {pwd}@10.0.0.1') == 'echo'
+        utl.run_argv(['true', pwd])
+        assert self.spans()[0]['name'] == 'run_argv: true'
+
+    def test_span_error(self):
+        with self.assertRaises(ValueError):
+            with trc.span('stage', 'stage', node='node-1'):
+                raise ValueError('boom')
+        assert self.spans()[0]['args'] == {'node': 'node-1', 'error': "ValueError('boom')"}
+
+    def test_threads_metadata(self):
+        thread = threading.Thread(target=fake_cmd, args=('ls',), name='node-1_0')
+        thread.start()
+        thread.join()
+        events = trc.trace_events()['traceEvents']
+        names = [e['args']['name'] for e in events if e['name'] == 'thread_name']
+        assert names == ['node-1_0']
+        assert self.spans()[0]['tid'] == thread.ident
+
+    def test_disabled(self):
+        trc._EVENTS = None
+        assert fake_cmd('ls') == {'rc': 2}
+        assert self.spans() == []
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
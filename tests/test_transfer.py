@@ -0,0 +1,74 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('../')
+import transfer as trn
+import utils as utl
+
+
+class TestTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.local = os.path.join(self.root, 'local')
+        self.remote = os.path.join(self.root, 'remote')
+        os.makedirs(self.local)
+        os.makedirs(self.remote)
+        # the "remote" shell is a local one
+        self.ssh = mock.patch.object(utl, 'ssh_argv', lambda node_name, tty=False: ['sh', '-c'])
+        self.ssh.start()
+
+    def tearDown(self):
+        self.ssh.stop()
+        shutil.rmtree(self.root)
+
+    def write(self, path, data, mode=0o644):
+        with open(path, 'w') as f_out:
+            f_out.write(data)
+        os.chmod(path, mode)
+
+    def manifest(self, *names):
+        return [(os.path.join(self.local, name), os.path.join(self.remote, name))
+                for name in names]
+
+    def test_push_skips_up_to_date(self):
+        self.write(os.path.join(self.local, 'a.sh'), 'echo a\n', 0o750)
+        self.write(os.path.join(self.local, 'b.cfg'), 'b\n')
+        res = trn.transfer_files('n1', self.manifest('a.sh', 'b.cfg'), to_node=True)
+        assert len(res['sent']) == 2
+        assert stat.S_IMODE(os.stat(os.path.join(self.remote, 'a.sh')).st_mode) == 0o750
+        self.write(os.path.join(self.local, 'b.cfg'), 'b changed\n')
+        res = trn.transfer_files('n1', self.manifest('a.sh', 'b.cfg'), to_node=True)
+        assert res['sent'] == [os.path.join(self.remote, 'b.cfg')]
+        assert res['skipped'] == [os.path.join(self.remote, 'a.sh')]
+        with open(os.path.join(self.remote, 'b.cfg')) as f_in:
+            assert f_in.read() == 'b changed\n'
+
+    def test_pull(self):
+        self.write(os.path.join(self.remote, 'cred'), 'secret\n', 0o600)
+        self.write(os.path.join(self.remote, 'log'), 'log\n')
+        res = trn.transfer_files('n1', self.manifest('cred', 'log'))
+        assert sorted(res['sent']) == sorted(r for _, r in self.manifest('cred', 'log'))
+        assert stat.S_IMODE(os.stat(os.path.join(self.local, 'cred')).st_mode) == 0o600
+        assert trn.transfer_files('n1', self.manifest('cred', 'log'))['sent'] == []
+
+    def test_missing_files(self):
+        with self.assertRaises(RuntimeError):
+            trn.transfer_files('n1', self.manifest('nope'), to_node=True)
+        with self.assertRaises(RuntimeError):
+            trn.transfer_files('n1', self.manifest('nope'))
+
+    def test_fan_out_shares_archive(self):
+        self.write(os.path.join(self.local, 'a.sh'), 'echo a\n')
+        with mock.patch.object(trn, 'build_archive', wraps=trn.build_archive) as build:
+            results = trn.push_to_nodes(['n1', 'n2', 'n3'], self.manifest('a.sh'), 1)
+        assert all(not isinstance(res, Exception) for res in results.values())
+        assert build.call_count == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
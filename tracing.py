@@ -0,0 +1,173 @@
+import functools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+
+# recorded trace events (Chrome trace-event format), `None` when disabled
+_EVENTS = None
+_EVENTS_LOCK = threading.Lock()
+_THREAD_NAMES = {}
+_START_TIME = 0.0
+_SSH_TARGET = re.compile(r'^[\w.-]+@[\w.-]+(:\S*)?$')
+
+def enable():
+    '''
+    Start recording spans (see `trace_events` to export them)
+    '''
+    global _EVENTS, _START_TIME
+    with _EVENTS_LOCK:
+        _EVENTS = []
+        _THREAD_NAMES.clear()
+        _START_TIME = time.perf_counter()
+
+def enabled():
+    '''
+    Check if spans are being recorded
+
+    Args:
+        return: `True` if enabled, `False` if not
+    '''
+    return _EVENTS is not None
+
+def _now_us():
+    return (time.perf_counter() - _START_TIME) * 1e6
+
+def _status(res):
+    '''
+    Return the exit status of a traced call from its return value
+
+    Args:
+        param1: return value (result dict, bool or `None`)
+        return: exit code (`None` if unknown)
+    '''
+    if isinstance(res, dict) and 'rc' in res:
+        return res['rc']
+    if isinstance(res, bool):
+        return 0 if res else 1
+    return None
+
+@contextmanager
+def span(name, cat, **args):
+    '''
+    Record the block as a complete event on the current thread timeline
+    The yielded dict is stored as the event args, so the block can add
+    details (ie: `rc`); an exception is recorded as `error` and re-raised
+
+    Args:
+        param1: span name
+        param2: span category (ie: terraform, ansible, ssh, stage)
+        param3: span args (ie: node, cmd)
+    '''
+    if _EVENTS is None:
+        yield args
+        return
+    thread = threading.current_thread()
+    start_ts = _now_us()
+    try:
+        yield args
+    except BaseException as exc:
+        args['error'] = repr(exc)
+        raise
+    finally:
+        event = {'name': name,
+                 'cat': cat,
+                 'ph': 'X',
+                 'ts': round(start_ts, 1),
+                 'dur': round(_now_us() - start_ts, 1),
+                 'pid': os.getpid(),
+                 'tid': thread.ident,
+                 'args': {k: v for k, v in args.items() if v is not None}}
+        with _EVENTS_LOCK:
+            if _EVENTS is not None:
+                _EVENTS.append(event)
+                _THREAD_NAMES.setdefault(thread.ident, thread.name)
+
+def command_label(value):
+    '''
+    Return the recorded part of a command string or argv list: the command
+    name, plus the target of known commands (`user@host` for ssh/scp, the
+    playbook, inventory and `--limit` for ansible-playbook); the rest may
+    hold secrets (ie: passwords in remote commands) and is dropped
+
+    Args:
+        param1: command string or argv list
+        return: command label
+    '''
+    tokens = value.split() if isinstance(value, str) else [str(arg) for arg in value]
+    if not tokens:
+        return ''
+    label = [tokens[0]]
+    cmd = os.path.basename(tokens[0])
+    if cmd in ('ssh', 'scp'):
+        # first `user@host[:path]` only, a remote command is never recorded
+        label += [tok.split(':', 1)[0] for tok in tokens[1:] if _SSH_TARGET.match(tok)][:1]
+    elif cmd == 'ansible-playbook':
+        for prev, tok in zip(tokens, tokens[1:]):
+            if prev in ('-i', '--inventory', '-l', '--limit'):
+                label += [prev, os.path.basename(tok) if prev in ('-i', '--inventory') else tok]
+            elif tok.endswith(('.yml', '.yaml')) and not tok.startswith('@'):
+                label.append(os.path.basename(tok))
+    return ' '.join(label)
+
+def traced(cat, label_arg=None, arg_names=('cmd', 'node_name'), redact=('cmd', 'argv')):
+    '''
+    Decorator recording every call of the function as a span, w/ the
+    selected arguments and the exit status of the returned value
+    Arguments in `redact` (label included) are recorded as their command label only
+    Nothing is recorded (and nothing is inspected) while tracing is disabled
+
+    Args:
+        param1: span category
+        param2: [optional] argument appended to the span name (ie: the command)
+        param3: [optional] arguments recorded in the span (never pass secrets)
+        param4: [optional] command arguments reduced to the command label
+        return: decorator
+    '''
+    def decorator(func):
+        signature = []
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _EVENTS is None:
+                return func(*args, **kwargs)
+            if not signature:
+                # inspected on first traced call only (import cost on startup)
+                import inspect
+                signature.append(inspect.signature(func))
+            bound = signature[0].bind(*args, **kwargs)
+            bound.apply_defaults()
+            recorded = {arg: command_label(val) if arg in redact and val is not None else val
+                        for arg, val in bound.arguments.items()}
+            name = func.__name__
+            if label_arg is not None and recorded.get(label_arg) is not None:
+                name = f'{name}: {str(recorded[label_arg])[:80]}'
+            span_args = {arg: recorded[arg] for arg in arg_names if arg in recorded}
+            with span(name, cat, **span_args) as sp_args:
+                res = func(*args, **kwargs)
+                sp_args['rc'] = _status(res)
+                return res
+        return wrapper
+    return decorator
+
+def trace_events():
+    '''
+    Return the recorded spans plus the process/thread names metadata,
+    loadable in chrome://tracing or Perfetto
+
+    Args:
+        return: Chrome trace-event format dict
+    '''
+    pid = os.getpid()
+    with _EVENTS_LOCK:
+        events = list(_EVENTS or [])
+        thread_names = dict(_THREAD_NAMES)
+    meta = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+             'args': {'name': 'pcli'}}]
+    meta += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+              'args': {'name': thread_name}}
+             for tid, thread_name in thread_names.items()]
+    return {'traceEvents': meta + sorted(events, key=lambda e: e['ts']),
+            'displayTimeUnit': 'ms'}
@@ -0,0 +1,209 @@
+import hashlib
+import io
+import logging
+import os
+import shlex
+import subprocess
+import tarfile
+import threading
+
+import tracing as trc
+import utils as utl
+
+
+logger = logging.getLogger(__name__)
+
+# bytes read at a time when hashing local files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def local_digest(path):
+    '''
+    Return the sha256 of a local file
+
+    Args:
+        param1: file path
+        return: hex digest (`None` if not found)
+    '''
+    sha = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f_in:
+            for chunk in iter(lambda: f_in.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+    except OSError:
+        return None
+    return sha.hexdigest()
+
+def remote_digests(node_name, rem_paths):
+    '''
+    Return the sha256 of remote files (single ssh call, missing files omitted)
+
+    Args:
+        param1: node name
+        param2: remote paths list
+        return: dict remote path -> hex digest
+    '''
+    digests = {}
+
+    def collect(line, stream):
+        if stream == 'stdout' and '  ' in line:
+            digest, path = line.split('  ', 1)
+            digests[path] = digest
+
+    res = utl.run_argv(utl.ssh_argv(node_name)
+                       + ['sha256sum -- ' + ' '.join(shlex.quote(p) for p in rem_paths)
+                          + ' 2>/dev/null'],
+                       on_line=collect)
+    if res['rc'] is None or res['rc'] == 255:
+        raise RuntimeError(f'{node_name}: unable to hash remote files\n{res["output"]}')
+    return digests
+
+def build_archive(entries):
+    '''
+    Build an in-memory gzip tar of local files, every member named after
+    its remote path (mode and mtime preserved)
+
+    Args:
+        param1: list of (local path, remote path)
+        return: archive bytes
+    '''
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for loc_path, rem_path in entries:
+            tar_info = tar.gettarinfo(loc_path)
+            tar_info.name = rem_path
+            tar_info.uid = tar_info.gid = 0
+            tar_info.uname = tar_info.gname = ''
+            with open(loc_path, 'rb') as f_in:
+                tar.addfile(tar_info, f_in)
+    return buf.getvalue()
+
+def push_files(node_name, manifest, cache=None):
+    '''
+    Send local files to a node as a single tar stream, skipping the ones
+    whose remote copy already has the same sha256
+
+    Args:
+        param1: node name
+        param2: list of (local path, remote path)
+        param3: [optional] local digests and archives cache shared between
+                nodes (see `push_to_nodes`)
+        return: dict w/ sent and skipped remote paths, archive bytes
+    '''
+    if cache is None:
+        cache = {'lock': threading.Lock(), 'digests': {}, 'archives': {}}
+    with cache['lock']:
+        for loc, _ in manifest:
+            if loc not in cache['digests']:
+                cache['digests'][loc] = local_digest(loc)
+    missing = [loc for loc, _ in manifest if cache['digests'][loc] is None]
+    if missing:
+        raise RuntimeError(f'local files not found: {", ".join(missing)}')
+    rem_digests = remote_digests(node_name, [rem for _, rem in manifest])
+    entries = tuple((loc, rem) for loc, rem in manifest
+                    if rem_digests.get(rem) != cache['digests'][loc])
+    sent = [rem for _, rem in entries]
+    skipped = [rem for _, rem in manifest if rem not in sent]
+    if not entries:
+        return {'sent': [], 'skipped': skipped, 'bytes': 0}
+    with cache['lock']:
+        if entries not in cache['archives']:
+            cache['archives'][entries] = build_archive(entries)
+        archive = cache['archives'][entries]
+    # `-P`: members keep their absolute names, relative ones land in $HOME
+    proc = subprocess.run(utl.ssh_argv(node_name) + ['tar -xzpPf - --no-same-owner'],
+                          input=archive,
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f'{node_name}: tar extraction failed (exit code {proc.returncode})\n'
+                           f'{proc.stderr.decode(errors="replace").strip()}')
+    return {'sent': sent, 'skipped': skipped, 'bytes': len(archive)}
+
+def pull_files(node_name, manifest):
+    '''
+    Fetch remote files from a node as a single tar stream, skipping the
+    ones whose local copy already has the same sha256
+    Every file is written to a temp file and then moved in place
+
+    Args:
+        param1: node name
+        param2: list of (local path, remote path)
+        return: dict w/ received and skipped remote paths, received bytes
+    '''
+    rem_digests = remote_digests(node_name, [rem for _, rem in manifest])
+    missing = [rem for _, rem in manifest if rem not in rem_digests]
+    if missing:
+        raise RuntimeError(f'{node_name}: remote files not found: {", ".join(missing)}')
+    entries = {rem: loc for loc, rem in manifest if local_digest(loc) != rem_digests[rem]}
+    skipped = [rem for _, rem in manifest if rem not in entries]
+    if not entries:
+        return {'sent': [], 'skipped': skipped, 'bytes': 0}
+    proc = subprocess.Popen(utl.ssh_argv(node_name)
+                            + ['tar -czPf - -- ' + ' '.join(shlex.quote(r) for r in entries)],
+                            stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    received = []
+    received_bytes = 0
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode='r|gz') as tar:
+            for member in tar:
+                loc_path = entries.get(member.name)
+                if loc_path is None or not member.isfile():
+                    continue
+                loc_dir = os.path.dirname(os.path.abspath(loc_path))
+                os.makedirs(loc_dir, exist_ok=True)
+                tmp_path = f'{loc_path}.partial'
+                with open(tmp_path, 'wb') as f_out:
+                    f_in = tar.extractfile(member)
+                    for chunk in iter(lambda: f_in.read(HASH_CHUNK_SIZE), b''):
+                        f_out.write(chunk)
+                os.chmod(tmp_path, member.mode)
+                os.replace(tmp_path, loc_path)
+                received.append(member.name)
+                received_bytes += member.size
+    except tarfile.TarError as exc:
+        raise RuntimeError(f'{node_name}: invalid tar stream\n{exc}')
+    finally:
+        proc.stdout.close()
+        rc = proc.wait()
+    if rc != 0 or len(received) != len(entries):
+        raise RuntimeError(f'{node_name}: tar stream failed (exit code {rc})')
+    return {'sent': received, 'skipped': skipped, 'bytes': received_bytes}
+
+@trc.traced('transfer', label_arg='node_name', arg_names=('node_name', 'to_node'))
+def transfer_files(node_name, manifest, to_node=False):
+    '''
+    Transfer a manifest of files to/from a node in one tar stream over the
+    node's ssh master connection (`to_node=True` so send)
+    Files already up to date on the destination (same sha256) are skipped
+
+    Args:
+        param1: node name
+        param2: list of (local path, remote path)
+        param3: [optional] send files to node
+        return: dict w/ transferred and skipped remote paths, bytes
+                (raise RuntimeError on failure)
+    '''
+    if to_node is True:
+        res = push_files(node_name, manifest)
+    else:
+        res = pull_files(node_name, manifest)
+    logger.info(f'{node_name}: {len(res["sent"])} files transferred, '
+                f'{len(res["skipped"])} up to date, {res["bytes"]} bytes')
+    return res
+
+def push_to_nodes(node_names, manifest, parallel):
+    '''
+    Fan out the same files to many nodes, at most `parallel` at a time
+    Nodes needing the same subset of files share the same archive
+
+    Args:
+        param1: node names list
+        param2: list of (local path, remote path)
+        param3: max concurrent nodes
+        return: dict node name -> result dict (or the raised exception)
+    '''
+    cache = {'lock': threading.Lock(), 'digests': {}, 'archives': {}}
+    return utl.run_parallel(lambda node_name: push_files(node_name, manifest, cache),
+                            node_names, parallel)
@@ -1,14 +1,17 @@
+import collections
 import json
 import logging
 import os
-import pickle
 import random
+import selectors
 import string
 import subprocess
-import yaml
-from tqdm import tqdm
-import random_name
+import sys
+import threading
+import time
 
+import inventory as inv
+import tracing as trc
 from client_config import CLI_CONFIG
 
 
@@ -16,6 +19,15 @@ __version__ = '0.1-1'
 
 logger = logging.getLogger(__name__)
 
+# max bytes buffered for a single output line (see `run_argv`)
+RUN_MAX_LINE = 64 * 1024
+
+# nodes w/ an open ssh master connection (see `open_ssh_master`)
+_SSH_MASTERS = set()
+_SSH_MASTERS_LOCKS = {}
+# serializes the read-modify-write of the instance state file
+_INST_STATE_LOCK = threading.Lock()
+
 def print_err_str(err_str):
     '''
     Return red-colored string for errors
@@ -48,9 +60,106 @@ def check_for_pcli_updates(args):
           'https://github.com/provable-things/pnetwork-node-cli/tree/master '
           'for updates')
 
+def ssh_control_socket(node_name):
+    '''
+    Return the path of the ssh master connection socket of a node
+
+    Args:
+        param1: node name
+        return: control socket path
+    '''
+    return f'{CLI_CONFIG["ssh_control_path"]}{node_name}.sock'
+
+@trc.traced('ssh', arg_names=('node_name',))
+def open_ssh_master(node_name, pub_ip):
+    '''
+    Open (or reuse) the persistent ssh master connection to a node
+    The master stays alive `ssh_control_persist` after its last use, so
+    consecutive pcli runs reuse it too. If it can't be opened, ssh and scp
+    calls fall back to a direct connection
+
+    Args:
+        param1: node name
+        param2: public ip
+        return: `True` if the master connection is up
+    '''
+    if pub_ip == 'unknown ip':
+        return False
+    with _SSH_MASTERS_LOCKS.setdefault(node_name, threading.Lock()):
+        if node_name in _SSH_MASTERS:
+            return True
+        ctl_socket = ssh_control_socket(node_name)
+        os.makedirs(CLI_CONFIG['ssh_control_path'], mode=0o700, exist_ok=True)
+        if os.path.exists(ctl_socket):
+            check = subprocess.run(['ssh', '-O', 'check', '-o', f'ControlPath={ctl_socket}',
+                                    node_name],
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+            if check.returncode == 0:
+                logger.info(f'Reusing ssh master connection to {node_name}')
+                _SSH_MASTERS.add(node_name)
+                return True
+            os.remove(ctl_socket)
+        priv_key_path = os.path.expanduser(CLI_CONFIG['pcli_ssh_key_path'] + node_name)
+        master = subprocess.run(['ssh', '-f', '-N', '-i', priv_key_path,
+                                 '-o', 'ControlMaster=yes',
+                                 '-o', f'ControlPath={ctl_socket}',
+                                 '-o', f'ControlPersist={CLI_CONFIG["ssh_control_persist"]}',
+                                 '-o', 'BatchMode=yes',
+                                 '-o', 'ConnectTimeout=10',
+                                 '-o', 'ServerAliveInterval=15',
+                                 '-o', 'ServerAliveCountMax=3',
+                                 '-o', 'StrictHostKeyChecking=no',
+                                 '-o', 'UserKnownHostsFile=/dev/null',
+                                 f'{CLI_CONFIG["inst_user"]}@{pub_ip}'],
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        if master.returncode != 0:
+            logger.info(f'Unable to open ssh master connection to {node_name}')
+            return False
+        logger.info(f'ssh master connection to {node_name} opened')
+        _SSH_MASTERS.add(node_name)
+        return True
+
+def close_ssh_master(node_name):
+    '''
+    Close the persistent ssh master connection to a node (if any)
+
+    Args:
+        param1: node name
+    '''
+    ctl_socket = ssh_control_socket(node_name)
+    with _SSH_MASTERS_LOCKS.setdefault(node_name, threading.Lock()):
+        _SSH_MASTERS.discard(node_name)
+        if os.path.exists(ctl_socket):
+            subprocess.run(['ssh', '-O', 'exit', '-o', f'ControlPath={ctl_socket}', node_name],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            if os.path.exists(ctl_socket):
+                os.remove(ctl_socket)
+            logger.info(f'ssh master connection to {node_name} closed')
+
+def ssh_conn(node_name):
+    '''
+    Return ssh/scp options and `user@ip` for a node, going through the
+    node's ssh master connection
+
+    Args:
+        param1: node name
+        return: ssh options string, ssh destination string
+    '''
+    pub_ip = get_pub_ip(node_name)
+    open_ssh_master(node_name, pub_ip)
+    priv_key_path = CLI_CONFIG['pcli_ssh_key_path'] + node_name
+    ssh_args = (f'-i {priv_key_path} -o ControlMaster=no '
+                f'-o ControlPath={ssh_control_socket(node_name)}')
+    return ssh_args, f'{CLI_CONFIG["inst_user"]}@{pub_ip}'
+
 def scp_file(file_rem_path, file_loc_path, node_name, to_node=False):
     '''
-    scp file to/from instance by files path and node name (`to_node=True` so send)
+    Copy file to/from instance by files path and node name (`to_node=True` so send)
+    Single file shortcut of `transfer.transfer_files` (skipped if already up to date)
 
     Args:
         param1: remote file path
@@ -58,106 +167,225 @@ def scp_file(file_rem_path, file_loc_path, node_name, to_node=False):
         param3: node name
         param4: [optional] send file to node
     '''
+    import transfer as trn
     try:
-        pub_ip = get_pub_ip(node_name)
-        priv_key_path = CLI_CONFIG['pcli_ssh_key_path'] + node_name
-        if to_node is True:
-            run_cmd((f'scp -i {priv_key_path} -o StrictHostKeyChecking=no '
-                     '-o UserKnownHostsFile=/dev/null -q '
-                     f'{file_loc_path} {CLI_CONFIG["inst_user"]}@{pub_ip}:{file_rem_path}'))
-        else:
-            run_cmd((f'scp -i {priv_key_path} -q '
-                     f'{CLI_CONFIG["inst_user"]}@{pub_ip}:{file_rem_path} '
-                     f'{file_loc_path}'))
+        trn.transfer_files(node_name, [(file_loc_path, file_rem_path)], to_node=to_node)
     except Exception as exc:
         logger.error(f'scp error on {node_name}\n{exc}')
         print(print_err_str(f'>>> scp error on {node_name}'))
 
-def run_remote_cmd(cmd, node_name, output=False, nowait=False, comm=False):
+def ssh_argv(node_name, tty=False):
     '''
-    Run raw command on remote instance
+    Return the ssh argv (w/o remote command) for a node, going through the
+    node's ssh master connection
+
+    Args:
+        param1: node name
+        param2: [optional] force a remote tty
+        return: argv list
+    '''
+    pub_ip = get_pub_ip(node_name)
+    open_ssh_master(node_name, pub_ip)
+    return (['ssh']
+            + (['-tt', '-q'] if tty is True else [])
+            + ['-i', os.path.expanduser(CLI_CONFIG['pcli_ssh_key_path'] + node_name),
+               '-o', 'ControlMaster=no',
+               '-o', f'ControlPath={ssh_control_socket(node_name)}',
+               f'{CLI_CONFIG["inst_user"]}@{pub_ip}'])
+
+@trc.traced('ssh', label_arg='cmd')
+def run_remote_cmd(cmd, node_name, output=False, nowait=False, comm=False, result=False,
+                   log=False):
+    '''
+    Run raw command on remote instance (`cmd` is run by the remote shell only)
+    Output is streamed line by line to the console (to the pcli log if `log=True`)
+    `output=True` return the stdout (last `run_tail_lines` lines), `None` if
+    the command fails
+    `result=True` return a dict w/ node name, exit code, output, stdout and
+    duration, w/o streaming (ie: for many nodes at once)
 
     Args:
         param1: raw command
         param2: node name
-        return: stdout result string
+        return: result dict (output string if `output=True`)
     '''
-    if output is True:
-        try:
-            pub_ip = get_pub_ip(node_name)
-            priv_key_path = CLI_CONFIG['pcli_ssh_key_path'] + node_name
-            res = run_cmd((f'ssh -i {priv_key_path} '
-                           f'{CLI_CONFIG["inst_user"]}@{pub_ip} '
-                           f'{cmd}'), output=True)
-            return res
-        except Exception as exc:
-            logger.error(f'Error running command {cmd} on {node_name}\n{exc}')
-            print(print_err_str(f'>>> error running command {cmd} on {node_name}'))
-    elif nowait is True:
-        try:
-            pub_ip = get_pub_ip(node_name)
-            priv_key_path = CLI_CONFIG['pcli_ssh_key_path'] + node_name
-            run_cmd((f'ssh -i {priv_key_path} '
-                     f'{CLI_CONFIG["inst_user"]}@{pub_ip} '
-                     f'{cmd}'), nowait=True)
-        except Exception as exc:
-            logger.error(f'Error running command {cmd} on {node_name}\n{exc}')
-            print(print_err_str(f'>>> error running command {cmd} on {node_name}'))
-    elif comm is True:
-        try:
-            pub_ip = get_pub_ip(node_name)
-            priv_key_path = CLI_CONFIG['pcli_ssh_key_path'] + node_name
-            run_cmd((f'ssh -i {priv_key_path} '
-                     f'{CLI_CONFIG["inst_user"]}@{pub_ip} '
-                     f'{cmd}'), comm=True)
-        except Exception as exc:
-            logger.error(f'Error running command {cmd} on {node_name}\n{exc}')
-            print(print_err_str(f'>>> error running command {cmd} on {node_name}'))
-    else:
-        try:
-            pub_ip = get_pub_ip(node_name)
-            priv_key_path = CLI_CONFIG['pcli_ssh_key_path'] + node_name
-            run_cmd(f'ssh -tt -q -i {priv_key_path} '
-                    f'{CLI_CONFIG["inst_user"]}@{pub_ip} {cmd}')
-        except Exception as exc:
-            logger.error(f'Error running command {cmd} on {node_name}\n{exc}')
+    try:
+        if nowait is True:
+            log_f = open(CLI_CONFIG['pcli_log_path'], 'a') if log is True else None
+            try:
+                subprocess.Popen(ssh_argv(node_name) + [cmd], close_fds=True,
+                                 stdin=subprocess.DEVNULL, stdout=log_f,
+                                 stderr=subprocess.STDOUT if log is True else None)
+            finally:
+                if log_f is not None:
+                    log_f.close()
+            logger.info(f'{cmd} started in background on {node_name}')
+            return None
+        if comm is True:
+            return {'rc': subprocess.run(ssh_argv(node_name) + [cmd]).returncode,
+                    'node': node_name}
+        if result is True:
+            res = run_argv(ssh_argv(node_name) + [cmd])
+        elif log is True or output is True:
+            res = run_argv(ssh_argv(node_name) + [cmd],
+                           on_line=line_logger(f'{node_name}: {cmd.split()[0]}') if log is True
+                           else None)
+        else:
+            res = run_argv(ssh_argv(node_name, tty=True) + [cmd],
+                           on_line=(console_line, line_logger(f'{node_name}: {cmd.split()[0]}')),
+                           stdin=None)
+        res['node'] = node_name
+        if res['rc'] != 0 and result is False:
+            logger.error(f'{cmd} on {node_name} returned {res["rc"]}\n{res["output"]}')
+        if output is True and res['rc'] != 0:
             print(print_err_str(f'>>> error running command {cmd} on {node_name}'))
+            return None
+        if output is True:
+            return res['stdout']
+        return res
+    except Exception as exc:
+        logger.error(f'Error running command {cmd} on {node_name}\n{exc}')
+        print(print_err_str(f'>>> error running command {cmd} on {node_name}'))
 
-def run_remote_script(script_path, node_name):
+@trc.traced('ssh', label_arg='script_path', arg_names=('script_path', 'node_name'))
+def run_remote_script(script_path, node_name, result=False):
     '''
-    Run script on remote instance
+    Run script on remote instance, streaming its output to the console
+    `result=True` return a dict w/ node name, exit code, output and duration,
+    w/o streaming (ie: for many nodes at once)
 
     Args:
         param1: script local path
         param2: node name
-        return: stdout result string
+        return: result dict
     '''
     try:
-        pub_ip = get_pub_ip(node_name)
-        priv_key_path = CLI_CONFIG['pcli_ssh_key_path'] + node_name
-        res = run_cmd((f'ssh -i {priv_key_path} '
-                       f'{CLI_CONFIG["inst_user"]}@{pub_ip} '
-                       f'bash -s < {script_path}'), output=True)
+        with open(script_path, 'rb') as f_script:
+            res = run_argv(ssh_argv(node_name) + ['bash', '-s'],
+                           on_line=None if result is True else console_line,
+                           stdin=f_script)
+        res['node'] = node_name
         return res
     except Exception as exc:
         logger.error(f'Error running script {script_path} on {node_name}\n{exc}')
         print(print_err_str(f'>>> error running script {script_path} on {node_name}'))
 
-def run_cmd(cmd, output=False, nowait=False, noerr=False, comm=False):
+def console_line(line, stream):
     '''
-    Run command on host, if `output=True` return stdout result
+    `run_argv` callback: print the line on the console
+
+    Args:
+        param1: output line
+        param2: stream name (stdout or stderr)
+    '''
+    print(line, file=sys.stderr if stream == 'stderr' else sys.stdout, flush=True)
+
+def line_logger(prefix):
+    '''
+    Return a `run_argv` callback writing every line in the pcli log
+
+    Args:
+        param1: line prefix (ie: command)
+        return: callback
+    '''
+    def log_line(line, stream):
+        logger.info(f'{prefix}: {line}')
+    return log_line
+
+@trc.traced('cmd', label_arg='argv', arg_names=('argv', 'cwd'))
+def run_argv(argv, on_line=None, cwd=None, env=None, stdin=subprocess.DEVNULL, tail_lines=None):
+    '''
+    Run a command (argv list, no shell) streaming stdout and stderr line by
+    line to the `on_line(line, stream)` callback(s) as soon as they are written
+    Only the last `tail_lines` lines (and at most `RUN_MAX_LINE` bytes per
+    line) are kept in memory, whatever the command output size, both for
+    the whole output and for stdout alone (what parsers should read: ssh
+    warnings and such land on stderr)
+
+    Args:
+        param1: argv list
+        param2: [optional] callback or list of callbacks (ie: `console_line`,
+                `line_logger(...)`, `collected.append`)
+        param3: [optional] working dir
+        param4: [optional] environment (default inherited)
+        param5: [optional] stdin (default /dev/null, `None` to inherit)
+        param6: [optional] output lines kept (default `run_tail_lines`)
+        return: dict w/ exit code, output (last lines, stdout and stderr), stdout
+                (last stdout lines), duration, lines count and `truncated`
+                (`True` if lines were dropped)
+    '''
+    callbacks = [] if on_line is None else list(on_line) if isinstance(on_line, (list, tuple)) \
+        else [on_line]
+    tail = collections.deque(maxlen=tail_lines or CLI_CONFIG['run_tail_lines'])
+    stdout_tail = collections.deque(maxlen=tail.maxlen)
+    lines_nr = 0
+    start_time = time.monotonic()
+
+    def emit(raw_line, stream):
+        nonlocal lines_nr
+        line = raw_line.decode('utf-8', 'replace').rstrip('\r')
+        lines_nr += 1
+        tail.append(line)
+        if stream == 'stdout':
+            stdout_tail.append(line)
+        for callback in callbacks:
+            callback(line, stream)
+
+    try:
+        proc = subprocess.Popen(argv, cwd=cwd, env=env, stdin=stdin,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as exc:
+        logger.error(f'Error running command {argv}\n{exc}')
+        return {'rc': None, 'output': str(exc), 'stdout': '',
+                'duration': time.monotonic() - start_time, 'lines': 0, 'truncated': False}
+    partial = {'stdout': b'', 'stderr': b''}
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ, 'stdout')
+        selector.register(proc.stderr, selectors.EVENT_READ, 'stderr')
+        while selector.get_map():
+            for key, _ in selector.select():
+                stream = key.data
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    if partial[stream]:
+                        emit(partial[stream], stream)
+                    continue
+                *complete, partial[stream] = (partial[stream] + chunk).split(b'\n')
+                for raw_line in complete:
+                    emit(raw_line, stream)
+                if len(partial[stream]) > RUN_MAX_LINE:
+                    emit(partial[stream], stream)
+                    partial[stream] = b''
+    rc = proc.wait()
+    return {'rc': rc,
+            'output': '\n'.join(tail),
+            'stdout': '\n'.join(stdout_tail),
+            'duration': time.monotonic() - start_time,
+            'lines': lines_nr,
+            'truncated': lines_nr > len(tail)}
+
+@trc.traced('cmd', label_arg='cmd', arg_names=('cmd',))
+def run_cmd(cmd, output=False, nowait=False, noerr=False, comm=False, result=False):
+    '''
+    Run shell command on host, if `output=True` return its output (stdout and stderr)
+    `result=True` return a dict w/ exit code, output (stdout and stderr) and duration
+    (prefer `run_argv` when no shell feature is needed)
 
     Args:
         param1: command
-        return: stdout result (if `output=True`)
+        return: stdout result (if `output=True`), result dict (if `result=True`),
+                `True` if succeeded / `False` if not (default mode)
     '''
+    if result is True:
+        return run_argv(['/bin/sh', '-c', cmd])
     if output is True:
-        try:
-            res = subprocess.check_output(cmd, shell=True)
-            return res.decode('utf-8').rstrip()
-        except Exception as exc:
-            logger.error(f'Error running command {cmd}\n{exc}')
-            print(print_err_str(f'>>> error running command {cmd}'))
+        res = run_argv(['/bin/sh', '-c', cmd])
+        if res['rc'] == 0:
+            return res['output']
+        logger.error(f'Error running command {cmd}\n{res["output"]}')
+        print(print_err_str(f'>>> error running command {cmd}'))
     elif nowait is True:
         try:
             subprocess.Popen(cmd, close_fds=True, shell=True)
@@ -179,10 +407,11 @@ def run_cmd(cmd, output=False, nowait=False, noerr=False, comm=False):
     else:
         try:
             subprocess.run(cmd, shell=True, check=True)
-            return None
+            return True
         except Exception as exc:
             logger.error(f'Error running command {cmd}\n{exc}')
             print(print_err_str(f'>>> error running command {cmd}'))
+            return False
 
 def reboot_system(node_name):
     '''
@@ -191,45 +420,95 @@ def reboot_system(node_name):
     Args:
        param1: node name
     '''
+    from tqdm import tqdm
     logger.info('Rebooting system')
     tqdm.write('>>> rebooting system')
     run_remote_cmd('sudo shutdown -r +1 > /dev/null 2> /dev/null', node_name)
+    close_ssh_master(node_name)
 
-def get_inst_list(nodes_nr=False, single_node=False):
+def get_inst_list(nodes_nr=False, single_node=False, names=False):
     '''
     Print list of active nodes (name: IP)
     Find folders in path which are not the defaults
     `nodes_nr=True` return nr of nodes
     `single_node=True` return single node name
+    `names=True` return node names list
 
     Args:
         param1: [optional] return nr of nodes
         param2: [optional] return single node name
+        param3: [optional] return node names list
     '''
-    tf_form_dir = os.path.abspath(
-                      os.path.expanduser(
-                          os.path.expandvars(CLI_CONFIG['tf_config_dir'])))
-    for root, dirs, files in os.walk(tf_form_dir):
-        # Get dirs with depth=1
-        if root[len(tf_form_dir):].count(os.sep) < 1:
-            n_list = dirs
+    n_list = list(inv.list_nodes())
+    if names is True:
+        return n_list
     if nodes_nr is False and single_node is False:
         if len(n_list) == 0:
             logger.info('No active nodes')
             print('>>> no active nodes')
         else:
+            node_ips = run_parallel(get_pub_ip, n_list, CLI_CONFIG['fleet_parallel'])
             for node in n_list:
-                node_ip = get_pub_ip(node)
-                logger.info(f'{node}: {node_ip} listed')
-                print(f'>>> {node}: {node_ip}')
+                logger.info(f'{node}: {node_ips[node]} listed')
+                print(f'>>> {node}: {node_ips[node]}')
     elif single_node is True:
         return n_list[0]
     else:
         return len(n_list)
 
+def select_nodes(args):
+    '''
+    Return the node names selected by `--all` or by a comma-separated `-n`
+    (exit if a selected node is not found, or if `--all` finds no node)
+
+    Args:
+        param1: CLI args
+        return: node names list
+    '''
+    active_nodes = get_inst_list(names=True)
+    if args.all_nodes is True and not active_nodes:
+        logger.info('No active nodes')
+        print('>>> no active nodes')
+        sys.exit(1)
+    if args.all_nodes is True:
+        return active_nodes
+    node_names = [n.strip() for n in args.node_name.split(',') if n.strip()]
+    unknown_nodes = [n for n in node_names if n not in active_nodes]
+    if unknown_nodes:
+        logger.error(f'Nodes not found: {", ".join(unknown_nodes)}')
+        print(print_err_str(f'>>> nodes not found: {", ".join(unknown_nodes)}'))
+        sys.exit(1)
+    return list(dict.fromkeys(node_names))
+
+def run_parallel(func, items, parallel):
+    '''
+    Run `func(item)` for every item on a pool of (max) `parallel` threads
+
+    Args:
+        param1: function to run
+        param2: items list
+        param3: max concurrent calls
+        return: dict item -> func result (or the raised exception)
+    '''
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    results = {}
+    if not items:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(items))),
+                            thread_name_prefix='pcli') as pool:
+        futures = {pool.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as exc:
+                logger.error(f'Error on {futures[future]}\n{exc}')
+                results[futures[future]] = exc
+    return results
+
 def get_pub_ip(node_name):
     '''
-    Return nodes's public IP via `terraform output` using the proper state file
+    Return nodes's public IP reading the node's terraform state file
+    (parsed state is cached until the file changes)
     If error, returns `unknown ip`
 
     Args:
@@ -238,57 +517,66 @@ def get_pub_ip(node_name):
     '''
     logger.info('Asking for instances\'s public ip')
     try:
-        tf_state_path = CLI_CONFIG['tf_state_path'] + node_name + '/terraform.tfstate'
-        ip_name = run_cmd(f'terraform output -json -state={tf_state_path}',
-                          output=True)
-        return json.loads(ip_name)['public_ip']['value'][0]
+        pub_ip = inv.get_node_info(node_name)['public_ip']
+        if pub_ip is None:
+            logger.error(f'No public IP found in {node_name} terraform state')
+            return 'unknown ip'
+        return pub_ip
     except Exception as exc:
-        logger.error(f'Error parsing public IP from terraform-output\n{exc}')
+        logger.error(f'Error parsing public IP from terraform state\n{exc}')
         return 'unknown ip'
 
-def read_file(file_path, yaml_f=False, state=False):
+def read_file(file_path, yaml_f=False, json_f=False):
     '''
     Read file from path and return its content
-    Works also for yaml and pickle
+    Works also for yaml and json
 
     Args:
         param1: file path
         param2: [optional] yaml format
-        param3: [optional] pickle format
+        param3: [optional] json format
         return: file content
     '''
     try:
+        if json_f is True:
+            with open(file_path) as f_json:
+                json_file = json.load(f_json)
+            return json_file
         if yaml_f is True:
+            import yaml
             with open(file_path) as f_yaml:
                 yaml_file = yaml.safe_load(f_yaml)
             return yaml_file
-        if state is True:
-            with open(file_path, 'rb') as f_state:
-                state_file = pickle.load(f_state)
-            return state_file
     except Exception as exc:
         logger.error(f'Error while loading {file_path}\n{exc}')
         print(print_err_str('>>> error while loading {file_path}'))
 
-def write_file(file_content, dest_path, file_list=False, state=False):
+def write_file(file_content, dest_path, file_list=False, json_f=False):
     '''
     Write data on a given path as file
-    Works also for lists and pickle files
+    Works also for lists and json
+    `json_f=True` replace the file atomically w/ the json dump of the content
+    (readable by the owner only)
 
     Args:
         param1: file content
         param2: destination path
         param3: [optional] list format
-        param4: [optional] pickle format
+        param4: [optional] json format
     '''
     try:
-        if file_list is True:
+        if json_f is True:
+            tmp_path = f'{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f_json:
+                json.dump(file_content, f_json)
+                f_json.flush()
+                os.fsync(f_json.fileno())
+            os.replace(tmp_path, dest_path)
+        elif file_list is True:
             with open(dest_path, 'a') as f_list:
                 for row in file_content:
                     f_list.write(row)
-        elif state is True:
-            with open(dest_path, 'ab') as f_state:
-                pickle.dump(file_content, f_state)
         else:
             with open(dest_path, 'a') as f_gen:
                 f_gen.write(file_content)
@@ -297,6 +585,52 @@ def write_file(file_content, dest_path, file_list=False, state=False):
         logger.error(f'Error while writing {dest_path}\n{exc}')
         print(print_err_str('>>> error while writing {dest_path}'))
 
+def read_inst_state(node_name):
+    '''
+    Return the inputs saved by an interrupted node configuration: the
+    node's own ones, or else the last saved ones
+    The state file holds one entry per node (overwritten, never appended)
+    plus the `last` node name, so it doesn't grow w/ the sessions
+
+    Args:
+        param1: node name
+        return: node name the inputs were saved for, saved inputs dict
+                (`None, None` if not found)
+    '''
+    if not os.path.isfile(CLI_CONFIG['inst_state_path']):
+        return None, None
+    inst_state = read_file(CLI_CONFIG['inst_state_path'], json_f=True) or {}
+    nodes = inst_state.get('nodes', {})
+    state_node = node_name if node_name in nodes else inst_state.get('last')
+    if state_node not in nodes:
+        return None, None
+    return state_node, nodes[state_node]
+
+def save_inst_state(node_name, inputs=None):
+    '''
+    Save (replace) the inputs of a node configuration in the state file,
+    atomically (`inputs=None` to drop the node entry)
+
+    Args:
+        param1: node name
+        param2: [optional] inputs dict
+    '''
+    state_path = CLI_CONFIG['inst_state_path']
+    with _INST_STATE_LOCK:
+        inst_state = {}
+        if os.path.isfile(state_path):
+            inst_state = read_file(state_path, json_f=True) or {}
+        nodes = inst_state.setdefault('nodes', {})
+        if inputs is None:
+            nodes.pop(node_name, None)
+            if inst_state.get('last') == node_name:
+                inst_state['last'] = None
+        else:
+            nodes[node_name] = inputs
+            inst_state['last'] = node_name
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        write_file(inst_state, state_path, json_f=True)
+
 def check_for_file_in_path(file_name, path, isdir=False, no_stdout=False):
     '''
     Check for file in a given path
@@ -308,6 +642,7 @@ def check_for_file_in_path(file_name, path, isdir=False, no_stdout=False):
         param4: [optional] disable stdout
         return: `True` if found, `False` if not
     '''
+    from tqdm import tqdm
     if isdir is True:
         if os.path.isdir(f'{path}{file_name}'):
             logger.info(f'{path}{file_name} found')
@@ -419,6 +754,7 @@ def random_pwd_generator():
     Args:
         return: generated pwd
     '''
+    from tqdm import tqdm
     pwd_chars = string.ascii_letters + string.digits
     pwd = ''.join(random.choice(pwd_chars) for i in range(36))
     logging.info('Random password generated')
@@ -432,6 +768,7 @@ def random_name_generator():
     Args:
         return: generated name
     '''
+    import random_name
     node_name = random_name.generate_name().split('-', 1)[1]
     logging.info('Random instance name generated')
     logging.info(f'Instance name: {node_name}')